@@ -0,0 +1,136 @@
+'''
+Column-named loader of the datasets in ../data and the result store.
+
+A dataset is a dict of NumPy arrays keyed by the lower-cased csv column,
+so 'ENRE-old-time' becomes 'enre-old-time' as in the `tools` of pre.py and
+pre2.py, plus 'loc', 'stars' (if present) and 'project_name'. Every array
+has one entry per project, a cell that is empty or holds an error
+indicator (0 or -1) is NaN rather than left out, so columns never get out
+of line with each other. Values are in the units of the file (seconds, MB).
+
+Parsed datasets are saved to ./intermediate/<name>.npz along with the mtime
+and size of their source, and reused until the source changes. They are
+also kept in memory, so processes forked after a `load` (see render.py)
+don't load them again.
+'''
+
+import os
+import csv
+import sys
+import numpy as np
+
+
+DATA_DIR = '../data'
+CACHE_DIR = './intermediate'
+STORE_PATH = '../../records/results.sqlite'
+
+# name -> (source stamp, data)
+_loaded = dict()
+
+
+def _columns(header, rows):
+    data = dict()
+    for index, column in enumerate(header):
+        key = 'loc' if column == 'LoC' else column.lower()
+        values = [row[index] if index < len(row) else '' for row in rows]
+        if key == 'project_name':
+            data[key] = np.array(values, dtype=str)
+            continue
+        array = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                array[i] = float(value)
+            except ValueError:
+                # Empty cells mean not measured
+                pass
+        # Error indicators of records files, 0 for not run and -1 for failed
+        array[array <= 0] = np.nan
+        data[key] = array
+    return data
+
+
+def read_csv(filepath):
+    '''Parse a dataset csv, see the module docstring.'''
+    # Using 'sig' to suppress the BOM generated by Excel
+    with open(filepath, 'r', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = [row for row in reader if len(row) != 0]
+    return _columns(header, rows)
+
+
+def read_store(lang, store_path=STORE_PATH):
+    '''Read the latest results of `lang` from the result store, in the same layout as `read_csv`.'''
+    # The store lives in the harness' utils package two levels up
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    from utils.store import ResultStore
+
+    store = ResultStore(store_path)
+    try:
+        table = store.table(lang)
+    finally:
+        store.close()
+    header = ['project_name', 'LoC']
+    for row in table:
+        header += [column for column in row if column not in header and column != 'revision']
+    rows = [[str(row.get(column, '')) for column in header] for row in table]
+    return _columns(header, rows)
+
+
+def _cached(name, source, read):
+    stat = os.stat(source)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size])
+    if name in _loaded and np.array_equal(_loaded[name][0], stamp):
+        return _loaded[name][1]
+    cache_path = os.path.join(CACHE_DIR, f'{name}.npz')
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached['__source__'], stamp):
+                    data = {key: cached[key] for key in cached.files if key != '__source__'}
+                    _loaded[name] = (stamp, data)
+                    return data
+        except (EnvironmentError, ValueError, KeyError):
+            pass
+    data = read()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, __source__=stamp, **data)
+    os.replace(tmp_path, cache_path)
+    _loaded[name] = (stamp, data)
+    return data
+
+
+def load(lang, store_path=None):
+    '''
+    Load the dataset of `lang` from ../data/<lang>.csv, or from the result
+    store at `store_path` if given. Raises EnvironmentError if there is none.
+    '''
+    if store_path is not None:
+        return _cached(f'store-{lang}', store_path, lambda: read_store(lang, store_path))
+    filepath = os.path.join(DATA_DIR, f'{lang}.csv')
+    return _cached(lang, filepath, lambda: read_csv(filepath))
+
+
+def select(data, tools, metrics, logloc=False):
+    '''
+    Pick the columns of `tools` and `metrics` out of `data` in the layout of
+    `pre.init()`'s collection, memory in GB. Projects without a LoC are left out,
+    `stars` is NaN where the dataset has none (python.csv).
+    '''
+    keep = ~np.isnan(data['loc'])
+    curr = dict()
+    loc = data['loc'][keep]
+    if logloc:
+        curr['loc'] = np.log10(loc)
+    else:
+        curr['loc'] = loc.astype(int)
+    missing = np.full(len(loc), np.nan)
+    for tool in tools:
+        for metric in metrics:
+            values = data.get(f'{tool}-{metric}')
+            values = values[keep] if values is not None else missing.copy()
+            # Convert MB to GB if it's memory data
+            curr[f'{tool}-{metric}'] = values / 1024 if metric == 'memory' else values
+    curr['stars'] = data['stars'][keep] if 'stars' in data else missing.copy()
+    return curr
@@ -1,9 +1,10 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import statsmodels.api as sm
-from scipy.optimize import curve_fit
 
 from pre import init
+from output import figure_path
+from fitting import cached_fit
+from outliers import keep
 
 
 collection, tags, mode, langs, tools, metrics = init()
@@ -20,79 +21,17 @@ def xlabel_formatter(x, pos):
         return '{:.1f}'.format(x / 10**3) + 'K'
 
 
-def filter_time(lang, loc, subject, tool=None):
-    indices = []
-    for index, value in enumerate(subject):
-        # Remove NaN points
-        if np.isnan(value):
-            indices.append(index)
-        # Remove incorrect points
-        if lang == 'java':
-            if value < loc[index] * 100 / (5 * 10 ** 6) - 20:
-                indices.append(index)
-        elif lang == 'cpp':
-            if tool == 'depends':
-                if value < 50 / (5 * 10 ** 5) * loc[index]:
-                    indices.append(index)
-            else:
-                if value < loc[index] * 100 / (5 * 10 ** 6) - 20:
-                    indices.append(index)
-        elif lang == 'python':
-            if tool == 'sourcetrail':
-                if value < 100 / (2 * 10 ** 5) * loc[index]:
-                    indices.append(index)
-            else:
-                if value < 50 / (10**6-5*10**4) * (loc[index]-5*10*4):
-                    indices.append(index)
-        else:
-            pass
-    return np.delete(loc, indices), np.delete(subject, indices)
-
-
-def filter_memory(lang, loc, subject, tool=None):
-    indices = []
-    # Default range
-    range = [0, 3*10**6]
-    for index, value in enumerate(subject):
-        # Remove NaN points
-        if np.isnan(value):
-            indices.append(index)
-        # Only track memory usage from LoC=2W, for all language
-        if loc[index] < 2*10**4:
-            indices.append(index)
-        # Remove abnormal points and assign observation plot range
-        if lang == 'java':
-            if value < 1 / (1 * 10 ** 6) * loc[index]:
-                indices.append(index)
-            if tool == 'depends':
-                range[0] = 1*10**5
-            elif tool == 'understand':
-                range[0] = 10**5
-                if loc[index] < range[0]:
-                    indices.append(index)
-        elif lang == 'cpp':
-            pass
-        elif lang == 'python':
-            if tool == 'enre':
-                if value < 0.5 / (2 * 10 ** 5) * loc[index]:
-                    indices.append(index)
-        else:
-            pass
-    return np.delete(loc, indices), np.delete(subject, indices), np.linspace(range[0], range[1], 1000)
+# The range used by drawing power trend line for 'memory', starts from where data is tracked
+def memory_range(lang, tool):
+    if lang == 'java' and tool in ['depends', 'understand']:
+        return np.linspace(10**5, 3*10**6, 1000)
+    return np.linspace(0, 3*10**6, 1000)
 
 
 # The range used by drawing linear trend line for 'time'
 trendx = np.array([0, 3*10**6])
 
 
-def linear_func(fx, a, b):
-    return a * fx + b
-
-
-def power_func(fx, a, b, c):
-    return a * fx ** b + c
-
-
 def draw(lang, metric, loc, enre, depends, sourcetrail, understand):
     plt.figure(num=f'{lang}-{metric}')
     plt.xlabel('LoC')
@@ -118,54 +57,62 @@ def draw(lang, metric, loc, enre, depends, sourcetrail, understand):
     # ENRE
     e = plt.scatter(loc, enre, linewidths=general_lw, s=general_s, marker=general_m, c=tools['enre'][1])
     if metric == 'time':
-        _loc, _enre = filter_time(lang, loc, enre, 'enre')
-        res = sm.OLS(_enre, _loc).fit()
-        plt.plot(trendx, res.params[0] * trendx, c=tools['enre'][1])
-        print(f'Standard consumption on time for ENRE in {lang} is {res.params[0] * 10**6}s')
-        print(f'R-squared value for ENRE in {lang}-{metric} is {res.rsquared}')
+        mask = keep('time', lang, 'enre', loc, enre)
+        _loc, _enre = loc[mask], enre[mask]
+        res = cached_fit(_loc, _enre, 'proportional')
+        plt.plot(trendx, res(trendx), c=tools['enre'][1])
+        print(f'Standard consumption on time for ENRE in {lang} is {res.params["a"] * 10**6}s')
+        print(f'R-squared value for ENRE in {lang}-{metric} is {res.r2}')
     else:
-        _loc, _enre, _range = filter_memory(lang, loc, enre, 'enre')
-        popt, pcov = curve_fit(power_func, _loc, _enre)
-        plt.plot(_range, popt[0] * _range ** popt[1] + popt[2], c=tools['enre'][1])
+        mask = keep('memory', lang, 'enre', loc, enre)
+        _loc, _enre, _range = loc[mask], enre[mask], memory_range(lang, 'enre')
+        res = cached_fit(_loc, _enre, 'power')
+        plt.plot(_range, res(_range), c=tools['enre'][1])
 
     # Depends
     # d = plt.scatter(loc, depends, linewidths=general_lw, s=general_s, marker=general_m, c=tools['depends'][1])
     # if metric == 'time':
-    #     _loc, _depends = filter_time(lang, loc, depends, 'depends')
-    #     res = sm.OLS(_depends, _loc).fit()
-    #     plt.plot(trendx, res.params[0] * trendx, c=tools['depends'][1])
-    #     print(f'Standard consumption on time for Depends in {lang} is {res.params[0] * 10 ** 6}s')
-    #     print(f'R-squared value for Depends in {lang}-{metric} is {res.rsquared}')
+    #     mask = keep('time', lang, 'depends', loc, depends)
+    #     _loc, _depends = loc[mask], depends[mask]
+    #     res = cached_fit(_loc, _depends, 'proportional')
+    #     plt.plot(trendx, res(trendx), c=tools['depends'][1])
+    #     print(f'Standard consumption on time for Depends in {lang} is {res.params["a"] * 10 ** 6}s')
+    #     print(f'R-squared value for Depends in {lang}-{metric} is {res.r2}')
     # else:
-    #     _loc, _depends, _range = filter_memory(lang, loc, depends, 'depends')
-    #     popt, pcov = curve_fit(power_func, _loc, _depends)
-    #     plt.plot(_range, popt[0] * _range ** popt[1] + popt[2], c=tools['depends'][1])
+    #     mask = keep('memory', lang, 'depends', loc, depends)
+    #     _loc, _depends, _range = loc[mask], depends[mask], memory_range(lang, 'depends')
+    #     res = cached_fit(_loc, _depends, 'power')
+    #     plt.plot(_range, res(_range), c=tools['depends'][1])
 
     # SourceTrail
     # s = plt.scatter(loc, sourcetrail, linewidths=general_lw, s=general_s, marker=general_m, c=tools['sourcetrail'][1])
     # if metric == 'time':
-    #     _loc, _sourcetrail = filter_time(lang, loc, sourcetrail, 'sourcetrail')
-    #     res = sm.OLS(_sourcetrail, _loc).fit()
-    #     plt.plot(trendx, res.params[0] * trendx, c=tools['sourcetrail'][1])
-    #     print(f'Standard consumption on time for SourceTrail in {lang} is {res.params[0] * 10 ** 6}s')
-    #     print(f'R-squared value for SourceTrail in {lang}-{metric} is {res.rsquared}')
+    #     mask = keep('time', lang, 'sourcetrail', loc, sourcetrail)
+    #     _loc, _sourcetrail = loc[mask], sourcetrail[mask]
+    #     res = cached_fit(_loc, _sourcetrail, 'proportional')
+    #     plt.plot(trendx, res(trendx), c=tools['sourcetrail'][1])
+    #     print(f'Standard consumption on time for SourceTrail in {lang} is {res.params["a"] * 10 ** 6}s')
+    #     print(f'R-squared value for SourceTrail in {lang}-{metric} is {res.r2}')
     # else:
-    #     _loc, _sourcetrail, _range = filter_memory(lang, loc, sourcetrail, 'sourcetrail')
-    #     popt, pcov = curve_fit(power_func, _loc, _sourcetrail, maxfev=5000)
-    #     plt.plot(_range, popt[0] * _range ** popt[1] + popt[2], c=tools['sourcetrail'][1])
+    #     mask = keep('memory', lang, 'sourcetrail', loc, sourcetrail)
+    #     _loc, _sourcetrail, _range = loc[mask], sourcetrail[mask], memory_range(lang, 'sourcetrail')
+    #     res = cached_fit(_loc, _sourcetrail, 'power')
+    #     plt.plot(_range, res(_range), c=tools['sourcetrail'][1])
 
     # Understand
     u = plt.scatter(loc, understand, linewidths=general_lw, s=general_s, marker=general_m, c=tools['understand'][1])
     if metric == 'time':
-        _loc, _understand = filter_time(lang, loc, understand, 'understand')
-        res = sm.OLS(_understand, _loc).fit()
-        plt.plot(trendx, res.params[0] * trendx, c=tools['understand'][1])
-        print(f'Standard consumption on time for Understand in {lang} is {res.params[0] * 10 ** 6}s')
-        print(f'R-squared value for Understand in {lang}-{metric} is {res.rsquared}')
+        mask = keep('time', lang, 'understand', loc, understand)
+        _loc, _understand = loc[mask], understand[mask]
+        res = cached_fit(_loc, _understand, 'proportional')
+        plt.plot(trendx, res(trendx), c=tools['understand'][1])
+        print(f'Standard consumption on time for Understand in {lang} is {res.params["a"] * 10 ** 6}s')
+        print(f'R-squared value for Understand in {lang}-{metric} is {res.r2}')
     else:
-        _loc, _understand, _range = filter_memory(lang, loc, understand, 'understand')
-        popt, pcov = curve_fit(power_func, _loc, _understand)
-        plt.plot(_range, popt[0] * _range ** popt[1] + popt[2], c=tools['understand'][1])
+        mask = keep('memory', lang, 'understand', loc, understand)
+        _loc, _understand, _range = loc[mask], understand[mask], memory_range(lang, 'understand')
+        res = cached_fit(_loc, _understand, 'power')
+        plt.plot(_range, res(_range), c=tools['understand'][1])
 
     # if mode == 'view':
     #     plt.title(f'{lang}-{metric}')
@@ -174,7 +121,7 @@ def draw(lang, metric, loc, enre, depends, sourcetrail, understand):
     if mode == 'view':
         plt.show()
     else:
-        plt.savefig(f'G:\\我的云端硬盘\\ASE 2022\\{metric}-{lang}.png')
+        plt.savefig(figure_path(f'{metric}-{lang}.png'))
 
 
 for lang in langs:
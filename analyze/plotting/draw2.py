@@ -4,13 +4,14 @@ from functools import reduce
 from colour import Color
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from matplotlib.collections import LineCollection
 import matplotlib.patheffects as path_effects
 from shapely.geometry import LineString, Point
 
 
 from pre import init
+from output import figure_path
+from fitting import cached_fit
 
 collection, tags, mode, langs, tools, metrics = init()
 
@@ -91,11 +92,8 @@ def draw(lang, original_data):
             time = _time
             memory = _memory
 
-        popt, _ = curve_fit(lambda x, a, b, c: a * x ** b + c,
-                            time,
-                            memory,
-                            # A lower number will cause interation fails on python-st
-                            maxfev=2400 if lang == 'python' and tool == 'sourcetrail' else 800)
+        fit = cached_fit(time, memory, 'power')
+        popt = [fit.params['a'], fit.params['k'], fit.params['b']]
 
         def trend(x):
             return popt[0] * x ** popt[1] + popt[2]
@@ -118,7 +116,8 @@ def draw(lang, original_data):
                 projection.append(pline.project(opoint))
 
             # Calculate the LoC~CurveLength function
-            params, _ = curve_fit(lambda x, a, b: a * x + b, loc, projection)
+            line = cached_fit(loc, projection, 'linear', bootstrap=0)
+            params = [line.params['a'], line.params['b']]
 
             def loc2len(x):
                 return params[0] * x + params[1]
@@ -174,12 +173,7 @@ def draw(lang, original_data):
                  size=10,
                  zorder=100)
 
-        # Calculate R2
-        residuals = memory - trend(time)
-        ss_res = np.sum(residuals ** 2)
-        ss_tot = np.sum((memory - np.mean(memory)) ** 2)
-        r_squared = 1 - (ss_res / ss_tot)
-        print(f'{lang}-{tool}-r2: {r_squared}')
+        print(f'{lang}-{tool}-r2: {fit.r2}')
 
         return trend, trend_inverse, d_trend
 
@@ -227,7 +221,7 @@ def draw(lang, original_data):
         ax.title.set_text(f'performance-{lang}')
         fig.show()
     else:
-        fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-{lang}.png')
+        fig.savefig(figure_path(f'performance-{lang}.png'))
 
 
 for lang in langs:
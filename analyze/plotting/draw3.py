@@ -1,10 +1,11 @@
 from colour import Color
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from shapely.geometry import LineString, Point
 
 from pre import init
+from output import figure_path
+from fitting import cached_fit
 
 collection, tags, mode, langs, tools, metrics = init()
 
@@ -92,11 +93,8 @@ def draw(lang, original_data):
             time = _time
             memory = _memory
 
-        popt, _ = curve_fit(lambda x, a, b, c: a * x ** b + c,
-                            time,
-                            memory,
-                            # A lower number will cause interation fails on python-st
-                            maxfev=2400)
+        fit = cached_fit(time, memory, 'power')
+        popt = [fit.params['a'], fit.params['k'], fit.params['b']]
 
         def trend(x):
             return popt[0] * x ** popt[1] + popt[2]
@@ -119,7 +117,8 @@ def draw(lang, original_data):
                 projection.append(pline.project(opoint))
 
             # Calculate the LoC~CurveLength function
-            params, _ = curve_fit(lambda x, a, b: a * x + b, loc, projection)
+            line = cached_fit(loc, projection, 'linear', bootstrap=0)
+            params = [line.params['a'], line.params['b']]
 
             def loc2len(x):
                 return params[0] * x + params[1]
@@ -179,12 +178,7 @@ def draw(lang, original_data):
                  zorder=99)
         print(f'{lang}-{tool}-1mloc: {mx}, {my}')
 
-        # Calculate R2
-        residuals = memory - trend(time)
-        ss_res = np.sum(residuals ** 2)
-        ss_tot = np.sum((memory - np.mean(memory)) ** 2)
-        r_squared = 1 - (ss_res / ss_tot)
-        print(f'{lang}-{tool}-r2: {r_squared}')
+        print(f'{lang}-{tool}-r2: {fit.r2}')
 
         return trendline
 
@@ -259,7 +253,7 @@ def draw(lang, original_data):
             plt.subplots_adjust(left=0.079, right=0.999, top=0.999, bottom=0.125)
         else:
             plt.subplots_adjust(left=0.096, right=0.999, top=0.999, bottom=0.125)
-        fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-{lang}.png')
+        fig.savefig(figure_path(f'performance-{lang}.png'))
 
 
 for lang in langs:
@@ -1,11 +1,12 @@
 from colour import Color
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from shapely.geometry import LineString, Point
 from matplotlib.lines import Line2D
 
 from pre import init
+from output import figure_path
+from fitting import cached_fit
 
 collection, tags, mode, langs, tools, metrics = init()
 
@@ -93,11 +94,8 @@ for il, lang in enumerate(langs):
             time = _time
             memory = _memory
 
-        popt, _ = curve_fit(lambda x, a, b, c: a * x ** b + c,
-                            time,
-                            memory,
-                            # A lower number will cause interation fails on python-st
-                            maxfev=2400)
+        fit = cached_fit(time, memory, 'power')
+        popt = [fit.params['a'], fit.params['k'], fit.params['b']]
 
         def trend(x):
             return popt[0] * x ** popt[1] + popt[2]
@@ -120,7 +118,8 @@ for il, lang in enumerate(langs):
                 projection.append(pline.project(opoint))
 
             # Calculate the LoC~CurveLength function
-            params, _ = curve_fit(lambda x, a, b: a * x + b, loc, projection)
+            line = cached_fit(loc, projection, 'linear', bootstrap=0)
+            params = [line.params['a'], line.params['b']]
 
             def loc2len(x):
                 return params[0] * x + params[1]
@@ -180,11 +179,7 @@ for il, lang in enumerate(langs):
                      zorder=99)
         print(f'{lang}-{tool}-1mloc: {round(mx, 1)}, {round(my, 1)}')
 
-        # Calculate R2
-        residuals = memory - trend(time)
-        ss_res = np.sum(residuals ** 2)
-        ss_tot = np.sum((memory - np.mean(memory)) ** 2)
-        r_squared = 1 - (ss_res / ss_tot)
+        r_squared = fit.r2
         print(f'{lang}-{tool}-r2: {round(r_squared, 1)}')
 
         return trendline, (r_squared, mx, my)
@@ -288,4 +283,4 @@ plt.subplots_adjust(left=0.035, right=0.996, top=0.999, bottom=0.15)
 if mode == 'view':
     fig.show()
 else:
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-all.png')
+    fig.savefig(figure_path('performance-all.png'))
@@ -5,6 +5,7 @@ import matplotlib.patches as pch
 import math
 
 from pre2 import init
+from output import figure_path
 
 collection, tags, mode, langs, tools, metrics = init()
 features = [{'key': 'time', 'text': 'Completion Time (s)', 'settings': {'xlim0': 25, 'xlim1': 600}},
@@ -284,4 +285,4 @@ for inf, feature in enumerate(features):
 if mode == 'view':
     fig.show()
 else:
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-python-v2.png')
+    fig.savefig(figure_path('performance-python-v2.png'))
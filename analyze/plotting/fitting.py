@@ -0,0 +1,316 @@
+'''
+Scaling models of time / memory against LoC (or of memory against time),
+shared by the draw*.py scripts.
+
+Every model is linear in its coefficients once a shape parameter is fixed:
+
+    proportional  y = a * x
+    linear        y = a * x + b
+    nlogn         y = a * x * log(x) + b
+    power         y = a * x ** k + b          k from a grid
+    piecewise     y = a * x + b + c * max(0, x - k)   breakpoint k from a grid
+
+so a fit is a batch of weighted least squares problems, one per (bootstrap
+sample, grid value), solved at once with numpy instead of one curve_fit
+call per sample that may not converge. Bootstrap samples are multinomial
+weights over the points, the confidence interval of each parameter is the
+percentile interval over samples, and models are compared by AIC.
+
+Fits are cached by the hash of their input and options, one file per fit
+in ./intermediate/fits/, so every figure script gets the same fit of the
+same data without paying for the bootstrap again, and figures rendered by
+parallel processes never overwrite each other's fits.
+'''
+
+import os
+import pickle
+import hashlib
+import numpy as np
+
+
+CACHE_DIR = './intermediate/fits'
+
+# Exponents tried by 'power', refined around the best one of the data
+POWER_GRID = np.linspace(0.05, 3, 60)
+# Quantiles of x tried as the breakpoint of 'piecewise'
+PIECEWISE_GRID = np.linspace(0.1, 0.9, 33)
+# Residuals computed at once by `_solve`, 32MB of floats
+RESIDUALS = 4 * 1024 * 1024
+
+
+def _proportional(x, grid):
+    return x[None, :, None], None
+
+
+def _linear(x, grid):
+    return np.stack([x, np.ones_like(x)], axis=-1)[None], None
+
+
+def _nlogn(x, grid):
+    return np.stack([x * np.log(np.maximum(x, 1)), np.ones_like(x)], axis=-1)[None], None
+
+
+def _power(x, grid):
+    if grid is None:
+        grid = POWER_GRID
+    # x ** k over a large x overflows the normal equations, the scale goes into a
+    scale = x.max()
+    u = x / scale
+    columns = u[None, :] ** grid[:, None]
+    X = np.stack([columns, np.ones_like(columns)], axis=-1)
+    return X, (grid, scale)
+
+
+def _piecewise(x, grid):
+    if grid is None:
+        grid = np.quantile(x, PIECEWISE_GRID)
+    hinge = np.maximum(0, x[None, :] - grid[:, None])
+    X = np.stack([np.broadcast_to(x, hinge.shape), np.ones_like(hinge), hinge], axis=-1)
+    return X, (grid, None)
+
+
+# name -> (design matrix builder, parameter names, has intercept)
+MODELS = {
+    'proportional': (_proportional, ['a'], False),
+    'linear': (_linear, ['a', 'b'], True),
+    'nlogn': (_nlogn, ['a', 'b'], True),
+    'power': (_power, ['a', 'k', 'b'], True),
+    'piecewise': (_piecewise, ['a', 'b', 'c', 'k'], True),
+}
+
+
+def predict(model, params, x):
+    '''Evaluate `model` with `params` (a dict) at `x`.'''
+    x = np.asarray(x, dtype=float)
+    if model == 'proportional':
+        return params['a'] * x
+    if model == 'linear':
+        return params['a'] * x + params['b']
+    if model == 'nlogn':
+        return params['a'] * x * np.log(np.maximum(x, 1)) + params['b']
+    if model == 'power':
+        return params['a'] * x ** params['k'] + params['b']
+    if model == 'piecewise':
+        return params['a'] * x + params['b'] + params['c'] * np.maximum(0, x - params['k'])
+    raise ValueError(f'Unknown model {model}')
+
+
+def _solve(X, y, weights):
+    '''
+    Weighted least squares for every (sample, grid value).
+
+    X: (G, n, p) design matrices, y: (n,), weights: (B, n)
+    Returns coefficients (B, G, p) and weighted SSE (B, G).
+    '''
+    # Columns of very different magnitude (x * log x against 1) make the
+    # normal equations ill-conditioned, solve for normalized columns
+    norm = np.abs(X).max(axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    X = X / norm
+    p = X.shape[2]
+    XtWX = np.empty((weights.shape[0], X.shape[0], p, p))
+    for i in range(p):
+        for j in range(i, p):
+            XtWX[:, :, i, j] = XtWX[:, :, j, i] = weights @ (X[:, :, i] * X[:, :, j]).T
+    XtWy = np.stack([weights @ (X[:, :, i] * y).T for i in range(p)], axis=-1)
+    # pinv, since a breakpoint past every sampled point leaves a column of zeros
+    beta = (np.linalg.pinv(XtWX) @ XtWy[..., None])[..., 0]
+    # Residuals of every (sample, grid value, point) at once take B * G * n floats,
+    # gigabytes for a full dataset, so only as many samples as fit in RESIDUALS at a time
+    sse = np.empty(beta.shape[:2])
+    chunk = max(1, RESIDUALS // (X.shape[0] * X.shape[1]))
+    for start in range(0, beta.shape[0], chunk):
+        residuals = y[None, None, :] - np.einsum('gnp,bgp->bgn', X, beta[start:start + chunk])
+        sse[start:start + chunk] = np.einsum('bn,bgn->bg', weights[start:start + chunk], residuals ** 2)
+    return beta / norm[:, 0, :][None], sse
+
+
+def _params(model, beta, shape, index):
+    # Coefficients of the best grid value as named parameters in the units of x
+    names = MODELS[model][1]
+    if model == 'power':
+        grid, scale = shape
+        k = grid[index]
+        return dict(zip(names, [beta[0] / scale ** k, k, beta[1]]))
+    if model == 'piecewise':
+        return dict(zip(names, list(beta) + [shape[0][index]]))
+    return dict(zip(names, beta))
+
+
+class Fit:
+    '''
+    A model fitted to some data.
+
+    params: parameter -> value, fitted on all points
+    ci: parameter -> (low, high), bootstrap percentile interval
+    aic, r2: of the fit on all points, R2 is uncentered for models without intercept
+    samples: parameter -> array of bootstrap estimates
+    '''
+
+    def __init__(self, model, params, ci, aic, r2, n, samples):
+        self.model = model
+        self.params = params
+        self.ci = ci
+        self.aic = aic
+        self.r2 = r2
+        self.n = n
+        self.samples = samples
+
+    def __call__(self, x):
+        return predict(self.model, self.params, x)
+
+    def band(self, x, confidence=0.95):
+        '''Bootstrap percentile band of the prediction at `x`, as (low, high).'''
+        x = np.asarray(x, dtype=float)
+        count = len(next(iter(self.samples.values())))
+        if count == 0:
+            y = self(x)
+            return y, y
+        predictions = np.stack([
+            predict(self.model, {name: values[i] for name, values in self.samples.items()}, x)
+            for i in range(count)])
+        alpha = (1 - confidence) / 2
+        return np.quantile(predictions, alpha, axis=0), np.quantile(predictions, 1 - alpha, axis=0)
+
+    def __repr__(self):
+        params = ', '.join(f'{name}={value:.4g}' for name, value in self.params.items())
+        return f'Fit({self.model}: {params}, AIC={self.aic:.2f}, R2={self.r2:.4f}, n={self.n})'
+
+
+def fit(x, y, model, bootstrap=1000, confidence=0.95, seed=0):
+    '''
+    Fit `model` (a key of MODELS) to the points (x, y), NaN points are left out.
+
+    `bootstrap` resamples give the confidence intervals, 0 to skip them.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    n = len(x)
+    build, names, intercept = MODELS[model]
+    if n < len(names) + 1:
+        raise ValueError(f'Too few points ({n}) to fit {model}')
+
+    # All points first, so the grid can be refined around its best value
+    X, shape = build(x, None)
+    beta, sse = _solve(X, y, np.ones((1, n)))
+    if model == 'power':
+        grid = shape[0]
+        best = grid[np.argmin(sse[0])]
+        step = grid[1] - grid[0]
+        fine = np.linspace(max(best - step, 0.01), best + step, 41)
+        X, shape = build(x, np.union1d(grid, fine))
+        beta, sse = _solve(X, y, np.ones((1, n)))
+    index = np.argmin(sse[0])
+    params = _params(model, beta[0, index], shape, index)
+
+    # Free parameters, the grid value counts as one
+    k = len(names)
+    rss = max(sse[0, index], np.finfo(float).tiny)
+    aic = n * np.log(rss / n) + 2 * k
+    tss = np.sum((y - y.mean()) ** 2) if intercept else np.sum(y ** 2)
+    r2 = 1 - rss / tss if tss != 0 else 1.0
+
+    samples = {name: np.empty(0) for name in names}
+    ci = {name: (value, value) for name, value in params.items()}
+    if bootstrap > 0:
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(n, np.full(n, 1 / n), size=bootstrap).astype(float)
+        beta, sse = _solve(X, y, weights)
+        indices = np.argmin(sse, axis=1)
+        estimates = [_params(model, beta[b, i], shape, i) for b, i in enumerate(indices)]
+        alpha = (1 - confidence) / 2
+        for name in names:
+            samples[name] = np.array([estimate[name] for estimate in estimates])
+            ci[name] = tuple(float(v) for v in np.quantile(samples[name], [alpha, 1 - alpha]))
+    return Fit(model, params, ci, aic, r2, n, samples)
+
+
+_cache = dict()
+
+
+def _load_fit(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (EnvironmentError, pickle.UnpicklingError, EOFError):
+        print(f'Can not read {path}, the fit will be recomputed')
+        return None
+
+
+def _save_fit(path, result):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Written aside and moved into place, so a process reading it never sees half a fit
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp_path, path)
+
+
+def cached_fit(x, y, model, bootstrap=1000, confidence=0.95, seed=0):
+    '''Same as `fit`, reusing the fit of the same data and options from the cache.'''
+    x = np.ascontiguousarray(x, dtype=float)
+    y = np.ascontiguousarray(y, dtype=float)
+    digest = hashlib.sha1(x.tobytes() + b'|' + y.tobytes()
+                          + repr((model, bootstrap, confidence, seed)).encode('utf-8')).hexdigest()
+    if digest not in _cache:
+        path = os.path.join(CACHE_DIR, f'{digest}.pickle')
+        result = _load_fit(path)
+        if result is None:
+            result = fit(x, y, model, bootstrap, confidence, seed)
+            _save_fit(path, result)
+        _cache[digest] = result
+    return _cache[digest]
+
+
+def fit_all(x, y, models=None, bootstrap=1000, confidence=0.95, seed=0):
+    '''Fit every model in `models` (all but proportional by default), returns {model: Fit}.'''
+    if models is None:
+        models = [model for model in MODELS if model != 'proportional']
+    fits = dict()
+    for model in models:
+        try:
+            fits[model] = cached_fit(x, y, model, bootstrap, confidence, seed)
+        except ValueError as e:
+            print(e)
+    return fits
+
+
+def best(fits):
+    '''The fit with the lowest AIC among {model: Fit}.'''
+    return min(fits.values(), key=lambda f: f.aic)
+
+
+def fit_collection(collection, langs, tools, metrics, models=None, bootstrap=1000):
+    '''
+    Fit every (lang, tool, metric) of a `pre.init()` collection against LoC.
+
+    Returns {(lang, tool, metric): {model: Fit}}.
+    '''
+    result = dict()
+    for lang in langs:
+        curr = collection[lang]
+        for tool in tools:
+            for metric in metrics:
+                key = f'{tool}-{metric}'
+                if key not in curr:
+                    continue
+                result[(lang, tool, metric)] = fit_all(curr['loc'], curr[key], models, bootstrap)
+    return result
+
+
+if __name__ == '__main__':
+    from pre import init
+
+    collection, tags, mode, langs, tools, metrics = init()
+    for (lang, tool, metric), fits in fit_collection(collection, langs, tools, metrics).items():
+        if len(fits) == 0:
+            continue
+        chosen = best(fits)
+        print(f'{lang}-{tool}-{metric}: {chosen.model} by AIC')
+        for model, f in fits.items():
+            ci = ', '.join(f'{name} in [{low:.4g}, {high:.4g}]' for name, (low, high) in f.ci.items())
+            print(f'    {f}  {ci}')
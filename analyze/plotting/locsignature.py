@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from pre import init, name_for
+from output import figure_path
 
 collection, tags, mode, langs, tools, metrics = init()
 
@@ -35,4 +36,4 @@ for index, lang in enumerate(langs):
 if mode == 'view':
     fig.show()
 else:
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-loc.png')
+    fig.savefig(figure_path('performance-loc.png'))
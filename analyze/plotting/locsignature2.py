@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from pre import init, name_for
+from output import figure_path
 
 collection, tags, mode, langs, tools, metrics = init()
 
@@ -58,4 +59,4 @@ plt.subplots_adjust(left=0.087, right=0.999, top=0.999, bottom=0.155)
 if mode == 'view':
     fig.show()
 else:
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\performance-loc.png',)
+    fig.savefig(figure_path('performance-loc.png'))
@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 
 from pre import init, name_for
+from output import figure_path
 
 collection, tags, mode, langs, tools, metrics = init(True)
 
@@ -62,8 +63,11 @@ for index, lang in enumerate(langs):
                            facecolor='white',
                            zorder=100))
 
-    all_min_star = min(all_min_star, min(collection[lang]['stars']))
-    all_max_star = max(all_max_star, max(collection[lang]['stars']))
+    # Languages without stars (python.csv has none) get an empty star background
+    stars = collection[lang]['stars']
+    if not np.all(np.isnan(stars)):
+        all_min_star = min(all_min_star, np.nanmin(stars))
+        all_max_star = max(all_max_star, np.nanmax(stars))
     # Use data[index] rather than collection[lang]['loc'] to apply filter
     local_min_loc = min(data[index])
     local_max_loc = max(data[index])
@@ -83,7 +87,7 @@ for index, lang in enumerate(langs):
                  color='#F4F4F4',
                  )
         filtered_loc = [j for j in range(len(collection[lang]['loc'])) if i <= collection[lang]['loc'][j] < i + 0.2]
-        star_grouping[lang].append(sorted(list(map(lambda j: collection[lang]['stars'][j], filtered_loc))))
+        star_grouping[lang].append(sorted(filter(lambda s: not np.isnan(s), map(lambda j: stars[j], filtered_loc))))
 
 star_len = all_max_star - all_min_star
 for index, lang in enumerate(langs):
@@ -137,4 +141,4 @@ plt.subplots_adjust(left=0.087, right=0.999, top=0.999, bottom=0.09)
 if mode == 'view':
     fig.show()
 else:
-    fig.savefig('G:/My Drive/ASE 2022/performance-loc.png')
+    fig.savefig(figure_path('performance-loc.png'))
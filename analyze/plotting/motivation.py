@@ -2,6 +2,7 @@ import csv
 from math import trunc
 
 from pre import name_for, tools
+from output import figure_path
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -134,4 +135,4 @@ mode = 'view'
 if mode == 'view':
     fig.show()
 elif mode == 'save':
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\motivation.png')
+    fig.savefig(figure_path('motivation.png'))
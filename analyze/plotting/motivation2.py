@@ -1,6 +1,7 @@
 import csv
 
 from pre import name_for, tools
+from output import figure_path
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -133,4 +134,4 @@ mode = 'view'
 if mode == 'view':
     fig.show()
 elif mode == 'save':
-    fig.savefig(f'G:\\My Drive\\ASE 2022\\motivation.png')
+    fig.savefig(figure_path('motivation.png'))
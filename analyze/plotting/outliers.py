@@ -0,0 +1,147 @@
+'''
+Declarative outlier rules for the points of a tool against LoC.
+
+A rule takes the LoC and the values of one tool and returns a boolean mask
+of the points it drops, so filtering is a handful of vectorized
+comparisons however many projects there are. Rules are configured in
+RULES per metric, language and tool, where '*' matches any language or
+tool, the same way commands are looked up in utils/runner.py:
+
+    RULES['time']['cpp']['depends']     rules of Depends on C++
+    RULES['time']['cpp']['*']           rules of other tools on C++
+    DEFAULT                             anything not configured
+
+NaN points are always dropped, whether the value or the LoC is NaN. The
+loops of draw.py these rules replace kept points with a NaN LoC, so the
+java and ts series have one point less than before (row 62 of java.csv
+and row 24 of ts.csv), and the rules give the same points otherwise.
+`keep` reports how many points each rule dropped, so a figure never loses
+points silently.
+'''
+
+import numpy as np
+
+from fitting import fit
+
+
+class Rule:
+    '''A named mask function of (loc, values).'''
+
+    def __init__(self, name, drops):
+        self.name = name
+        self.drops = drops
+
+    def __call__(self, loc, values):
+        return self.drops(loc, values)
+
+    def __repr__(self):
+        return self.name
+
+
+def below(slope, intercept=0, origin=0):
+    '''Drop points under the line `slope * (loc - origin) + intercept`, e.g. tools that crashed early.'''
+    line = f'{slope:.3g} * ' + (f'(loc - {origin})' if origin != 0 else 'loc') \
+        + (f' {"+" if intercept > 0 else "-"} {abs(intercept)}' if intercept != 0 else '')
+    return Rule(f'below {line}', lambda loc, values: values < slope * (loc - origin) + intercept)
+
+
+def loc_below(threshold):
+    '''Drop projects smaller than `threshold` LoC, e.g. where memory is mostly the runtime's.'''
+    return Rule(f'loc < {threshold}', lambda loc, values: loc < threshold)
+
+
+def _robust_z(values):
+    # Distance to the median in units of the MAD, scaled to match the standard deviation of a normal distribution
+    median = np.median(values)
+    mad = 1.4826 * np.median(np.abs(values - median))
+    if mad == 0:
+        return np.zeros_like(values)
+    return (values - median) / mad
+
+
+def mad(threshold=3.5):
+    '''Drop points whose value per LoC is more than `threshold` MADs away from the median.'''
+    def drops(loc, values):
+        return np.abs(_robust_z(values / loc)) > threshold
+    return Rule(f'mad({threshold})', drops)
+
+
+def residual(model='power', threshold=3.5):
+    '''Drop points more than `threshold` MADs of the residuals away from the fitted `model`.'''
+    def drops(loc, values):
+        try:
+            trend = fit(loc, values, model, bootstrap=0)
+        except ValueError:
+            return np.zeros(len(values), dtype=bool)
+        return np.abs(_robust_z(values - trend(loc))) > threshold
+    return Rule(f'residual({model}, {threshold})', drops)
+
+
+DEFAULT = [residual()]
+
+RULES = {
+    'time': {
+        'java': {
+            '*': [below(100 / (5 * 10 ** 6), -20)],
+        },
+        'cpp': {
+            'depends': [below(50 / (5 * 10 ** 5))],
+            '*': [below(100 / (5 * 10 ** 6), -20)],
+        },
+        'python': {
+            'sourcetrail': [below(100 / (2 * 10 ** 5))],
+            # The origin has been 5*10*4 rather than 5*10**4 for every figure so far
+            '*': [below(50 / (10 ** 6 - 5 * 10 ** 4), origin=5 * 10 * 4)],
+        },
+        'ts': {
+            '*': [],
+        },
+    },
+    'memory': {
+        # Only track memory usage from LoC=2W, for all language
+        'java': {
+            'understand': [loc_below(2 * 10 ** 4), below(1 / (1 * 10 ** 6)), loc_below(10 ** 5)],
+            '*': [loc_below(2 * 10 ** 4), below(1 / (1 * 10 ** 6))],
+        },
+        'cpp': {
+            '*': [loc_below(2 * 10 ** 4)],
+        },
+        'python': {
+            'enre': [loc_below(2 * 10 ** 4), below(0.5 / (2 * 10 ** 5))],
+            '*': [loc_below(2 * 10 ** 4)],
+        },
+        'ts': {
+            '*': [loc_below(2 * 10 ** 4)],
+        },
+    },
+}
+
+
+def rules_for(metric, lang, tool):
+    by_lang = RULES.get(metric, {})
+    by_tool = by_lang.get(lang, by_lang.get('*'))
+    if by_tool is None:
+        return DEFAULT
+    return by_tool.get(tool, by_tool.get('*', DEFAULT))
+
+
+def keep(metric, lang, tool, loc, values, verbose=True):
+    '''
+    Returns the mask of points of `tool` to keep, after the rules of
+    (metric, lang, tool) and dropping NaN. Prints what was dropped if `verbose`.
+    '''
+    loc = np.asarray(loc, dtype=float)
+    values = np.asarray(values, dtype=float)
+    dropped = np.isnan(values) | np.isnan(loc)
+    report = [('nan', int(dropped.sum()))]
+    for rule in rules_for(metric, lang, tool):
+        mask = np.zeros(len(values), dtype=bool)
+        valid = ~dropped
+        # Rules only see the points still in, so fits and medians are not skewed by NaN
+        mask[valid] = rule(loc[valid], values[valid])
+        report.append((rule.name, int(mask.sum())))
+        dropped |= mask
+    if verbose and dropped.any():
+        details = ', '.join(f'{name}: {count}' for name, count in report if count != 0)
+        print(f'Dropped {int(dropped.sum())} of {len(values)} points of {tool}-{metric} in {lang} ({details})')
+    return ~dropped
@@ -0,0 +1,21 @@
+'''
+Where figures are saved.
+
+Scripts save to `figure_path(<name>)`, which is under $FIGURES_DIR, or the
+paper's shared drive if it is not set. Saved paths are recorded in `saved`,
+so render.py knows what each script produced.
+'''
+
+import os
+
+
+FIGURES_DIR = os.environ.get('FIGURES_DIR', 'G:\\My Drive\\ASE 2022')
+
+saved = []
+
+
+def figure_path(name):
+    os.makedirs(FIGURES_DIR, exist_ok=True)
+    path = os.path.join(FIGURES_DIR, name)
+    saved.append(path)
+    return path
@@ -1,6 +1,6 @@
 import argparse
-import csv
-import numpy as np
+
+from dataset import load, select
 
 
 # Fixtures
@@ -37,6 +37,8 @@ def init(logloc=False):
                         '--prune-all',
                         help='Remove a result among all tools\' if it\'s going to be removed in one\'s',
                         action=argparse.BooleanOptionalAction)
+    parser.add_argument('--store',
+                        help='Load the latest results from the given result store instead of ../data')
     args = parser.parse_args()
 
     mode = args.mode
@@ -63,53 +65,12 @@ def init(logloc=False):
     # Loading data
     for lang in langs:
         print(f'Loading {lang} data')
-        curr = collection[lang] = {}
         try:
-            # Using 'sig' to suppress the BOM generated by Excel
-            with open(f'../data/{lang}.csv', 'r', encoding='utf-8-sig') as file:
-                data = csv.reader(file)
-                curr['loc'] = []
-                for tool in tools:
-                    for metric in metrics:
-                        curr[f'{tool}-{metric}'] = []
-                curr['stars'] = []
-
-                index = -1
-                for row in data:
-                    index += 1
-                    if index != 0:
-                        loc_num = int(row[1])
-                        if logloc:
-                            if loc_num == 0:
-                                curr['loc'].append(0)
-                            else:
-                                curr['loc'].append(np.log10(loc_num))
-                        else:
-                            curr['loc'].append(loc_num)
-
-                        c = 2
-                        for tool in tools:
-                            for metric in metrics:
-                                # Convert MB to GB if it's memory data
-                                curr[f'{tool}-{metric}'].append(float(row[c]) / (1 if c % 2 == 0 else 1024))
-                                c += 1
-                        curr['stars'].append(int(row[10]))
+            data = load(lang, args.store)
         except EnvironmentError:
-            print(f'No {lang}.csv file found, skipping to the next')
+            print(f'No {lang} data found, skipping to the next')
             continue
-        # Convert to numpy array
-        for key in curr:
-            if key != 'loc' and key != 'stars':
-                curr[key] = np.array(curr[key])
-                # Convert 0, -1 or any error indicators to NaN
-                curr[key][curr[key] <= 0] = np.nan
-        # If an error indicator shows up as LoC, remove it and associated datas
-        indices = []
-        for index, value in enumerate(curr['loc']):
-            if value <= 0:
-                indices.append(index)
-        for key in curr.keys():
-            curr[key] = np.delete(curr[key], indices)
+        collection[lang] = select(data, tools, metrics, logloc)
 
     if args.no_sourcetrail is True:
         del tools['sourcetrail']
@@ -0,0 +1,148 @@
+'''
+Render every figure of the paper in one go, headless.
+
+Datasets are loaded once in this process, then each figure script runs in
+a worker process of its own with the Agg backend, as if it was called as
+
+    python <script> save <lang>
+
+and saves under the output directory (see output.py). A figure is only
+rendered again if one of its inputs changed since the last time, by the
+hash of the script, the modules and style it shares with the others, and
+its data, kept in <output>/.render.json.
+
+    $ python render.py -o ./figures -j 4
+    $ python render.py -o ./figures draw3.py --force
+'''
+
+import os
+import sys
+import json
+import runpy
+import hashlib
+import argparse
+import multiprocessing
+
+import output
+from dataset import load
+
+
+LANGS = ['cpp', 'java', 'python', 'ts']
+
+# (script, lang argument), variants left out write the same files as their successor
+# (draw2.py as draw3.py, locsignature*.py as locsignature3.py); motivation*.py reads
+# clustering results that are not in this repository
+FIGURES = [('draw.py', lang) for lang in LANGS] \
+    + [('draw3.py', lang) for lang in LANGS] \
+    + [('draw4.py', 'all'), ('draw5.py', 'python'), ('locsignature3.py', 'all')]
+
+# Inputs of every script besides its own source and data
+SHARED = ['pre.py', 'pre2.py', 'dataset.py', 'fitting.py', 'outliers.py', 'output.py', 'my.mplstyle']
+
+MANIFEST = '.render.json'
+
+
+def data_sources(lang, store):
+    if store is not None:
+        return [store]
+    langs = LANGS if lang == 'all' else [lang]
+    return [os.path.join('../data', f'{lang}.csv') for lang in langs]
+
+
+def input_hash(script, lang, store):
+    digest = hashlib.sha256()
+    digest.update(f'{script} {lang}\n'.encode('utf-8'))
+    for path in [script] + SHARED + data_sources(lang, store):
+        digest.update(path.encode('utf-8'))
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except EnvironmentError:
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+def render(job):
+    '''Run a figure script, returns (script, lang, saved paths, error).'''
+    script, lang, store = job
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    output.saved.clear()
+    sys.argv = [script, 'save', lang] + (['--store', store] if store is not None else [])
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except BaseException as e:
+        return script, lang, list(output.saved), f'{type(e).__name__}: {e}'
+    finally:
+        plt.close('all')
+    return script, lang, list(output.saved), None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scripts', nargs='*', help='Only render figures of the given scripts')
+    parser.add_argument('-o', '--output', help='Specify the output directory', default=output.FIGURES_DIR)
+    parser.add_argument('-j', '--jobs', help='Specify the number of worker processes', type=int,
+                        default=os.cpu_count())
+    parser.add_argument('--store', help='Load the latest results from the given result store instead of ../data')
+    parser.add_argument('--force', help='Render figures whose inputs have not changed as well', action='store_true')
+    args = parser.parse_args()
+
+    # Scripts find their style and data relative to this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    output.FIGURES_DIR = os.environ['FIGURES_DIR'] = os.path.abspath(args.output)
+    os.makedirs(output.FIGURES_DIR, exist_ok=True)
+
+    manifest_path = os.path.join(output.FIGURES_DIR, MANIFEST)
+    manifest = dict()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    jobs = []
+    hashes = dict()
+    for script, lang in FIGURES:
+        if len(args.scripts) != 0 and script not in args.scripts:
+            continue
+        key = f'{script} {lang}'
+        hashes[key] = input_hash(script, lang, args.store)
+        entry = manifest.get(key)
+        if not args.force and entry is not None and entry['hash'] == hashes[key] \
+                and all(os.path.exists(path) for path in entry['outputs']):
+            print(f'{key} is up to date')
+            continue
+        jobs.append((script, lang, args.store))
+    if len(jobs) == 0:
+        return
+
+    # Load once, forked workers inherit the loaded datasets
+    for lang in LANGS:
+        try:
+            load(lang, args.store)
+        except EnvironmentError:
+            pass
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    failed = 0
+    # A fresh process for every figure, scripts keep state at module level
+    with context.Pool(min(args.jobs, len(jobs)), maxtasksperchild=1) as pool:
+        for script, lang, saved, error in pool.imap_unordered(render, jobs):
+            key = f'{script} {lang}'
+            if error is not None:
+                failed += 1
+                print(f'{key} failed: {error}')
+                continue
+            print(f'{key} rendered {", ".join(os.path.basename(path) for path in saved)}')
+            manifest[key] = {'hash': hashes[key], 'outputs': saved}
+            # Saved after every figure, so an interrupted batch keeps what it has rendered
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+    if failed != 0:
+        sys.exit(f'{failed} figures failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+'''
+Measure the overhead and accuracy of the harness itself with the stand-in analyzers of utils/fake.py.
+
+Each scenario runs a fake tool of known cost through `utils.runner.measure`,
+the same path every real tool goes through, and compares what was measured
+with what the fake did:
+
+    time error      measured time minus the fake's wall clock duration
+    memory error    measured peak minus the fake's peak allocation plus
+                    the baseline (a fake allocating nothing) of each of
+                    its processes
+    cpu error       measured user + system time minus the fake's CPU time
+    phase error     largest difference of a phase duration with its share
+                    of the run
+    harness cpu     CPU seconds the harness itself (sampler, supervisor)
+                    used while the tool ran
+    overhead        wall clock seconds of `measure` over those of a bare
+                    `subprocess.run` of the same command
+
+    $ python bench_harness.py
+    $ python bench_harness.py --repeat 5 --cgroup /sys/fs/cgroup/$(...)/jobs -o ./harness.csv
+'''
+
+import sys
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+
+from utils.runner import measure
+from utils.cgroup import CgroupBackend
+from utils.phases import PhaseProfile
+from utils.supervisor import supervisor
+
+
+FAKE = [sys.executable, './utils/fake.py']
+
+PHASES = PhaseProfile([('parsing', r'Start parsing files'),
+                       ('resolving', r'Resolve types and bindings'),
+                       ('output', r'Dependency done')])
+
+# name, fake options, (duration, cpu, memory in MB, processes) the fake is expected to take,
+# CPU time is only expected where one core is enough
+SCENARIOS = [
+    ('idle', '--duration 1', (1, 0, 0, 1)),
+    ('cpu', '--duration 2 --cpu 1', (2, 1, 0, 1)),
+    ('memory-step', '--duration 2 --memory 512', (2, None, 512, 1)),
+    ('memory-ramp', '--duration 2 --memory 512 --profile ramp', (2, None, 512, 1)),
+    # Held for 0.4s, which the sampler of a loaded system may miss
+    ('memory-spike', '--duration 4 --memory 512 --profile spike', (4, None, 512, 1)),
+    ('children', '--duration 2 --cpu 0.2 --memory 128 --children 3', (2, 0.8, 512, 4)),
+    ('chatty', '--duration 2 --lines-per-second 50000 --line-length 200', (2, None, 0, 1)),
+    ('phases', '--duration 3 --phases', (3, 0, 0, 1)),
+]
+
+
+def error(measured, expected):
+    if measured is None or measured == -1 or expected is None:
+        return None
+    return measured - expected
+
+
+def fmt(value, width):
+    return f'{value:>{width}.3f}' if value is not None else f'{"-":>{width}}'
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('scenarios', nargs='*', help='Only run the given scenarios')
+parser.add_argument('--repeat', help='Specify the number of runs of every scenario', type=int, default=3)
+parser.add_argument('--cgroup', help='Specify a delegated cgroup v2 directory to measure in cgroups, as do.py does')
+parser.add_argument('-o', '--output', help='Also write results as csv to the given file')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+supervisor(echo=False)
+cgroup = CgroupBackend(args.cgroup) if args.cgroup is not None else None
+
+baseline = None
+rows = []
+print(f'{"scenario":<16}{"time err":>10}{"mem err":>10}{"cpu err":>10}{"phase err":>11}'
+      f'{"harness cpu":>13}{"overhead":>10}')
+for name, options, (duration, cpu, memory, processes) in SCENARIOS:
+    if len(args.scenarios) != 0 and name not in args.scenarios and name != 'idle':
+        continue
+    cmd = FAKE + options.split()
+    errors = {key: [] for key in ['time', 'memory', 'cpu', 'phase', 'harness', 'overhead']}
+    peaks = []
+    for _ in range(args.repeat):
+        cpu_start = time.process_time()
+        start = time.monotonic()
+        result = measure(cmd, label=name, cgroup=cgroup, phases=PHASES if name == 'phases' else None)
+        wall = time.monotonic() - start
+        harness = time.process_time() - cpu_start
+
+        start = time.monotonic()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        bare = time.monotonic() - start
+
+        errors['time'].append(error(result['time'], duration))
+        if result['memory'] != -1:
+            peaks.append(result['memory'])
+        if baseline is not None:
+            errors['memory'].append(error(result['memory'], baseline * processes + memory))
+        used = None
+        if result['user-time'] != -1:
+            used = result['user-time'] + result['system-time']
+        errors['cpu'].append(error(used, cpu))
+        if name == 'phases':
+            shares = [result[f'phase-{phase}'] for phase in PHASES.names]
+            errors['phase'].append(max(abs(share - duration / len(shares)) for share in shares))
+        errors['harness'].append(harness)
+        errors['overhead'].append(wall - bare)
+        if result['returncode'] != 0:
+            logging.warning(f'{name} exited with {result["returncode"]}')
+    if name == 'idle':
+        # The interpreter of the fake, which every other scenario has on top of its allocation
+        baseline = statistics.median(peaks) if len(peaks) != 0 else 0
+
+    summary = dict()
+    for key, values in errors.items():
+        values = [value for value in values if value is not None]
+        summary[key] = statistics.median(values) if len(values) != 0 else None
+    rows.append([name] + [summary[key] for key in errors])
+    print(f'{name:<16}{fmt(summary["time"], 10)}{fmt(summary["memory"], 10)}{fmt(summary["cpu"], 10)}'
+          f'{fmt(summary["phase"], 11)}{fmt(summary["harness"], 13)}{fmt(summary["overhead"], 10)}')
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        f.write('scenario,time-error,memory-error,cpu-error,phase-error,harness-cpu,overhead\n')
+        for row in rows:
+            f.write(','.join(str(value) if value is not None else '' for value in row) + '\n')
@@ -0,0 +1,92 @@
+'''
+Compare the throughput of the built-in LoC counter with cloc on the repositories in `repo/`.
+
+Both count from scratch, cloc is run on the whole repository the way do.py
+used to, and the built-in counter without its cache.
+
+    $ python bench_loc.py java
+    $ python bench_loc.py cpp --workers 8 --cloc perl ./utils/cloc
+'''
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+from utils.loc import LANGUAGES, LocCounter, list_blobs
+
+
+def cloc_loc(cloc, repo_path, lang):
+    languages = LANGUAGES.get(lang, LANGUAGES['ts'])
+    output = subprocess.check_output(cloc + [repo_path, '--csv', '--quiet'])
+    LoC = 0
+    for line in output.decode('utf-8', errors='replace').splitlines():
+        fields = line.split(',')
+        if len(fields) >= 5 and fields[1] in languages:
+            LoC += int(fields[4])
+    return LoC
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('lang', help='Sepcify the target language')
+parser.add_argument('--repo-dir',
+                    help='Specify the directory of repositories to count',
+                    default='./repo')
+parser.add_argument('--workers',
+                    help='Specify the number of processes of the built-in counter, all cores up to 4 by default',
+                    type=int)
+parser.add_argument('--cloc',
+                    help='Specify the command running cloc',
+                    nargs='+',
+                    default=['./utils/cloc'])
+parser.add_argument('-o',
+                    '--output',
+                    help='Also write results as csv to the given file')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+repos = sorted(
+    name for name in os.listdir(args.repo_dir)
+    if not name.startswith('.') and os.path.isdir(os.path.join(args.repo_dir, name)))
+
+rows = []
+print(f'{"project":<32}{"files":>8}{"cloc LoC":>12}{"native LoC":>12}{"cloc s":>9}{"native s":>10}{"speedup":>9}')
+for name in repos:
+    repo_path = os.path.join(args.repo_dir, name)
+    files = len(list_blobs(repo_path, set(LANGUAGES.get(args.lang, LANGUAGES['ts']))))
+
+    start = time.monotonic()
+    cloc_count = cloc_loc(args.cloc, repo_path, args.lang)
+    cloc_time = time.monotonic() - start
+
+    # A fresh cache every time, so that nothing is reused
+    cache_dir = tempfile.mkdtemp()
+    counter = LocCounter(os.path.join(cache_dir, 'cache.sqlite'), counter='native', workers=args.workers)
+    try:
+        start = time.monotonic()
+        native_count = counter.count(repo_path, args.lang)
+        native_time = time.monotonic() - start
+    finally:
+        counter.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    rows.append([name, files, cloc_count, native_count, cloc_time, native_time])
+    print(f'{name:<32}{files:>8}{cloc_count:>12}{native_count:>12}{cloc_time:>9.2f}{native_time:>10.2f}'
+          f'{cloc_time / max(native_time, 1e-6):>8.1f}x')
+
+if len(rows) != 0:
+    cloc_total = sum(row[4] for row in rows)
+    native_total = sum(row[5] for row in rows)
+    files_total = sum(row[1] for row in rows)
+    print(f'cloc: {files_total / cloc_total:.0f} files/s, native: {files_total / native_total:.0f} files/s, '
+          f'LoC differ by {sum(abs(row[2] - row[3]) for row in rows) / max(1, sum(row[2] for row in rows)):.2%}')
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        f.write('project,files,cloc-LoC,native-LoC,cloc-time,native-time\n')
+        for row in rows:
+            f.write(','.join(str(value) for value in row) + '\n')
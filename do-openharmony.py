@@ -13,19 +13,19 @@ This script depends on:
 This script has only been tested on Windows 10/11.
 '''
 
-import re
 import io
 import logging
-from os import path, rename
-import os
+from os import path
 import sys
 import csv
 import subprocess
 import time
 import argparse
 from datetime import datetime
-from threading import Timer, Thread
-from functools import reduce
+
+from utils.runner import ToolRunner, register, runners_for
+from utils.loc import LocCounter
+from utils.store import ResultStore
 
 
 timestamp = datetime.now().strftime("%y%m%d%H%M")
@@ -39,67 +39,45 @@ logging.basicConfig(
     ]
 )
 
-try:
-    import psutil
-except NameError:
-    logging.warning('Can not import psutil, memory usage monitoring disabled')
-
-
-def memory_profiling(pid):
-    value = {'peak': -1}
-
-    def task(pid, value):
-        if psutil is None:
-            value['peak'] = -1
-            return value
-
-        while True:
-            prev = value['peak']
-            try:
-                psection = True
-                me = psutil.Process(pid)
-                curr = me.memory_info().rss
-                psection = False
-                # Also counting descendents
-                children = me.children(recursive=True)
-                curr += reduce(lambda p, v: p + v,
-                               map(lambda sp: sp.memory_info().rss, children), 0)
-                # Convert unit from B to MB
-                curr /= 1024 ** 2
-            except (psutil.ProcessLookupError, psutil.NoSuchProcess):
-                if psection is True:
-                    # This usually happens after the process is finished/killed but the function is still invoked
-                    logging.warning(
-                        f'Losing process with pid={pid}')
-                    # By breaking the loop, this thread should be terminated
-                    break
-                else:
-                    # Suppress the losing of subprocesses
-                    pass
-            else:
-                value['peak'] = curr if curr > prev else prev
-
-                # ENRE-python has a memory leak bug if running in Windows 11 (not sure)
-                # so in general, if a process is taking too much memory,
-                # then we just kill it and let latter projects be run.
-                #
-                # Current threshold is 20GB
-                if value['peak'] > 1024 * 20:
-                    for c in children:
-                        c.kill()
-                    me.kill()
-                    value['peak'] = 0
-                    logging.warning(
-                        f'The process with pid={pid} took too much memory and thus been killed')
-                    break
-
-                # Set interval to 0.5 for the tradeoff between accuracy and performance
-                # (busy loop will cause the target process to be extremely slow, which
-                # should definitely not be used)
-                time.sleep(0.5)
-
-    Thread(target=task, args=(pid, value,)).start()
-    return value
+# Tool definitions, tools are run and recorded in this order
+ROOT = path.abspath(path.dirname(__file__))
+TOOLS = path.join(ROOT, 'tools')
+
+# ENRE-python has a memory leak bug if running in Windows 11 (not sure)
+# so in general, if a process is taking too much memory,
+# then we just kill it and let latter projects be run.
+#
+# Current threshold is 20GB
+MEMORY_LIMIT = 1024 * 20
+
+register(ToolRunner('depends', 'Depends', {
+    '*': ['java', '-jar', '{tools}/depends.jar', '{lang}', '{repo}', '{project}', '-g', 'var'],
+}, cwd='./out/depends', memory_limit=MEMORY_LIMIT))
+
+register(ToolRunner('enre', 'ENRE', {
+    'java': ['java', '-jar', '{tools}/enre/enre-java.jar', 'java', '{repo}', '{project}'],
+    'cpp': ['java', '-jar', '{tools}/enre/enre-cpp.jar', '{repo}', '{project}'],
+    'python': ['{tools}/enre/enre-python.exe', '{repo}'],
+    'ts': ['node', '{tools}/enre/enre-ts.js', '-i', '{repo}', '-n', '{project}'],
+}, cwd='./out/enre-openharmony/{project}', label='ENRE-{lang}', memory_limit=MEMORY_LIMIT))
+
+# Run SourceTrail only if the project has been created before (see utils/sthelper.py)
+register(ToolRunner('sourcetrail', 'SourceTrail', {
+    '*': ['C:\\Program Files\\Sourcetrail\\Sourcetrail.exe', 'index',
+          '--project-file', '{root}/out/sourcetrail/{project}.srctrlprj'],
+}, requires='./out/sourcetrail/{project}.srctrlprj', memory_limit=MEMORY_LIMIT))
+
+# `-db` has already set output path to the correct location hence there is no need to set the cwd
+register(ToolRunner('understand', 'Understand', {
+    'cpp': ['und', 'create', '-db', './out/understand-openharmony/{project}.und', '-languages', 'C++',
+            'add', '{repo}', 'settings', '-C++UseStrict', 'on', 'analyze', '-all'],
+    'java': ['und', 'create', '-db', './out/understand-openharmony/{project}.und', '-languages', 'Java',
+             'add', '{repo}', 'settings', '-C++UseStrict', 'on', 'analyze', '-all'],
+    'python': ['und', 'create', '-db', './out/understand-openharmony/{project}.und', '-languages', 'Python',
+               'add', '{repo}', 'settings', '-C++UseStrict', 'on', 'analyze', '-all'],
+    'ts': ['und', 'create', '-db', './out/understand-openharmony/{project}.und', '-languages', 'Web',
+           'add', '{repo}', 'settings', '-C++UseStrict', 'on', 'analyze', '-all'],
+}, memory_limit=MEMORY_LIMIT))
 
 
 # Usage
@@ -111,6 +89,10 @@ parser.add_argument('-t',
                     '--timeout',
                     help='Specify the maximum duration of a single process',
                     type=int)
+parser.add_argument('--loc-counter',
+                    help='Specify how LoC is counted, by cloc or by the built-in parallel counter',
+                    choices=['cloc', 'native'],
+                    default='cloc')
 args = parser.parse_args()
 
 lang = args.lang
@@ -131,13 +113,14 @@ else:
     raise ValueError(
         f'Invalid range format {args.range}, only support x or x-x')
 
+runners = runners_for(lang)
+
 only = args.only.lower() if args.only is not None else ''
 try:
-    ['clone', 'loc', 'depends', 'enre',
-        'understand', 'sourcetrail', ''].index(only)
+    (['clone', 'loc', ''] + [runner.name for runner in runners]).index(only)
 except ValueError:
     raise ValueError(
-        f'Invalid tool {only}, only support depends / enre / understand / sourcetrail / clone / loc')
+        f'Invalid tool {only}, only support {" / ".join(runner.name for runner in runners)} / clone / loc')
 
 # Feature set
 timeout = args.timeout  # None, or positive int
@@ -156,19 +139,11 @@ logging.info(
 
 outfile_path = f'./records/{timestamp}-{lang}-{from_line}-{end_line}.csv'
 
-with open(f'{outfile_path}.pending', 'a+') as f:
-    f.write(
-        'project_name'
-        + ',LoC'
-        + ',Depends-time'
-        + ',Depends-memory'
-        + ',ENRE-time'
-        + ',ENRE-memory'
-        + ',SourceTrail-time'
-        + ',SourceTrail-memory'
-        + ',Understand-time'
-        + ',Understand-memory'
-        + '\n')
+# Results are saved to the store as soon as they are measured, and exported
+# to `outfile_path` once the run has completed. OpenHarmony has a store of its
+# own, so that its projects are not mixed up with the ones of do.py
+store = ResultStore('./records/openharmony.sqlite')
+run_id = store.start_run(lang, from_line, end_line, only, vars(args))
 
 project_clone_url_list = dict()
 try:
@@ -186,10 +161,14 @@ except EnvironmentError:
     logging.error(f'Can not find project list for {args.lang}')
     sys.exit()
 
+# cloc, as in the recorded datasets, the native counter needs no Perl but its counts differ slightly
+loc_counter = LocCounter('./out/loc/cache.sqlite', counter=args.loc_counter)
+
 # Cloning (or reusing) repository from GitHub
 for project_name in project_clone_url_list.keys():
     repo_path = f'./repo/openharmony/{project_name}'
-    abs_repo_path = path.join(path.dirname(__file__), repo_path)
+    # Tools are run in their own output directories, so pass an absolute path
+    abs_repo_path = path.join(ROOT, 'repo', 'openharmony', project_name)
     if not path.exists(repo_path):
         logging.info(f'Cloning \'{project_name}\'')
         fail_count = 0
@@ -223,322 +202,47 @@ for project_name in project_clone_url_list.keys():
         logging.info(
             f'Reusing existed local repository for {project_name}')
 
-    records = dict()
-
     # Obtain LoC (only when process all tools)
     if only == 'loc' or only == '':
         print('Counting line of code')
-        LoC = 0
-        cmd = f'.\\utils\\cloc-1.92.exe {repo_path} --csv --quiet'
         try:
             # A fixed timeout threshold is only activated on process all,
             # which allow LoC counting to exeed the time when only process LoC
-            proc = subprocess.check_output(
-                cmd, timeout=180 if only == '' else None)
+            LoC = loc_counter.count(repo_path, lang, timeout=180 if only == '' else None)
         except subprocess.TimeoutExpired:
             logging.exception(
                 f'Counting LoC for {project_name} timed out')
-            records['LoC'] = -1
+            store.add_loc(run_id, project_name, None, -1)
         except subprocess.CalledProcessError:
             logging.exception(
                 f'Failed couting line of code for {project_name}')
-            records['LoC'] = -1
+            store.add_loc(run_id, project_name, None, -1)
         else:
-            outs = proc.strip().decode('utf-8').splitlines()
-            for out in outs:
-                out = out.split(',')
-                if len(out) == 5:
-                    if lang == 'java':
-                        if out[1] == 'Java':
-                            LoC += int(out[-1])
-                    elif lang == 'cpp':
-                        try:
-                            ['C++', 'C/C++ Header'].index(out[1])
-                            LoC += int(out[-1])
-                        except:
-                            pass
-                    elif lang == 'python':
-                        if out[1] == 'Python':
-                            LoC += int(out[-1])
-                    else:
-                        try:
-                            ['JavaScript', 'TypeScript'].index(out[1])
-                            LoC += int(out[-1])
-                        except:
-                            pass
             logging.info(f'LoC for {project_name} is {LoC}')
-        records['LoC'] = LoC
-    else:
-        records['LoC'] = 0
-
-    # Run ENRE
-    if only == 'enre' or only == '':
-        print('Starting ENRE')
-        if args.lang == 'java':
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/enre/enre-java.jar")} java {abs_repo_path} {project_name}'
-        elif args.lang == 'cpp':
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/enre/enre-cpp.jar")} {abs_repo_path} {project_name}'
-        elif args.lang == 'python':
-            cmd = f'{path.join(path.dirname(__file__), "./tools/enre/enre-python.exe")} {abs_repo_path}'
-        else:
-            cmd = f'node {path.join(path.dirname(__file__), "./tools/enre/enre-ts.js")} -i {abs_repo_path} -n {project_name}'
-        print(cmd)
-
-        # Whether placing the start of timer here or after the creation
-        # has no significant impact on the final duration
-        time_start = time.time()
-        isOutputExist = os.path.exists(f'./out/enre-openharmony/{project_name}')
-        if not isOutputExist:
-            os.makedirs(f'./out/enre-openharmony/{project_name}')
-            
-        proc = subprocess.Popen(
-            cmd,
-            # Do not use `shell=True`, which will create shell->jvm, a sub-subprocess, which
-            # won't be killed just by calling shell's `.kill()`; whereas,
-            # without shell, the jvm subprocess is directly returned,
-            # which can be killed then.
-            # shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            cwd=f'./out/enre-openharmony/{project_name}')
-            # cwd=f'./out/enre-{lang}')
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running ENRE-{lang} on {project_name} timed out')
-                records['ENRE-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on ENRE-{lang} while process {project_name}')
-        time_end = time.time()
-
-        # No matter it been killed or not, still output the peak memory usage
-        records['ENRE-memory'] = memory['peak']
-        if not killed:
-            # Cancel the timer! if the process is finished within the time
-            try:
-                logging.info(
-                    f'ENRE-{lang} finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
-
-            records['ENRE-time'] = time_end - time_start
-
-            logging.info(
-                f'Running ENRE-{lang} on {project_name} costs {records["ENRE-time"]}s'
-                + (f' and {records["ENRE-memory"]}MB' if records['ENRE-memory'] != -1 else ''))
-    else:
-        records['ENRE-time'] = 0
-        records['ENRE-memory'] = 0
-
-    if only == 'depends' or only == '':
-        # Run Depends
-        print('starting Depends')
-        cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/depends.jar")} {lang} {abs_repo_path} {project_name} -g var'
-
-        time_start = time.time()
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            cwd='./out/depends')
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running Depends on {project_name} timed out')
-                records['Depends-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on Depends while process {project_name}')
-        time_end = time.time()
-
-        records['Depends-memory'] = memory['peak']
-        if not killed:
-            try:
-                logging.info('Depends finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
-
-            records['Depends-time'] = time_end - time_start
-            logging.info(
-                f'Running Depends on {project_name} costs {records["Depends-time"]}s'
-                + (f' and {records["Depends-memory"]}MB' if records['Depends-memory'] != -1 else ""))
-    else:
-        records['Depends-time'] = 0
-        records['Depends-memory'] = 0
-
-    if only == 'understand' or only == '':
-        # Run Understand
-        print('Starting Understand')
-        upath = f'./out/understand-openharmony/{project_name}.und'
-        if lang == 'cpp':
-            ulang = 'C++'
-        elif lang == 'java':
-            ulang = 'Java'
-        elif lang == 'python':
-            ulang = 'Python'
-        else:
-            ulang = 'Web'
-        cmd = f'und create -db {upath} -languages {ulang} add {abs_repo_path} settings -C++UseStrict on analyze -all'
-
-        time_start = time.time()
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            # `upath` has already set output path to the correct location hence there is no need to set the cwd
-            # cwd='./out/understand'
-        )
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running Understand on {project_name} timed out')
-                records['Understand-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on Understand while process {project_name}')
-        time_end = time.time()
-
-        records['Understand-memory'] = memory['peak']
-        if not killed:
-            try:
-                logging.info('Process finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
-
-            records['Understand-time'] = time_end - time_start
-            logging.info(
-                f'Running Understand on {project_name} costs {records["Understand-time"]}s'
-                + (f' and {records["Understand-memory"]}MB' if records['Understand-memory'] != -1 else ""))
-    else:
-        records['Understand-time'] = 0
-        records['Understand-memory'] = 0
-
-    if only == 'sourcetrail' or only == '':
-        # Run SourceTrail (only if the project has been created before)
-        print('Start SourceTrail')
-        spath = f'./out/sourcetrail/{project_name}.srctrlprj'
-        if path.exists(spath):
-            cmd = f'"C:\Program Files\Sourcetrail\Sourcetrail.exe" index --project-file {path.join(path.dirname(__file__), spath)}'
-
-            time_start = time.time()
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT)
-
-            killed = False
-            if timeout is not None:
-                def handle_timeout():
-                    global killed
-                    killed = True
-                    proc.kill()
-                    logging.warning(
-                        f'Running Sourcetrail on {project_name} timed out')
-                    records['SourceTrail-time'] = -1
-
-                timer = Timer(timeout, handle_timeout)
-                timer.start()
-
-            pid = proc.pid
-            memory = memory_profiling(pid)
-            try:
-                for line in io.TextIOWrapper(proc.stdout):
-                    print(line, end='')
-            except UnicodeDecodeError:
-                logging.warning(
-                    f'Suppressing an encoding error on SourceTrail while process {project_name}')
-            time_end = time.time()
-
-            records['SourceTrail-memory'] = memory['peak']
-            if not killed:
-                try:
-                    logging.info('Process finished normally, cancel the timer')
-                    timer.cancel()
-                except:
-                    pass
-
-                records['SourceTrail-time'] = time_end - time_start
-                logging.info(
-                    f'Running SourceTrail on {project_name} costs {records["SourceTrail-time"]}s'
-                    + (f' and {records["SourceTrail-memory"]}MB' if records['SourceTrail-memory'] != -1 else ""))
-        else:
-            logging.warning(
-                f'No SourceTrail project for {project_name}, skipped')
-            records['SourceTrail-time'] = 0
-            records['SourceTrail-memory'] = 0
-    else:
-        records['SourceTrail-time'] = 0
-        records['SourceTrail-memory'] = 0
-
-    # Instantly save duration info whenever a project is finished analizing
+            store.add_loc(run_id, project_name, None, LoC)
+
+    for runner in runners:
+        if only == runner.name or only == '':
+            result = runner.run({
+                'project': project_name,
+                'repo': abs_repo_path,
+                'lang': lang,
+                'root': ROOT,
+                'tools': TOOLS,
+            }, timeout)
+            if result is not None:
+                store.add(run_id, project_name, runner.column, None, result)
+
+    # Instantly save results whenever a project is finished analizing
     # to prevent from crashing.
-    with open(f'{outfile_path}.pending', 'a+') as f:
-        f.write(
-            f'{project_name}'
-            + f',{records["LoC"]}'
-            + f',{records["Depends-time"]}'
-            + f',{records["Depends-memory"]}'
-            + f',{records["ENRE-time"]}'
-            + f',{records["ENRE-memory"]}'
-            + f',{records["SourceTrail-time"]}'
-            + f',{records["SourceTrail-memory"]}'
-            + f',{records["Understand-time"]}'
-            + f',{records["Understand-memory"]}'
-            + '\n')
+    store.flush()
 
-try:
-    # Remove `.pending` identifier to indicates to whole process succeeded
-    # After the finishing of this script, if `.pending` still exists,
-    # you might want to check out log files since it's a sign of some exception
-    # has taken place.
-    rename(f'{outfile_path}.pending', outfile_path)
-except:
-    logging.error(f'Lost output file {outfile_path}!')
+loc_counter.close()
+
+# A run without completion in the store is a sign of some exception
+# has taken place, you might want to check out log files then.
+store.finish_run(run_id)
+store.export_csv(outfile_path, [runner.column for runner in runners], run=run_id)
+store.close()
 
 logging.info('Run has completed')
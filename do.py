@@ -13,19 +13,26 @@ This script depends on:
 This script has only been tested on Windows 10/11.
 '''
 
-import re
 import os
-import io
 import logging
-from os import path, rename
+from os import path
 import sys
 import csv
 import subprocess
-import time
 import argparse
 from datetime import datetime
-from threading import Timer, Thread
-from functools import reduce
+from threading import Lock
+
+from utils.runner import ToolRunner, register, runners_for
+from utils.cgroup import CgroupBackend, COLUMNS as CGROUP_COLUMNS
+from utils.clone import ClonePool, project_ids
+from utils.repocache import RepoCache
+from utils.loc import LocCounter
+from utils.scheduler import Scheduler, load_peak_history
+from utils.store import ResultStore
+from utils.stats import cv, summarize
+from utils.jvm import JvmPool
+from utils.supervisor import supervisor, RUSAGE_COLUMNS
 
 
 timestamp = datetime.now().strftime("%y%m%d%H%M")
@@ -39,68 +46,92 @@ logging.basicConfig(
     ]
 )
 
-try:
-    import psutil
-# except NameError:
-except Exception as e:
-    logging.warning('Can not import psutil, memory usage monitoring disabled')
-
-
-def memory_profiling(pid):
-    value = {'peak': -1}
-
-    def task(pid, value):
-        if psutil is None:
-            value['peak'] = -1
-            return value
-
-        while True:
-            prev = value['peak']
-            try:
-                psection = True
-                me = psutil.Process(pid)
-                curr = me.memory_info().rss
-                psection = False
-                # Also counting descendents
-                children = me.children(recursive=True)
-                curr += reduce(lambda p, v: p + v,
-                               map(lambda sp: sp.memory_info().rss, children), 0)
-                # Convert unit from B to MB
-                curr /= 1024 ** 2
-            except (psutil.ProcessLookupError, psutil.NoSuchProcess):
-                if psection is True:
-                    # This usually happens after the process is finished/killed but the function is still invoked
-                    logging.warning(
-                        f'Losing process with pid={pid}')
-                    # By breaking the loop, this thread should be terminated
-                    break
-                else:
-                    # Suppress the losing of subprocesses
-                    pass
-            else:
-                value['peak'] = curr if curr > prev else prev
-
-                # ENRE-python has a memory leak bug if running in Windows 11 (not sure)
-                # so in general, if a process is taking too much memory,
-                # then we just kill it and let latter projects be run.
-                #
-                # Current threshold is 20GB
-                # if value['peak'] > 1024 * 20:
-                #     for c in children:
-                #         c.kill()
-                #     me.kill()
-                #     value['peak'] = 0
-                #     logging.warning(
-                #         f'The process with pid={pid} took too much memory and thus been killed')
-                #     break
-
-                # Set interval to 0.5 for the tradeoff between accuracy and performance
-                # (busy loop will cause the target process to be extremely slow, which
-                # should definitely not be used)
-                time.sleep(0.5)
-
-    Thread(target=task, args=(pid, value,)).start()
-    return value
+# Tool definitions, tools are run and recorded in this order
+ROOT = path.abspath(path.dirname(__file__))
+TOOLS = path.join(ROOT, 'tools')
+
+# Phases are told apart by the lines tools print when they move on, see utils/phases.py,
+# and `output` is what `--normalize` reads, see utils/normalize.py. Tools with an `output`
+# write into a directory of their own for every project, so that concurrent jobs of e.g.
+# `spring-boot` and `spring-boot-demo` never see each other's output
+register(ToolRunner('depends', 'Depends', {
+    'c': ['java', '-jar', '{tools}/depends.jar', 'cpp', '{repo}', '{project}', '-g', 'var'],
+    '*': ['java', '-jar', '{tools}/depends.jar', '{lang}', '{repo}', '{project}', '-g', 'var'],
+}, cwd='./out/depends/{project}', phases={
+    '*': [('parsing', r'Start parsing files'),
+          ('resolving', r'Resolve types and bindings'),
+          ('output', r'Dependency done|Start create')],
+}, output='*.json'))
+
+register(ToolRunner('enre', 'ENRE', {
+    'java': ['java', '-jar', '{tools}/enre/enre-java.jar', 'java', '{repo}', '{project}'],
+    'cpp': ['java', '-jar', '{tools}/enre/enre-cpp.jar', '{repo}', '{project}'],
+    'c': ['java', '-jar', '-Xmx64G', '{tools}/ENRE/ENRE-cpp.jar', '{repo}', '{project}'],
+    'python': ['{tools}/enre/enre-python.exe', '{repo}'],
+    'ts': ['node', '{tools}/enre/enre-ts.js', '-i', '{repo}', '-n', '{project}'],
+    # No phases until markers are taken from real logs of every ENRE variant, its phase columns are -1
+}, cwd='./out/enre-{lang}/{project}', label='ENRE-{lang}', output='**/*.json'))
+
+# Run SourceTrail only if the project has been created before (see utils/sthelper.py)
+register(ToolRunner('sourcetrail', 'SourceTrail', {
+    '*': ['C:\\Program Files\\Sourcetrail\\Sourcetrail.exe', 'index',
+          '--project-file', '{root}/out/sourcetrail/{project}.srctrlprj'],
+}, requires='./out/sourcetrail/{project}.srctrlprj'))
+
+# `-db` has already set output path to the correct location hence there is no need to set the cwd
+register(ToolRunner('understand', 'Understand', {
+    'cpp': ['und', 'create', '-db', './out/understand/{project}.und', '-languages', 'C++', 'add', '{repo}', 'analyze', '-all'],
+    'c': ['und', 'create', '-db', './out/understand/{project}.und', '-languages', 'C++', 'add', '{repo}', 'analyze', '-all'],
+    'java': ['und', 'create', '-db', './out/understand/{project}.und', '-languages', 'Java', 'add', '{repo}', 'analyze', '-all'],
+    'python': ['und', 'create', '-db', './out/understand/{project}.und', '-languages', 'Python', 'add', '{repo}', 'analyze', '-all'],
+    'ts': ['und', 'create', '-db', './out/understand/{project}.und', '-languages', 'Web', 'add', '{repo}', 'analyze', '-all'],
+    # Its database can only be read through its API, normalized is a dependency csv exported from it
+}, output='./out/understand/{project}.csv', export={
+    '*': ['und', 'export', '-dependencies', 'file', 'csv', './out/understand/{project}.csv', './out/understand/{project}.und'],
+}))
+
+# Python only analyzers, columns are ordered as in analyze/data/python.csv
+register(ToolRunner('pysonar2', 'PySonar2', {
+    'python': ['java', '-jar', '{tools}/pysonar2.jar', '{repo}', '{root}/out/pysonar2/{project}'],
+}, cwd='./out/pysonar2'))
+
+register(ToolRunner('enre-cfg', 'ENRE-cfg', {
+    'python': ['{tools}/enre/enre-python.exe', '{repo}', '--cfg'],
+}, cwd='./out/enre-cfg', label='ENRE-cfg'))
+
+
+def pycg_command(context):
+    # PyCG takes every entry point explicitly rather than a directory
+    files = []
+    for dirpath, _, filenames in os.walk(context['repo']):
+        files += [path.join(dirpath, filename) for filename in filenames if filename.endswith('.py')]
+    return ['pycg', '--package', context['repo']] + files + ['-o', f'{context["project"]}.json']
+
+
+register(ToolRunner('pycg', 'PyCG', {
+    'python': pycg_command,
+}, cwd='./out/pycg'))
+
+
+# Stand-ins of the tools above with known costs, run instead of them with
+# `--fake` to test the harness where they are not installed, see utils/fake.py
+def fake(options):
+    return {'*': [sys.executable, '{root}/utils/fake.py'] + options.split()}
+
+
+FAKE_RUNNERS = [
+    ToolRunner('fake-cpu', 'Fake-cpu', fake('--duration 4 --cpu 2 --memory 64 --phases'), phases={
+        '*': [('parsing', r'Start parsing files'),
+              ('resolving', r'Resolve types and bindings'),
+              ('output', r'Dependency done')],
+    }),
+    ToolRunner('fake-memory', 'Fake-memory', fake('--duration 4 --memory 1024 --profile ramp')),
+    ToolRunner('fake-spike', 'Fake-spike', fake('--duration 4 --memory 1024 --profile spike')),
+    ToolRunner('fake-children', 'Fake-children', fake('--duration 2 --cpu 1 --memory 128 --children 3 --orphans 1')),
+    ToolRunner('fake-chatty', 'Fake-chatty', fake('--duration 2 --lines-per-second 20000 --line-length 200')),
+    ToolRunner('fake-failing', 'Fake-failing', fake('--duration 1 --exit 1')),
+    ToolRunner('fake-hang', 'Fake-hang', fake('--hang')),
+]
 
 
 # Usage
@@ -112,6 +143,74 @@ parser.add_argument('-t',
                     '--timeout',
                     help='Specify the maximum duration of a single process',
                     type=int)
+parser.add_argument('-j',
+                    '--jobs',
+                    help='Specify the maximum number of (project, tool) jobs running at the same time',
+                    type=int,
+                    default=1)
+parser.add_argument('--cores-per-job',
+                    help='Specify the number of cores reserved for each job when running in parallel',
+                    type=int,
+                    default=1)
+parser.add_argument('--memory-budget',
+                    help='Specify the total memory (in MB) that parallel jobs can reserve, 90%% of physical memory by default',
+                    type=float)
+parser.add_argument('--memory-limit',
+                    help='Specify the maximum memory (in MB) a single process can take before being killed',
+                    type=float)
+parser.add_argument('--clone-workers',
+                    help='Specify the number of repositories cloned at the same time',
+                    type=int,
+                    default=1)
+parser.add_argument('--clone-ahead',
+                    help='Specify how many projects can be cloned ahead of the one being analyzed',
+                    type=int,
+                    default=2)
+parser.add_argument('--mirror',
+                    help='Specify a directory of bare repositories to clone from instead of remotes')
+parser.add_argument('--repo-cache',
+                    help='Check out repositories from a cache keyed by (url, commit) sharing one object store,'
+                    + ' instead of cloning into ./repo/<project_name>',
+                    action='store_true')
+parser.add_argument('--cgroup',
+                    help='Specify a delegated cgroup v2 directory to run each tool in a group of its own,'
+                    + ' which records exact peak memory, CPU time, IO and pressure stalls')
+parser.add_argument('--loc-counter',
+                    help='Specify how LoC is counted, by cloc or by the built-in parallel counter',
+                    choices=['cloc', 'native'],
+                    default='cloc')
+parser.add_argument('--repeat',
+                    help='Specify the number of times each tool is measured on each project',
+                    type=int,
+                    default=1)
+parser.add_argument('--warmup',
+                    help='Specify the number of unmeasured runs before the repeated ones',
+                    type=int,
+                    default=0)
+parser.add_argument('--stable',
+                    help='Stop repeating once the coefficient of variation of times is below this, 0.02 by default',
+                    type=float,
+                    default=0.02)
+parser.add_argument('--jvm-worker',
+                    help='Run java -jar tools in warm JVMs kept across projects, reporting JVM startup separately',
+                    action='store_true')
+parser.add_argument('--resume',
+                    help='Continue an interrupted run, the last unfinished one over the same range by default,'
+                    + ' skipping (project, tool) jobs that have completed',
+                    nargs='?',
+                    const=0,
+                    type=int,
+                    metavar='RUN')
+parser.add_argument('--list',
+                    help='Specify the project list, ./lists/<lang> project list final.csv by default,'
+                    + ' e.g. one of synthetic repositories written by utils/synth.py')
+parser.add_argument('--normalize',
+                    help='Normalize the output of every tool to ./out/normalized after it has run,'
+                    + ' recording its entity and relation counts and relations per second',
+                    action='store_true')
+parser.add_argument('--fake',
+                    help='Run stand-in analyzers with known costs instead of the real tools, to test the harness',
+                    action='store_true')
 args = parser.parse_args()
 
 lang = args.lang
@@ -121,24 +220,26 @@ except:
     raise ValueError(
         f'Invalid lang {lang}, only support c / cpp / java / python / ts')
 
-range = args.range.split('-')
-if len(range) == 1:
-    from_line = int(range[0])
-    end_line = int(range[0])
-elif len(range) == 2:
-    from_line = int(range[0])
-    end_line = int(range[1])
+# Not named `range`, which would shadow the builtin
+lines = args.range.split('-')
+if len(lines) == 1:
+    from_line = int(lines[0])
+    end_line = int(lines[0])
+elif len(lines) == 2:
+    from_line = int(lines[0])
+    end_line = int(lines[1])
 else:
     raise ValueError(
         f'Invalid range format {args.range}, only support x or x-x')
 
+runners = FAKE_RUNNERS if args.fake else runners_for(lang)
+
 only = args.only.lower() if args.only is not None else ''
 try:
-    ['clone', 'loc', 'depends', 'enre',
-        'understand', 'sourcetrail', ''].index(only)
+    (['clone', 'loc', ''] + [runner.name for runner in runners]).index(only)
 except ValueError:
     raise ValueError(
-        f'Invalid tool {only}, only support depends / enre / understand / sourcetrail / clone / loc')
+        f'Invalid tool {only}, only support {" / ".join(runner.name for runner in runners)} / clone / loc')
 
 # Feature set
 timeout = args.timeout  # None, or positive int
@@ -150,413 +251,273 @@ if timeout is not None:
         logging.warning(
             f'Unrecommended timeout value {timeout}, this value is too low to get useful information, and is allowed only for debug purpose')
 
+if args.jobs < 1:
+    raise ValueError(
+        f'Invalid jobs value {args.jobs}, at least 1 job is required')
+if args.repeat < 1 or args.warmup < 0:
+    raise ValueError(
+        f'Invalid repeat {args.repeat} or warmup {args.warmup}, at least 1 measured run is required')
+if args.cores_per_job < 1:
+    raise ValueError(
+        f'Invalid cores per job value {args.cores_per_job}, at least 1 core is required')
+
+cgroup = None
+if args.cgroup is not None:
+    cgroup = CgroupBackend(args.cgroup)
+
+# Interleaved output of concurrent tools is unreadable, it is kept in
+# per-job logs and only the end of it is shown when a tool fails
+supervisor(echo=args.jobs == 1)
+
+jvm = None
+if args.jvm_worker:
+    # A worker per job is kept between its trials
+    jvm = JvmPool('./out/jvmworker', max_idle=args.jobs)
+    if cgroup is not None or args.memory_limit is not None:
+        logging.warning('Tools in JVM workers are not run in cgroups nor limited in memory')
+
 logging.info(
     f'Working on {from_line}-{end_line} for {lang}'
     + f' with {"all tools" if only == "" else f"{only} only"}'
-    + (f' and timeout limit to {timeout}' if timeout is not None else ''))
+    + (f' and timeout limit to {timeout}' if timeout is not None else '')
+    + (f' using {args.jobs} parallel jobs' if args.jobs > 1 else '')
+    + (f' in cgroups under {args.cgroup}' if cgroup is not None else ''))
 
 outfile_path = f'./records/{timestamp}-{lang}-{from_line}-{end_line}.csv'
 
-with open(f'{outfile_path}.pending', 'a+') as f:
-    f.write(
-        'project_name'
-        + ',LoC'
-        + ',Depends-time'
-        + ',Depends-memory'
-        + ',ENRE-time'
-        + ',ENRE-memory'
-        + ',SourceTrail-time'
-        + ',SourceTrail-memory'
-        + ',Understand-time'
-        + ',Understand-memory'
-        + '\n')
+# Repeated trials stop early after this many once their coefficient of variation is below `--stable`
+MIN_TRIALS = 3
+
+# Results are saved to the store as soon as they are measured, and exported
+# to `outfile_path` once the run has completed
+store = ResultStore('./records/results.sqlite')
+
+# Results already in the store serve as the checkpoint of a resumed run,
+# jobs that timed out or failed are run again
+run_id = None
+completed = set()
+# Times of trials already measured by the run as {trial: time}, a resumed job only runs the ones it lacks
+measured = dict()
+if args.resume is not None:
+    run_id = args.resume if args.resume != 0 else store.find_run(lang, from_line, end_line)
+    if run_id is None:
+        logging.warning(f'No unfinished run over {from_line}-{end_line} for {lang}, starting a new one')
+    else:
+        run = store.run(run_id)
+        if run is None or (run['lang'], run['from_line'], run['end_line']) != (lang, from_line, end_line):
+            raise ValueError(
+                f'Invalid run {run_id} to resume, it is not a run over {from_line}-{end_line} for {lang}')
+        completed = store.completed(run_id, args.repeat, args.stable, MIN_TRIALS)
+        measured = store.trials(run_id)
+        logging.info(f'Resuming run {run_id}, where {len(completed)} jobs have completed')
+if run_id is None:
+    run_id = store.start_run(lang, from_line, end_line, only, vars(args))
+logging.info(f'Results are saved as run {run_id} in {store.path}')
 
 project_clone_url_list = dict()
+project_revision_list = dict()
 try:
-    with open(f'./lists/{args.lang} project list final.csv', 'r', encoding='utf-8') as file:
-        project_list = csv.reader(file)
-        count = 0
-        for row in project_list:
-            if (count >= from_line) and (count <= end_line):
-                project_name = row[0].split("/")[-1]
-                # Some project's git url is in 3rd column, rather than 4th column,
-                # which is weird. (Encoding problem) This handles that situation.
-                project_clone_url_list[project_name] = row[3] if row[3] != '' else row[2]
-            count += 1
+    list_path = args.list if args.list is not None else f'./lists/{args.lang} project list final.csv'
+    with open(list_path, 'r', encoding='utf-8') as file:
+        rows = [row if len(row) != 0 else [''] * 4 for row in csv.reader(file)]
 except EnvironmentError:
-    logging.error(f'Can not find project list for {args.lang}')
+    logging.error(f'Can not find project list {list_path} for {args.lang}')
     sys.exit()
+# Some project's git url is in 3rd column, rather than 4th column,
+# which is weird. (Encoding problem) This handles that situation.
+urls = [row[3] if len(row) > 3 and row[3] != '' else row[2] for row in rows]
+# Repositories of different owners may share a name, ids are unique over the whole list
+ids = project_ids([(row[0].split("/")[-1], url) for row, url in zip(rows, urls)])
+for count, (row, url, project_name) in enumerate(zip(rows, urls, ids)):
+    if (count >= from_line) and (count <= end_line) and url != '':
+        if project_name != row[0].split("/")[-1]:
+            logging.info(f'{row[0]} shares its name with another project, it is recorded as {project_name}')
+        project_clone_url_list[project_name] = url
+        # An optional 5th column pins the revision to analyze
+        if len(row) > 4 and row[4] != '':
+            project_revision_list[project_name] = row[4]
 
-# Cloning (or reusing) repository from GitHub
-for project_name in project_clone_url_list.keys():
-    repo_path = f'./repo/{project_name}'
-    abs_repo_path = path.join(path.dirname(__file__), repo_path)
-    abs_repo_path = path.join("..", "..", abs_repo_path)
-    if not path.exists(repo_path):
-        logging.info(f'Cloning \'{project_name}\'')
-        fail_count = 0
-
-        jump = False
-        while not path.exists(repo_path):
-            # Depth 1 for only current revison
-            cmd = f'git clone --depth 1 {project_clone_url_list[project_name]} {repo_path}'
-            cmd = cmd.split(" ")
-
-            proc = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-
-            if not path.exists(repo_path):
-                logging.warning(
-                    f'Failed cloning with return code {proc.poll()}, retry in 2 mins')
-                fail_count += 1
-                if fail_count < 4:
-                    # If fails cloning, retry after cooldown
-                    time.sleep(2*60)
+
+def pending_runners(project_name):
+    return [runner for runner in runners
+            if (only == runner.name or only == '') and (project_name, runner.column) not in completed]
+
+
+def pending_loc(project_name):
+    # LoC is only counted when process all tools
+    return (only == 'loc' or only == '') and (project_name, 'LoC') not in completed
+
+
+def make_job(runner, project_name, abs_repo_path, revision, remaining):
+    def job():
+        try:
+            context = {
+                'project': project_name,
+                'repo': abs_repo_path,
+                'lang': lang,
+                'root': ROOT,
+                'tools': TOOLS,
+            }
+            # A resumed job goes on from the trials it has measured, after warming up again
+            done = measured.get((project_name, runner.column), dict())
+            times = list(done.values())
+            # Warmup runs are numbered from -warmup, and stored but not summarized
+            for trial in list(range(-args.warmup, 0)) + [trial for trial in range(args.repeat) if trial not in done]:
+                result = runner.run(context, timeout, cgroup, args.memory_limit, jvm,
+                                    log_dir=f'./logs/{timestamp}',
+                                    normalize_dir='./out/normalized' if args.normalize else None)
+                # A skipped tool has no result, which is recorded as 0 like any tool that is not run
+                if result is None:
+                    break
+                store.add(run_id, project_name, runner.column, revision, result, trial)
+                # Another try won't make it any faster or smaller
+                if result['killed'] or result['oom']:
+                    break
+                if trial < 0:
                     continue
-                else:
-                    logging.fatal(
-                        f'Unable to clone {project_clone_url_list[project_name]} after 3 tries, go to next')
-                    jump = True
+                times.append(result['time'])
+                # Stop early once samples hardly vary
+                if len(times) >= MIN_TRIALS and cv(times) <= args.stable:
                     break
-        if jump is True:
-            continue
-    else:
-        logging.info(
-            f'Reusing existed local repository for {project_name}')
-    
-    
-
-    records = dict()
-
-    # Obtain LoC (only when process all tools)
-    if only == 'loc' or only == '':
-        print('Counting line of code')
-        LoC = 0
-        cmd = f'./utils/cloc {repo_path} --csv --quiet'
-        cmd = cmd.split(" ")
+            if len(times) > 1:
+                summary = summarize(times)
+                logging.info(
+                    f'{runner.label.format(**context)} on {project_name} takes {summary["median"]:.3f}s in median'
+                    + f' of {summary["n"]} trials, IQR {summary["iqr"]:.3f}s,'
+                    + f' 95% CI [{summary["ci-low"]:.3f}s, {summary["ci-high"]:.3f}s]')
+        finally:
+            # Instantly save results whenever a project is finished analizing
+            # to prevent from crashing.
+            with write_lock:
+                remaining.remove(runner.name)
+                done = len(remaining) == 0
+            if done:
+                store.flush()
+    return job
+
+
+def make_loc_job(project_name, repo_path, revision, remaining):
+    def job():
         try:
+            print('Counting line of code')
             # A fixed timeout threshold is only activated on process all,
             # which allow LoC counting to exeed the time when only process LoC
-            proc = subprocess.check_output(
-                cmd, timeout=180 if only == '' else None)
+            LoC = loc_counter.count(repo_path, lang, timeout=180 if only == '' else None)
         except subprocess.TimeoutExpired:
             logging.exception(
                 f'Counting LoC for {project_name} timed out')
-            records['LoC'] = -1
+            store.add_loc(run_id, project_name, revision, -1)
         except subprocess.CalledProcessError:
             logging.exception(
                 f'Failed couting line of code for {project_name}')
-            records['LoC'] = -1
+            store.add_loc(run_id, project_name, revision, -1)
         else:
-            outs = proc.strip().decode('utf-8').splitlines()
-            for out in outs:
-                out = out.split(',')
-                if len(out) == 5:
-                    if lang == 'java':
-                        if out[1] == 'Java':
-                            LoC += int(out[-1])
-                    elif lang == 'cpp':
-                        try:
-                            ['C++', 'C/C++ Header'].index(out[1])
-                            LoC += int(out[-1])
-                        except:
-                            pass
-                    elif lang == 'c':
-                        try:
-                            ['C++', 'C/C++ Header', 'C'].index(out[1])
-                            LoC += int(out[-1])
-                        except:
-                            pass
-                    elif lang == 'python':
-                        if out[1] == 'Python':
-                            LoC += int(out[-1])
-                    else:
-                        try:
-                            ['JavaScript', 'TypeScript'].index(out[1])
-                            LoC += int(out[-1])
-                        except:
-                            pass
             logging.info(f'LoC for {project_name} is {LoC}')
-        records['LoC'] = LoC
-    else:
-        records['LoC'] = 0
-
-    # Run ENRE
-    if only == 'enre' or only == '':
-        print('Starting ENRE')
-        if args.lang == 'java':
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/enre/enre-java.jar")} java {abs_repo_path} {project_name}'
-        elif args.lang == 'cpp':
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/enre/enre-cpp.jar")} {abs_repo_path} {project_name}'
-        elif args.lang == 'c':
-          # cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/ENRE/ENRE-cpp.jar")} {abs_repo_path} {project_name}'
-            cmd = f'java -jar -Xmx64G {path.join("../..", "./tools/ENRE/ENRE-cpp.jar")} {abs_repo_path} {project_name}'
-        elif args.lang == 'python':
-            cmd = f'{path.join(path.dirname(__file__), "./tools/enre/enre-python.exe")} {abs_repo_path}'
-        else:
-            cmd = f'node {path.join(path.dirname(__file__), "./tools/enre/enre-ts.js")} -i {abs_repo_path} -n {project_name}'
-        print(cmd)
-        cmd = cmd.split(" ")
-
-        # Whether placing the start of timer here or after the creation
-        # has no significant impact on the final duration
-        out_dirpath = f"./out/enre-{lang}"
-        os.makedirs(out_dirpath, exist_ok=True)
-        time_start = time.time()
-        proc = subprocess.Popen(
-            cmd,
-            # Do not use `shell=True`, which will create shell->jvm, a sub-subprocess, which
-            # won't be killed just by calling shell's `.kill()`; whereas,
-            # without shell, the jvm subprocess is directly returned,
-            # which can be killed then.
-            # shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            cwd=f'./out/enre-{lang}')
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running ENRE-{lang} on {project_name} timed out')
-                records['ENRE-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on ENRE-{lang} while process {project_name}')
-        time_end = time.time()
-
-        # No matter it been killed or not, still output the peak memory usage
-        records['ENRE-memory'] = memory['peak']
-        if not killed:
-            # Cancel the timer! if the process is finished within the time
-            try:
-                logging.info(
-                    f'ENRE-{lang} finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
+            store.add_loc(run_id, project_name, revision, LoC)
+        finally:
+            with write_lock:
+                remaining.remove('LoC')
+                done = len(remaining) == 0
+            if done:
+                store.flush()
+    return job
+
+
+# Memory in MB reserved for counting LoC, which holds little more than the list of files
+LOC_MEMORY = 256
+
+write_lock = Lock()
+scheduler = Scheduler(
+    args.jobs,
+    memory=args.memory_budget,
+    # Only parallel runs need the estimation of memory usage
+    history=load_peak_history('./records', store) if args.jobs > 1 else None)
+
+
+if len(completed) != 0:
+    # Projects that have nothing left are not even cloned
+    for project_name in list(project_clone_url_list.keys()):
+        if len(pending_runners(project_name)) == 0 and not pending_loc(project_name) and only != 'clone':
+            logging.info(f'All jobs of {project_name} have completed, skipped')
+            del project_clone_url_list[project_name]
+
+if len(project_revision_list) != 0 and not args.repo_cache:
+    logging.warning('Pinned revisions are only checked out with --repo-cache, using HEAD instead')
+
+# Cloning (or reusing) repository from GitHub, ahead of the analysis
+clone_pool = ClonePool(
+    project_clone_url_list,
+    './repo',
+    workers=args.clone_workers,
+    ahead=args.clone_ahead,
+    mirror=args.mirror,
+    cache=RepoCache('./repo/.cache') if args.repo_cache else None,
+    revisions=project_revision_list).start()
+
+# Code lines of files are cached by content, so re-runs only count what changed
+loc_counter = LocCounter('./out/loc/cache.sqlite', counter=args.loc_counter)
 
-            records['ENRE-time'] = time_end - time_start
-
-            logging.info(
-                f'Running ENRE-{lang} on {project_name} costs {records["ENRE-time"]}s'
-                + (f' and {records["ENRE-memory"]}MB' if records['ENRE-memory'] != -1 else ''))
-    else:
-        records['ENRE-time'] = 0
-        records['ENRE-memory'] = 0
-
-    if only == 'depends' or only == '':
-        # Run Depends
-        print('starting Depends')
-        if lang == 'c':
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/depends.jar")} cpp {abs_repo_path} {project_name} -g var'
-        else:
-            cmd = f'java -jar {path.join(path.dirname(__file__), "./tools/depends.jar")} {lang} {abs_repo_path} {project_name} -g var'
-
-        time_start = time.time()
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            cwd='./out/depends')
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running Depends on {project_name} timed out')
-                records['Depends-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on Depends while process {project_name}')
-        time_end = time.time()
-
-        records['Depends-memory'] = memory['peak']
-        if not killed:
-            try:
-                logging.info('Depends finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
-
-            records['Depends-time'] = time_end - time_start
-            logging.info(
-                f'Running Depends on {project_name} costs {records["Depends-time"]}s'
-                + (f' and {records["Depends-memory"]}MB' if records['Depends-memory'] != -1 else ""))
-    else:
-        records['Depends-time'] = 0
-        records['Depends-memory'] = 0
-
-    if only == 'understand' or only == '':
-        # Run Understand
-        print('Starting Understand')
-        upath = f'./out/understand/{project_name}.und'
-        if lang == 'cpp':
-            ulang = 'C++'
-        elif lang == 'c':
-            ulang = 'C++'
-        elif lang == 'java':
-            ulang = 'Java'
-        elif lang == 'python':
-            ulang = 'Python'
-        else:
-            ulang = 'Web'
-        cmd = f'und create -db {upath} -languages {ulang} add {abs_repo_path} analyze -all'
-
-        time_start = time.time()
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            # `upath` has already set output path to the correct location hence there is no need to set the cwd
-            # cwd='./out/understand'
-        )
-
-        killed = False
-        if timeout is not None:
-            def handle_timeout():
-                global killed
-                killed = True
-                proc.kill()
-                logging.warning(
-                    f'Running Understand on {project_name} timed out')
-                records['Understand-time'] = -1
-
-            timer = Timer(timeout, handle_timeout)
-            timer.start()
-
-        pid = proc.pid
-        memory = memory_profiling(pid)
-        try:
-            for line in io.TextIOWrapper(proc.stdout):
-                print(line, end='')
-        except UnicodeDecodeError:
-            logging.warning(
-                f'Suppressing an encoding error on Understand while process {project_name}')
-        time_end = time.time()
-
-        records['Understand-memory'] = memory['peak']
-        if not killed:
-            try:
-                logging.info('Process finished normally, cancel the timer')
-                timer.cancel()
-            except:
-                pass
-
-            records['Understand-time'] = time_end - time_start
-            logging.info(
-                f'Running Understand on {project_name} costs {records["Understand-time"]}s'
-                + (f' and {records["Understand-memory"]}MB' if records['Understand-memory'] != -1 else ""))
-    else:
-        records['Understand-time'] = 0
-        records['Understand-memory'] = 0
-
-    if only == 'sourcetrail' or only == '':
-        # Run SourceTrail (only if the project has been created before)
-        print('Start SourceTrail')
-        spath = f'./out/sourcetrail/{project_name}.srctrlprj'
-        if path.exists(spath):
-            cmd = f'"C:\Program Files\Sourcetrail\Sourcetrail.exe" index --project-file {path.join(path.dirname(__file__), spath)}'
-
-            time_start = time.time()
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT)
-
-            killed = False
-            if timeout is not None:
-                def handle_timeout():
-                    global killed
-                    killed = True
-                    proc.kill()
-                    logging.warning(
-                        f'Running Sourcetrail on {project_name} timed out')
-                    records['SourceTrail-time'] = -1
-
-                timer = Timer(timeout, handle_timeout)
-                timer.start()
-
-            pid = proc.pid
-            memory = memory_profiling(pid)
-            try:
-                for line in io.TextIOWrapper(proc.stdout):
-                    print(line, end='')
-            except UnicodeDecodeError:
-                logging.warning(
-                    f'Suppressing an encoding error on SourceTrail while process {project_name}')
-            time_end = time.time()
-
-            records['SourceTrail-memory'] = memory['peak']
-            if not killed:
-                try:
-                    logging.info('Process finished normally, cancel the timer')
-                    timer.cancel()
-                except:
-                    pass
-
-                records['SourceTrail-time'] = time_end - time_start
-                logging.info(
-                    f'Running SourceTrail on {project_name} costs {records["SourceTrail-time"]}s'
-                    + (f' and {records["SourceTrail-memory"]}MB' if records['SourceTrail-memory'] != -1 else ""))
-        else:
-            logging.warning(
-                f'No SourceTrail project for {project_name}, skipped')
-            records['SourceTrail-time'] = 0
-            records['SourceTrail-memory'] = 0
-    else:
-        records['SourceTrail-time'] = 0
-        records['SourceTrail-memory'] = 0
-
-    # Instantly save duration info whenever a project is finished analizing
-    # to prevent from crashing.
-    with open(f'{outfile_path}.pending', 'a+') as f:
-        f.write(
-            f'{project_name}'
-            + f',{records["LoC"]}'
-            + f',{records["Depends-time"]}'
-            + f',{records["Depends-memory"]}'
-            + f',{records["ENRE-time"]}'
-            + f',{records["ENRE-memory"]}'
-            + f',{records["SourceTrail-time"]}'
-            + f',{records["SourceTrail-memory"]}'
-            + f',{records["Understand-time"]}'
-            + f',{records["Understand-memory"]}'
-            + '\n')
-
-try:
-    # Remove `.pending` identifier to indicates to whole process succeeded
-    # After the finishing of this script, if `.pending` still exists,
-    # you might want to check out log files since it's a sign of some exception
-    # has taken place.
-    rename(f'{outfile_path}.pending', outfile_path)
-except:
-    logging.error(f'Lost output file {outfile_path}!')
+for project_name in project_clone_url_list.keys():
+    repo_path = clone_pool.wait(project_name)
+    if repo_path is None:
+        continue
+    # Tools are run in their own output directories, so pass an absolute path
+    abs_repo_path = path.abspath(repo_path)
+
+    revision = clone_pool.revision_of(project_name)
+
+    # Tools that are not going to run have no result, and are exported as 0
+    selected = pending_runners(project_name)
+
+    # LoC (only when process all tools) is a job of its own, so that under `--jobs`
+    # the cores it counts on are reserved rather than taken from measured tools
+    remaining = (['LoC'] if pending_loc(project_name) else []) + [runner.name for runner in selected]
+    if len(remaining) == 0:
+        store.flush()
+        continue
+
+    if pending_loc(project_name):
+        scheduler.submit(
+            project_name,
+            'LoC',
+            make_loc_job(project_name, repo_path, revision, remaining),
+            cores=loc_counter.workers if args.loc_counter == 'native' else 1,
+            memory=LOC_MEMORY)
+    for runner in selected:
+        scheduler.submit(
+            project_name,
+            runner.column,
+            make_job(runner, project_name, abs_repo_path, revision, remaining),
+            cores=args.cores_per_job)
+
+    # Without `--jobs`, keep the original behavior of finishing a project
+    # before moving to (and cloning) the next one
+    if args.jobs == 1:
+        scheduler.join()
+
+scheduler.join()
+clone_pool.close()
+loc_counter.close()
+if jvm is not None:
+    jvm.close()
+
+# A run without completion in the store is a sign of some exception
+# has taken place, you might want to check out log files then.
+store.finish_run(run_id)
+phases = []
+for runner in runners:
+    profile = runner.profile(lang)
+    if profile is not None:
+        phases += [name for name in ['startup'] + profile.names if name not in phases]
+store.export_csv(
+    outfile_path,
+    [runner.column for runner in runners],
+    run=run_id,
+    # Accounting only a cgroup can provide goes right after time and memory
+    columns=(CGROUP_COLUMNS if cgroup is not None else []) + (['jvm-startup', 'jvm-warm-memory', 'jvm-pool-memory'] if jvm is not None else [])
+    + ['returncode'] + RUSAGE_COLUMNS + [f'phase-{name}' for name in phases]
+    + (['entities', 'relations', 'relations-per-second'] if args.normalize else []),
+    stats=args.repeat > 1)
+store.close()
 
 logging.info('Run has completed')
@@ -4,6 +4,9 @@ import os
 import csv
 from collections import defaultdict
 
+from utils.store import ResultStore
+from utils.edges import read_meta
+
 def read_csv(filepath):
   rows = []
   with open(filepath, 'r') as f:
@@ -12,11 +15,6 @@ def read_csv(filepath):
       rows.append(row)
   return rows
 
-def read_lines(filepath):
-  with open(filepath, 'r') as f:
-    lines = f.readlines()
-  return lines
-
 def write_csv(rows, filepath):
   with open(filepath, 'w') as f:
     writer = csv.writer(f)
@@ -31,41 +29,49 @@ def read_list():
 
 def read_enre():
   out_dirpath = "./out/enre-c"
+  normalized_dirpath = "./out/normalized"
   res = set()
   for filename in os.listdir(out_dirpath):
     filepath = os.path.join(out_dirpath, filename)
-    file_stat = os.stat(filepath)
-    if file_stat.st_size == 52:
+    # do.py writes the output of every project into a directory of its own
+    if os.path.isdir(filepath):
+      outputs = [os.path.join(filepath, name) for name in os.listdir(filepath) if name.endswith(".json")]
+      if len(outputs) == 0:
+        continue
+      filepath = max(outputs, key=os.path.getsize)
+      project_name = filename
+    else:
+      project_name = filename.split("_out")[0]
+    # Outputs normalized by `do.py --normalize` tell whether any relation was extracted
+    edges_dirpath = os.path.join(normalized_dirpath, "{}.ENRE-c.edges".format(project_name))
+    if os.path.exists(os.path.join(edges_dirpath, "meta.json")):
+      if read_meta(edges_dirpath)["relations"] == 0:
+        continue
+    # Otherwise only the size of an empty output is known
+    elif os.stat(filepath).st_size == 52:
       continue
-    res.add(filename.split("_out")[0])
+    res.add(project_name)
   return res
 
-def read_log():
-  time_log_filepath = "./logs/2308281543.log"
-  loc_log_filepath = "./logs/2308281549.log"
-  time_lines = read_lines(time_log_filepath)
-  loc_lines = read_lines(loc_log_filepath)
+def read_store():
+  store = ResultStore("./records/results.sqlite")
   name_map = defaultdict()
-  for line in time_lines:
-    if line.startswith("INFO:root:Running ENRE-c on"):
-      sp = line.strip().split(" ")
-      name = sp[3]
-      time = sp[5]
-      memory = sp[7]
-      name_map[name] = [name, time, memory]
+  for result in store.query(lang="c", tool="ENRE"):
+    # Killed runs have no meaningful time
+    if result["timed_out"] or result["oom"] or result["time"] is None:
+      continue
+    memory = result["memory"] if result["memory"] is not None else -1
+    name_map[result["project"]] = [result["project"], result["time"], memory]
 
-  for line in loc_lines:
-    if line.startswith("INFO:root:LoC for"):
-      sp = line.strip().split(" ")
-      name = sp[2]
-      loc = sp[4]
-      if name not in name_map:
-        print("{} has no time/memory result".format(name))
-      else:
-        name_map[name].append(loc)
+  for name, loc in store.loc(lang="c").items():
+    if name not in name_map:
+      print("{} has no time/memory result".format(name))
+    else:
+      name_map[name].append(loc if loc is not None else -1)
+  store.close()
   return name_map
 
-def filter_and_fill(lists, enre_set, log_map):
+def filter_and_fill(lists, enre_set, store_map):
   failed = []
   name_map = defaultdict()
   for item in lists:
@@ -73,11 +79,11 @@ def filter_and_fill(lists, enre_set, log_map):
     if short_name not in enre_set:
       failed.append(item)
       continue
-    log_res = log_map[short_name]
+    res = store_map[short_name]
     name_map[short_name] = item + [
-        "{:.3f}".format(float(log_res[1][:-1])),
-        "{:.3f}".format(float(log_res[2][:-2]) / 1024),
-        "{:.3f}".format(int(log_res[3]) / 1000),
+        "{:.3f}".format(res[1]),
+        "{:.3f}".format(res[2] / 1024),
+        "{:.3f}".format(res[3] / 1000),
     ]
   rows = [["name", "stars", "html url", "clone url", "time (s)", "memory (GB)", "KLoC"]]
   rows += list(name_map.values())
@@ -93,7 +99,7 @@ def write_result(result, failed):
 if __name__ == '__main__':
   lists = read_list()
   enre_set = read_enre()
-  log_name_map = read_log()
-  result_rows, failed_rows = filter_and_fill(lists, enre_set, log_name_map)
+  store_name_map = read_store()
+  result_rows, failed_rows = filter_and_fill(lists, enre_set, store_name_map)
   write_result(result_rows, failed_rows)
 
@@ -0,0 +1,54 @@
+'''
+Streaming JSON reading of tool outputs, wherever the reads happen to be cut.
+'''
+
+import io
+import json
+
+from utils.normalize import JsonStream
+
+
+DOCUMENT = json.dumps({
+    'schemaVersion': 1.5,
+    'variables': [
+        {'id': 12, 'qualifiedName': 'a.B', 'category': 'Class', 'weight': -0.25},
+        {'id': 1e-07, 'qualifiedName': 'a.B.c', 'category': 'Method', 'weight': 3.5E+20},
+        {'id': -7, 'qualifiedName': 'a\\nb "c"', 'category': None, 'flags': [True, False]},
+    ],
+    'cells': [{'src': 12, 'dest': -7, 'values': {'Call': 2.0}}],
+    'count': 123456789,
+    'ratio': 0.5,
+})
+
+
+class SplitFile:
+    '''A text file whose first read stops at `offset`.'''
+
+    def __init__(self, text, offset):
+        self.file = io.StringIO(text)
+        self.offset = offset
+
+    def read(self, size):
+        if self.offset is not None:
+            size, self.offset = self.offset, None
+        return self.file.read(size)
+
+
+def expected():
+    result = []
+    for key, value in json.loads(DOCUMENT).items():
+        if isinstance(value, list):
+            result += [(key, index, element) for index, element in enumerate(value)]
+        else:
+            result.append((key, None, value))
+    return result
+
+
+def test_split_at_every_offset():
+    for offset in range(1, len(DOCUMENT)):
+        assert list(JsonStream(SplitFile(DOCUMENT, offset), chunk=len(DOCUMENT)).walk()) == expected(), offset
+
+
+def test_every_chunk_size():
+    for chunk in range(1, 64):
+        assert list(JsonStream(io.StringIO(DOCUMENT), chunk=chunk).walk()) == expected(), chunk
@@ -0,0 +1,47 @@
+'''
+Resuming a run through the result store, as do.py does with --resume and --repeat.
+'''
+
+from utils.store import ResultStore
+
+
+def result(time, returncode=0, killed=False):
+    return {'time': time, 'memory': 100, 'returncode': returncode, 'killed': killed, 'oom': False}
+
+
+def test_resumed_trial_replaces_failed_one(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    run_id = store.start_run('java', 1, 1)
+    store.add(run_id, 'fastjson', 'ENRE', None, result(100.0), trial=0)
+    store.add(run_id, 'fastjson', 'ENRE', None, result(2.0, returncode=1), trial=1)
+    store.flush()
+
+    # The failed trial is all that is left to run
+    assert store.trials(run_id) == {('fastjson', 'ENRE'): {0: 100.0}}
+    assert store.completed(run_id, repeat=2) == set()
+
+    store.add(run_id, 'fastjson', 'ENRE', None, result(102.0), trial=1)
+    store.flush()
+    assert store.trials(run_id) == {('fastjson', 'ENRE'): {0: 100.0, 1: 102.0}}
+    assert store.completed(run_id, repeat=2) == {('fastjson', 'ENRE')}
+
+    summary = store.summary(run=run_id)[('fastjson', 'ENRE')]
+    assert summary['time']['n'] == 2
+    assert summary['time']['median'] == 101.0
+    assert summary['failed'] == 0
+    assert summary['latest']['returncode'] == 0
+    store.close()
+
+
+def test_killed_trial_is_run_again(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    run_id = store.start_run('java', 1, 1)
+    store.add(run_id, 'fastjson', 'ENRE', None, result(-1, killed=True), trial=0)
+    store.flush()
+    assert store.trials(run_id) == {}
+
+    store.add(run_id, 'fastjson', 'ENRE', None, result(5.0), trial=0)
+    store.flush()
+    assert store.completed(run_id) == {('fastjson', 'ENRE')}
+    assert store.summary(run=run_id)[('fastjson', 'ENRE')]['time']['median'] == 5.0
+    store.close()
@@ -0,0 +1,236 @@
+'''
+Optional execution backend running every tool inside a transient cgroup v2 group.
+
+The kernel then accounts the whole process tree exactly: `memory.peak`,
+CPU time, IO bytes and pressure stall information are read from the group
+once the tool exits, and `memory.max` enforces a memory cap without any
+polling.
+
+The backend needs a cgroup v2 directory that is writable by the current
+user and does not hold processes itself, e.g. one delegated by systemd:
+
+    $ systemd-run --user --scope -p Delegate=yes --unit=usability bash
+    $ mkdir /sys/fs/cgroup/user.slice/.../usability.scope/jobs
+
+or one created by root and handed over with `chown -R`. A group holding
+processes can't pass controllers on to its children (the "no internal
+processes" rule of cgroup v2), so when the parent of that directory holds
+processes, as the scope above holds the shell and the harness, they are
+first moved into a leaf group `harness` next to it.
+'''
+
+import os
+import time
+import uuid
+import logging
+
+
+# Extra per-tool columns in records, in this order
+COLUMNS = ['cpu-user', 'cpu-system', 'io-read', 'io-write', 'psi-cpu', 'psi-memory', 'psi-io']
+CONTROLLERS = ['memory', 'cpu', 'io']
+
+
+def read_procs(path):
+    '''Returns the pids of the processes in the group at `path`.'''
+    try:
+        with open(os.path.join(path, 'cgroup.procs'), 'r') as f:
+            return [int(line) for line in f if line.strip() != '']
+    except (EnvironmentError, ValueError):
+        return []
+
+
+def read_controllers(path):
+    try:
+        with open(os.path.join(path, 'cgroup.controllers'), 'r') as f:
+            return f.read().split()
+    except EnvironmentError:
+        return []
+
+
+def read_keyed(filepath):
+    '''Parse files like cpu.stat and memory.events, which are made of `key value` lines.'''
+    values = dict()
+    try:
+        with open(filepath, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2:
+                    values[fields[0]] = int(fields[1])
+    except (EnvironmentError, ValueError):
+        pass
+    return values
+
+
+def read_io(filepath):
+    '''Returns (read bytes, written bytes) summed over all devices in io.stat.'''
+    rbytes = wbytes = 0
+    try:
+        with open(filepath, 'r') as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        rbytes += int(value)
+                    elif key == 'wbytes':
+                        wbytes += int(value)
+    except (EnvironmentError, ValueError):
+        return -1, -1
+    return rbytes, wbytes
+
+
+def read_pressure(filepath):
+    '''Returns the total time in seconds some task was stalled, from a *.pressure file.'''
+    try:
+        with open(filepath, 'r') as f:
+            for line in f:
+                if line.startswith('some'):
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition('=')
+                        if key == 'total':
+                            return int(value) / 10 ** 6
+    except (EnvironmentError, ValueError):
+        pass
+    return -1
+
+
+class Cgroup:
+    '''A transient group holding a single tool run, see `CgroupBackend.create`.'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def wrap(self, cmd):
+        '''
+        Make `cmd` join this group before it starts.
+
+        A tiny shell moves itself into the group and then `exec`s the tool, so
+        the tool keeps the pid that is returned by Popen. This is used instead
+        of `preexec_fn`, which is not safe with the scheduler's threads.
+        '''
+        return ['sh', '-c', 'echo 0 > "$0/cgroup.procs" && exec "$@"', self.path] + list(cmd)
+
+    def stats(self):
+        '''
+        Read the accounting of the group, times are in seconds, sizes in MB.
+
+        `oom` tells whether the kernel killed something for exceeding `memory.max`.
+        '''
+        cpu = read_keyed(os.path.join(self.path, 'cpu.stat'))
+        events = read_keyed(os.path.join(self.path, 'memory.events'))
+        rbytes, wbytes = read_io(os.path.join(self.path, 'io.stat'))
+        try:
+            with open(os.path.join(self.path, 'memory.peak'), 'r') as f:
+                peak = int(f.read()) / 1024 ** 2
+        except (EnvironmentError, ValueError):
+            peak = -1
+        return {
+            'memory': peak,
+            'cpu-user': cpu['user_usec'] / 10 ** 6 if 'user_usec' in cpu else -1,
+            'cpu-system': cpu['system_usec'] / 10 ** 6 if 'system_usec' in cpu else -1,
+            'io-read': rbytes / 1024 ** 2 if rbytes != -1 else -1,
+            'io-write': wbytes / 1024 ** 2 if wbytes != -1 else -1,
+            'psi-cpu': read_pressure(os.path.join(self.path, 'cpu.pressure')),
+            'psi-memory': read_pressure(os.path.join(self.path, 'memory.pressure')),
+            'psi-io': read_pressure(os.path.join(self.path, 'io.pressure')),
+            'oom': events.get('oom_kill', 0) > 0,
+        }
+
+    def remove(self):
+        '''Kill whatever is left in the group and delete it.'''
+        try:
+            # cgroup.kill is only available from Linux 5.14
+            with open(os.path.join(self.path, 'cgroup.kill'), 'w') as f:
+                f.write('1')
+        except EnvironmentError:
+            pass
+        # The group can only be removed once its last process is reaped
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.1)
+        logging.warning(f'Can not remove cgroup {self.path}, it still has processes')
+
+
+class CgroupBackend:
+    '''
+    Create a group under `root` for every tool run.
+
+    If `memory_max` (in MB) is given, it is written to `memory.max` of every
+    group so that the kernel kills the tool once it uses more than that.
+    '''
+
+    def __init__(self, root, memory_max=None):
+        if not os.path.exists(os.path.join(root, 'cgroup.controllers')):
+            raise ValueError(f'{root} is not a cgroup v2 directory')
+        if not os.access(root, os.W_OK):
+            raise ValueError(f'{root} is not writable, delegate it to the current user first')
+        if len(read_procs(root)) != 0:
+            raise ValueError(f'{root} holds processes, use an empty group that only tools are run under')
+        self.root = root
+        self.memory_max = memory_max
+
+        parent = os.path.dirname(os.path.normpath(root))
+        if any(c not in read_controllers(root) for c in CONTROLLERS) and len(read_procs(parent)) != 0:
+            self._leave(parent)
+            self._enable(parent)
+        self._enable(root)
+        available = read_controllers(root)
+        if 'memory' not in available:
+            raise ValueError(f'The memory controller is not available in {root}, check `Delegate=yes`'
+                             + f' and that {parent} holds no processes')
+        missing = [c for c in CONTROLLERS if c not in available]
+        if len(missing) != 0:
+            logging.warning(f'Controllers {", ".join(missing)} are not available in {root}')
+
+    @staticmethod
+    def _leave(parent):
+        '''Move every process of `parent`, the harness among them, into the leaf group `parent/harness`.'''
+        leaf = os.path.join(parent, 'harness')
+        os.makedirs(leaf, exist_ok=True)
+        # Processes may fork while being moved, until none is left
+        for _ in range(10):
+            pids = read_procs(parent)
+            if len(pids) == 0:
+                break
+            for pid in pids:
+                try:
+                    with open(os.path.join(leaf, 'cgroup.procs'), 'w') as f:
+                        f.write(str(pid))
+                except ProcessLookupError:
+                    pass
+                except EnvironmentError as e:
+                    raise ValueError(f'Can not move process {pid} out of {parent} into {leaf}: {e}')
+        logging.info(f'Moved the processes of {parent} into {leaf}, so that it can delegate controllers')
+
+    @staticmethod
+    def _enable(path):
+        '''Make the controllers available to the groups created below `path`.'''
+        available = read_controllers(path)
+        try:
+            with open(os.path.join(path, 'cgroup.subtree_control'), 'w') as f:
+                f.write(' '.join(f'+{c}' for c in CONTROLLERS if c in available))
+        except EnvironmentError as e:
+            raise ValueError(f'Can not enable controllers in {path}, make sure it does not hold any process: {e}')
+
+    def create(self, name, memory_max=None):
+        '''Create a new group for a run of `name`, `memory_max` overrides the backend's cap.'''
+        # Tool labels may contain characters that are fine in logs but not in paths
+        name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        path = os.path.join(self.root, f'{name}-{uuid.uuid4().hex[:8]}')
+        os.mkdir(path)
+
+        memory_max = memory_max if memory_max is not None else self.memory_max
+        if memory_max is not None:
+            with open(os.path.join(path, 'memory.max'), 'w') as f:
+                f.write(str(int(memory_max * 1024 ** 2)))
+            # Don't let the tool swap instead of being killed, where swap is accounted
+            try:
+                with open(os.path.join(path, 'memory.swap.max'), 'w') as f:
+                    f.write('0')
+            except EnvironmentError:
+                pass
+        return Cgroup(path)
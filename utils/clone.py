@@ -0,0 +1,283 @@
+'''
+Prefetch stage cloning repositories ahead of the analysis queue.
+
+Worker threads clone up to `ahead` projects beyond the one being analyzed,
+so analyzing project N overlaps with cloning N+1..N+k. A failed clone is
+retried with exponential backoff without blocking other repositories, and
+the status of every clone is kept in a manifest so an interrupted run can
+be resumed.
+
+A clone is made into a temporary directory and renamed into place once
+complete, so an existing `repo/<project_name>` is always a whole clone.
+With a `RepoCache`, revisions are checked out from the cache instead.
+The manifest records the commit every project was analyzed at.
+
+Projects are keyed by the ids of `project_ids`, which are their repository
+names unless several repositories of a list share one.
+'''
+
+import os
+import json
+import time
+import shutil
+import logging
+import subprocess
+from threading import Thread, Condition
+
+from utils.repocache import url_key
+
+
+PENDING = 'pending'
+CLONED = 'cloned'
+FAILED = 'failed'
+
+
+def repo_name(url):
+    '''Returns the name of the repository at `url`, its last path segment without `.git`.'''
+    name = url.rstrip('/').split('/')[-1]
+    return name[:-len('.git')] if name.endswith('.git') else name
+
+
+def project_ids(projects):
+    '''
+    Returns a unique id of each (name, url) of `projects`, in the same order.
+
+    The id is the name itself, or the name and a hash of the url (as keys of
+    `RepoCache`) for every project whose name is shared by another one, e.g.
+    `owner-a/utils` and `owner-b/utils`. Pass all projects of a list, rather
+    than a range of them, for ids that are stable across runs.
+    '''
+    counts = dict()
+    for name, _ in projects:
+        counts[name] = counts.get(name, 0) + 1
+    return [name if counts[name] == 1 else f'{name}-{url_key(url)}' for name, url in projects]
+
+
+def mirror_source(mirror, project_name, url):
+    '''
+    Find the local bare repository of a project under `mirror`, or None.
+
+    Both `<mirror>/<name>.git` and `<mirror>/<owner>/<name>.git` layouts are
+    accepted, as well as the same paths without `.git`.
+    '''
+    owner = url.rstrip('/').split('/')[-2] if url.count('/') >= 1 else ''
+    for candidate in [
+        os.path.join(mirror, f'{project_name}.git'),
+        os.path.join(mirror, project_name),
+        os.path.join(mirror, owner, f'{project_name}.git'),
+        os.path.join(mirror, owner, project_name),
+    ]:
+        if os.path.isdir(candidate):
+            # `--depth` is ignored for plain local paths
+            return 'file://' + os.path.abspath(candidate)
+    return None
+
+
+def head_of(repo_path):
+    '''Returns the commit checked out in `repo_path`, or None if it is not a git repository.'''
+    proc = subprocess.run(
+        ['git', '-C', repo_path, 'rev-parse', 'HEAD'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.decode('utf-8').strip()
+
+
+class ClonePool:
+    '''
+    Clone `projects` (an ordered dict of project id -> clone url) into `repo_dir`.
+
+    workers: number of concurrent `git clone`s
+    ahead: how many projects after the current one may be cloned in advance
+    retries: attempts after the first failure, waiting backoff * 2 ** n seconds before the n-th
+    mirror: directory of bare repositories used instead of the remote when it has the project
+    cache: a `RepoCache` to check out from, instead of cloning into `repo_dir/<project_name>`
+    revisions: project id -> revision to check out (requires `cache`), HEAD otherwise
+    '''
+
+    def __init__(self, projects, repo_dir='./repo', workers=1, ahead=2, retries=3, backoff=2 * 60,
+                 mirror=None, manifest=None, cache=None, revisions=None):
+        self.projects = list(projects.keys())
+        self.urls = dict(projects)
+        self.cache = cache
+        self.revisions = revisions if revisions is not None else dict()
+        self.repo_dir = repo_dir
+        self.workers = max(1, workers)
+        self.ahead = max(0, ahead)
+        self.retries = retries
+        self.backoff = backoff
+        self.mirror = mirror
+        self.manifest_path = manifest if manifest is not None else os.path.join(repo_dir, 'manifest.json')
+
+        self._cond = Condition()
+        self._current = 0
+        self._cloning = set()
+        self._closed = False
+        self._threads = []
+        self.manifest = self._load_manifest()
+
+        for project_name in self.projects:
+            entry = self.manifest.setdefault(project_name, {'url': self.urls[project_name]})
+            if self._reusable(project_name, entry):
+                if entry.get('status') != CLONED:
+                    logging.info(f'Reusing existed local repository for {project_name}')
+                entry['status'] = CLONED
+                if 'commit' not in entry:
+                    entry['commit'] = head_of(self.path_of(project_name))
+            else:
+                # Resume anything unfinished, a failure from a past run is given another chance
+                entry.update({'url': self.urls[project_name], 'status': PENDING, 'attempts': 0, 'not_before': 0})
+        self._save_manifest()
+
+    def _reusable(self, project_name, entry):
+        if self.cache is None:
+            return os.path.exists(self.path_of(project_name))
+        # A cached checkout is only reused if it is of the same url and the wanted revision
+        revision = self.revisions.get(project_name)
+        return entry.get('url') == self.urls[project_name] \
+            and 'path' in entry and os.path.exists(entry['path']) \
+            and (revision is None or revision == entry.get('revision') or revision == entry.get('commit'))
+
+    def path_of(self, project_name):
+        if self.cache is not None:
+            return self.manifest[project_name].get('path')
+        return os.path.join(self.repo_dir, project_name)
+
+    def revision_of(self, project_name):
+        '''Returns the commit `project_name` has been checked out at, or None if unknown.'''
+        return self.manifest[project_name].get('commit')
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = Thread(target=self._work, daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def wait(self, project_name):
+        '''
+        Mark `project_name` as the one being analyzed and block until it is cloned.
+
+        Returns the repository path, or None if cloning finally failed.
+        '''
+        with self._cond:
+            self._current = max(self._current, self.projects.index(project_name))
+            self._cond.notify_all()
+            while self.manifest[project_name]['status'] == PENDING:
+                self._cond.wait()
+            if self.manifest[project_name]['status'] == CLONED:
+                return self.path_of(project_name)
+            return None
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError):
+            return dict()
+
+    def _save_manifest(self):
+        # Must be called with `self._cond` held (or before workers start)
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _next(self):
+        # Must be called with `self._cond` held, returns (project_name, seconds to wait)
+        soonest = None
+        window = self.projects[:self._current + self.ahead + 1]
+        for project_name in window:
+            entry = self.manifest[project_name]
+            if entry['status'] != PENDING or project_name in self._cloning:
+                continue
+            delay = entry['not_before'] - time.time()
+            if delay <= 0:
+                return project_name, 0
+            soonest = delay if soonest is None else min(soonest, delay)
+        return None, soonest
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    project_name, delay = self._next()
+                    if project_name is not None:
+                        break
+                    self._cond.wait(delay)
+                self._cloning.add(project_name)
+                entry = self.manifest[project_name]
+                entry['attempts'] += 1
+
+            ok, message = self._clone(project_name)
+
+            with self._cond:
+                self._cloning.discard(project_name)
+                if ok:
+                    entry['status'] = CLONED
+                    entry.pop('error', None)
+                    logging.info(f'Cloned \'{project_name}\'')
+                elif entry['attempts'] > self.retries:
+                    entry['status'] = FAILED
+                    entry['error'] = message
+                    logging.fatal(
+                        f'Unable to clone {entry["url"]} after {entry["attempts"]} tries, go to next')
+                else:
+                    cooldown = self.backoff * 2 ** (entry['attempts'] - 1)
+                    entry['not_before'] = time.time() + cooldown
+                    entry['error'] = message
+                    logging.warning(
+                        f'Failed cloning {project_name} ({message}), retry in {cooldown}s')
+                self._save_manifest()
+                self._cond.notify_all()
+
+    def _clone(self, project_name):
+        url = self.urls[project_name]
+        source = None
+        if self.mirror is not None:
+            source = mirror_source(self.mirror, repo_name(url), url)
+
+        entry = self.manifest[project_name]
+        if self.cache is not None:
+            revision = self.revisions.get(project_name)
+            logging.info(f'Checking out \'{project_name}\' at {revision if revision is not None else "HEAD"}')
+            try:
+                path, commit = self.cache.checkout(url, revision, source)
+            except RuntimeError as e:
+                return False, str(e)
+            with self._cond:
+                entry.update({'path': path, 'commit': commit, 'revision': revision})
+            return True, None
+
+        if source is None:
+            source = url
+        repo_path = self.path_of(project_name)
+        tmp_path = os.path.join(self.repo_dir, f'.{project_name}.cloning')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        logging.info(f'Cloning \'{project_name}\' from {source}')
+        # Depth 1 for only current revison
+        proc = subprocess.run(
+            ['git', 'clone', '--depth', '1', source, tmp_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        if proc.returncode != 0 or not os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            lines = proc.stdout.decode('utf-8', errors='replace').strip().splitlines()
+            return False, lines[-1] if len(lines) != 0 else f'return code {proc.returncode}'
+        os.rename(tmp_path, repo_path)
+        commit = head_of(repo_path)
+        with self._cond:
+            entry['commit'] = commit
+        return True, None
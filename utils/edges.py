@@ -0,0 +1,157 @@
+'''
+Compact columnar format of the entities and relations extracted by a tool.
+
+Whatever a tool writes, once normalized (see `utils.normalize`) its output
+is a directory `<name>.edges` of one file per column, every integer column
+a flat little-endian array:
+
+    meta.json            tool, source, counts and the kind dictionaries
+    entity_kind.u16      kind of every entity, an index into meta['entity_kinds']
+    entity_name.txt      qualified name of every entity, one per line, \n and \r escaped
+    relation_src.u32     source entity of every relation
+    relation_dst.u32     destination entity of every relation
+    relation_kind.u16    kind of every relation, an index into meta['relation_kinds']
+    relation_count.u32   how many times the relation occurs, e.g. calls of a method
+
+Entities are numbered densely from 0 in the order they are first seen,
+whichever ids the tool gave them. Relations are written out in batches as
+they are read, so only the entities are held in memory, and the columns
+can be loaded straight into arrays (`array.fromfile`, `numpy.fromfile`
+or memory mapped) without parsing anything.
+'''
+
+import os
+import sys
+import json
+import shutil
+from array import array
+
+
+# Relations buffered before being appended to their column files
+BATCH = 64 * 1024
+
+RELATION_COLUMNS = [('relation_src', 'I'), ('relation_dst', 'I'), ('relation_kind', 'H'), ('relation_count', 'I')]
+
+
+def _dump(values, f):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+class EdgeWriter:
+    '''
+    Write a `.edges` directory at `path`, replacing any previous one.
+
+    Entities and relations refer to entities by the tool's own keys (ids,
+    indices or names), which are mapped to dense ids.
+    '''
+
+    def __init__(self, path, tool, source=None):
+        self.path = path
+        self.tool = tool
+        self.source = source
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        # key -> dense id
+        self._ids = dict()
+        self._names = []
+        self._kinds = array('H')
+        self.entity_kinds = dict()
+        self.relation_kinds = dict()
+        self.relations = 0
+        self._files = {name: open(os.path.join(path, f'{name}.{"u16" if typecode == "H" else "u32"}'), 'wb')
+                       for name, typecode in RELATION_COLUMNS}
+        self._buffers = {name: array(typecode) for name, typecode in RELATION_COLUMNS}
+
+    def _id(self, key):
+        id = self._ids.get(key)
+        if id is None:
+            # Referred to before it is listed, if it ever is
+            id = self._ids[key] = len(self._names)
+            self._names.append('')
+            self._kinds.append(self._kind(self.entity_kinds, ''))
+        return id
+
+    @staticmethod
+    def _kind(kinds, kind):
+        index = kinds.get(kind)
+        if index is None:
+            index = kinds[kind] = len(kinds)
+        return index
+
+    def entity(self, key, name, kind):
+        '''Add the entity `key`, or name one that relations already referred to. Returns its dense id.'''
+        # Names are one per line, and lines are only ever split at \n when read
+        name = name.replace('\n', '\\n').replace('\r', '\\r')
+        kind = self._kind(self.entity_kinds, kind)
+        id = self._ids.get(key)
+        if id is None:
+            id = self._ids[key] = len(self._names)
+            self._names.append(name)
+            self._kinds.append(kind)
+        else:
+            self._names[id] = name
+            self._kinds[id] = kind
+        return id
+
+    def relation(self, src, dst, kind, count=1):
+        buffers = self._buffers
+        buffers['relation_src'].append(self._id(src))
+        buffers['relation_dst'].append(self._id(dst))
+        buffers['relation_kind'].append(self._kind(self.relation_kinds, kind))
+        buffers['relation_count'].append(count)
+        self.relations += 1
+        if len(buffers['relation_src']) >= BATCH:
+            self._flush()
+
+    def _flush(self):
+        for name, typecode in RELATION_COLUMNS:
+            _dump(self._buffers[name], self._files[name])
+            self._buffers[name] = array(typecode)
+
+    def close(self, **meta):
+        '''Write the entities and the meta data, extended with `meta`, and return the meta data.'''
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        with open(os.path.join(self.path, 'entity_kind.u16'), 'wb') as f:
+            _dump(self._kinds, f)
+        with open(os.path.join(self.path, 'entity_name.txt'), 'w', encoding='utf-8', newline='\n') as f:
+            for name in self._names:
+                f.write(name + '\n')
+        meta = dict({
+            'tool': self.tool,
+            'source': self.source,
+            'entities': len(self._names),
+            'relations': self.relations,
+            'entity_kinds': list(self.entity_kinds),
+            'relation_kinds': list(self.relation_kinds),
+        }, **meta)
+        with open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_column(path, name):
+    '''Returns a column of the `.edges` directory at `path` as an `array`.'''
+    typecode = 'H' if name.endswith('kind') else 'I'
+    values = array(typecode)
+    filepath = os.path.join(path, f'{name}.{"u16" if typecode == "H" else "u32"}')
+    with open(filepath, 'rb') as f:
+        values.frombytes(f.read())
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def read_names(path):
+    with open(os.path.join(path, 'entity_name.txt'), 'r', encoding='utf-8', newline='\n') as f:
+        return [line[:-1] for line in f]
@@ -0,0 +1,142 @@
+'''
+Stand-in analyzer for testing the harness where the real tools are not installed.
+
+It behaves like a tool whose cost is known in advance: it keeps the CPU
+busy for a set number of seconds, follows a set memory profile, spawns
+child processes, prints output at a set rate, and may exit with an error
+or hang. do.py runs these in place of the real tools with `--fake`, and
+bench_harness.py compares what the harness measures with what they did.
+
+    $ python utils/fake.py --duration 5 --cpu 2 --memory 512 --profile ramp
+    $ python utils/fake.py --duration 1 --children 4 --cpu 1
+    $ python utils/fake.py --hang
+
+Memory profiles, reaching `--memory` MB on top of the interpreter:
+
+    step    all of it from the start
+    ramp    growing linearly up to the end
+    spike   all of it for the middle tenth of the run only
+
+The run ends after `--duration` seconds of wall clock time whatever
+happens, so CPU time falls short of `--cpu` when the fake and its children
+need more cores than they get.
+'''
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+
+# Granularity of the work loop, in seconds
+TICK = 0.01
+# Memory is allocated in chunks of this many bytes, with every page written so that it is resident
+CHUNK = 1024 * 1024
+
+# The markers Depends prints, so that the phases of `utils.phases` can be tested
+PHASES = ['Start parsing files', 'Resolve types and bindings', 'Dependency done']
+
+
+def memory_target(profile, megabytes, progress):
+    '''MB held at `progress` (0 to 1) of the run.'''
+    if profile == 'step':
+        return megabytes
+    if profile == 'ramp':
+        return megabytes * progress
+    if profile == 'spike':
+        return megabytes if 0.45 <= progress < 0.55 else 0
+    raise ValueError(f'Unknown memory profile {profile}')
+
+
+def burn(seconds):
+    '''Keep the CPU busy for `seconds` of CPU time.'''
+    end = time.process_time() + seconds
+    x = 0
+    while time.process_time() < end:
+        for i in range(1000):
+            x += i * i
+    return x
+
+
+def child_command(args):
+    # Children do the same work, but don't print nor spawn children of their own
+    return [sys.executable, os.path.abspath(__file__), '--duration', str(args.duration), '--cpu', str(args.cpu),
+            '--memory', str(args.memory), '--profile', args.profile]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', help='Specify the wall clock seconds to run, at least --cpu', type=float,
+                        default=1)
+    parser.add_argument('--cpu', help='Specify the CPU seconds to use, spread over the run', type=float, default=0)
+    parser.add_argument('--memory', help='Specify the peak memory (in MB) to allocate', type=float, default=0)
+    parser.add_argument('--profile', help='Specify how memory is allocated over the run',
+                        choices=['step', 'ramp', 'spike'], default='step')
+    parser.add_argument('--children', help='Specify the number of child processes doing the same work', type=int,
+                        default=0)
+    parser.add_argument('--orphans', help='Specify the number of processes left running after exiting', type=int,
+                        default=0)
+    parser.add_argument('--lines-per-second', help='Specify the rate of output lines', type=float, default=0)
+    parser.add_argument('--line-length', help='Specify the length of output lines', type=int, default=80)
+    parser.add_argument('--phases', help='Print the phase markers of Depends at even intervals', action='store_true')
+    parser.add_argument('--exit', help='Specify the exit status', type=int, default=0)
+    parser.add_argument('--hang', help='Ignore SIGTERM and never exit', action='store_true')
+    args = parser.parse_args(argv)
+
+    duration = max(args.duration, args.cpu)
+    children = [subprocess.Popen(child_command(args)) for _ in range(args.children)]
+    for _ in range(args.orphans):
+        # Still in the session of the tool, as tools' daemons are
+        subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+
+    if args.hang:
+        if hasattr(signal, 'SIGTERM'):
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        while True:
+            time.sleep(3600)
+
+    held = []
+    printed = 0
+    phase = 0
+    line = 'x' * args.line_length
+    start = time.monotonic()
+    cpu_start = time.process_time()
+    while True:
+        elapsed = time.monotonic() - start
+        progress = min(elapsed / duration, 1) if duration > 0 else 1
+
+        chunks = int(memory_target(args.profile, args.memory, progress) * 1024 * 1024 / CHUNK)
+        while len(held) < chunks:
+            held.append(bytearray(b'\x01') * CHUNK)
+        del held[chunks:]
+
+        if args.phases:
+            while phase < len(PHASES) and progress >= phase / len(PHASES):
+                print(PHASES[phase], flush=True)
+                phase += 1
+        if args.lines_per_second > 0:
+            due = int(elapsed * args.lines_per_second)
+            if due > printed:
+                sys.stdout.write(''.join(f'{i} {line}\n' for i in range(printed, due)))
+                sys.stdout.flush()
+                printed = due
+
+        if progress >= 1:
+            break
+        # CPU time is kept on schedule with the progress of the run, the rest of a tick is slept
+        behind = args.cpu * min((elapsed + TICK) / duration, 1) - (time.process_time() - cpu_start)
+        if behind > 0:
+            burn(min(behind, TICK))
+        remaining = TICK - (time.monotonic() - start - elapsed)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    for child in children:
+        child.wait()
+    return args.exit
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+'''
+Memory-mapped dependency graphs of normalized tool outputs, and queries on them.
+
+Every `.edges` directory written by `utils.normalize` is built once into a
+`.csr` directory of `.npy` arrays, which are opened with `mmap_mode='r'`,
+so opening a graph reads nothing and hundreds of them can be queried
+without parsing any tool output again:
+
+    indptr, indices      out-edges of every entity in CSR layout, sorted by source
+    rows                 source of every edge, in the same order as `indices`
+    kinds, counts        relation kind and count of every edge, in the same order
+    rindptr, rindices    in-edges of every entity in CSR layout
+    entity_kind          kind of every entity
+    name_bytes, name_offsets
+                         utf-8 names of entities, name i is name_bytes[offsets[i]:offsets[i + 1]]
+    name_hash, name_ids  64-bit hashes of the names, sorted, and the entity of each,
+                         the name -> id index searched with `np.searchsorted`
+    file_of              the file entity every entity is in, -1 if none
+
+The file an entity is in is found by following containment relations
+(`CONTAINMENT`) down from entities of kind file. Queries are numpy
+operations on whole arrays, and scipy's sparse matrices for components
+and file-level rollups. Needs numpy and scipy, like analyze/plotting.
+
+    $ python -m utils.graph build
+    $ python -m utils.graph stats -o ./records/graphs.csv
+    $ python -m utils.graph query fastjson ENRE-java com.alibaba.fastjson.JSON
+'''
+
+import os
+import csv
+import json
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from utils.edges import read_meta
+
+
+# Relation kinds leading from an entity to what it contains, lower case
+CONTAINMENT = {'contain', 'define', 'declare', 'parameter'}
+
+# Columns of `Graph.stats`
+STATS = ['entities', 'relations', 'max-fan-in', 'max-fan-out', 'mean-fan-out', 'sccs', 'largest-scc',
+         'in-cycles', 'files', 'file-relations', 'max-file-fan-in', 'max-file-fan-out', 'largest-file-scc']
+
+
+def name_hash(name):
+    # Stable across runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _column(path, name, dtype):
+    suffix = 'u16' if dtype == '<u2' else 'u32'
+    return np.fromfile(os.path.join(path, f'{name}.{suffix}'), dtype=dtype)
+
+
+def _csr(src, dst, n, index):
+    # Sorted by destination within a row too, which scipy would otherwise sort out on every matrix
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(n + 1, dtype=index)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return order, indptr, dst[order].astype(index)
+
+
+def _file_of(n, rows, indices, kinds, entity_kind, relation_kinds, entity_kinds):
+    is_file = np.isin(entity_kind, [i for i, kind in enumerate(entity_kinds) if kind.lower() == 'file'])
+    file_of = np.where(is_file, np.arange(n), -1)
+    contains = np.isin(kinds, [i for i, kind in enumerate(relation_kinds) if kind.lower() in CONTAINMENT])
+    src, dst = rows[contains], indices[contains]
+    # Down one level of containment at a time, file -> class -> method -> ...
+    while True:
+        step = (file_of[src] != -1) & (file_of[dst] == -1)
+        if not step.any():
+            return file_of
+        file_of[dst[step]] = file_of[src[step]]
+
+
+def build(edges_path, csr_path):
+    '''Build the `.csr` directory `csr_path` from the `.edges` directory `edges_path`, see the module docstring.'''
+    meta = read_meta(edges_path)
+    n = meta['entities']
+    src = _column(edges_path, 'relation_src', '<u4').astype(np.int64)
+    dst = _column(edges_path, 'relation_dst', '<u4').astype(np.int64)
+    # Indices and indptr of the same dtype, so scipy takes the arrays as they are
+    index = np.int32 if max(len(src), n) < 2 ** 31 else np.int64
+
+    arrays = dict()
+    order, arrays['indptr'], arrays['indices'] = _csr(src, dst, n, index)
+    arrays['rows'] = src[order].astype(index)
+    arrays['kinds'] = _column(edges_path, 'relation_kind', '<u2')[order]
+    arrays['counts'] = _column(edges_path, 'relation_count', '<u4')[order]
+    _, arrays['rindptr'], arrays['rindices'] = _csr(dst, src, n, index)
+    arrays['entity_kind'] = _column(edges_path, 'entity_kind', '<u2')
+
+    with open(os.path.join(edges_path, 'entity_name.txt'), 'r', encoding='utf-8', newline='\n') as f:
+        names = [line[:-1].encode('utf-8') for line in f]
+    arrays['name_offsets'] = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in names], out=arrays['name_offsets'][1:])
+    arrays['name_bytes'] = np.frombuffer(b''.join(names), dtype=np.uint8)
+    hashes = np.array([name_hash(name.decode('utf-8')) for name in names], dtype=np.uint64)
+    arrays['name_ids'] = np.argsort(hashes, kind='stable').astype(index)
+    arrays['name_hash'] = hashes[arrays['name_ids']]
+    arrays['file_of'] = _file_of(n, arrays['rows'], arrays['indices'], arrays['kinds'], arrays['entity_kind'],
+                                 meta['relation_kinds'], meta['entity_kinds']).astype(index)
+
+    # Built aside and moved into place, so a graph is never seen half written
+    tmp_path = f'{csr_path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+    meta['built_from'] = os.path.abspath(edges_path)
+    meta['built_from_mtime'] = os.stat(os.path.join(edges_path, 'meta.json')).st_mtime_ns
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    if os.path.exists(csr_path):
+        shutil.rmtree(csr_path)
+    os.replace(tmp_path, csr_path)
+
+
+class Graph:
+    '''The dependency graph of a `.csr` directory, memory mapped.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+        self.n = self.meta['entities']
+        self.m = self.meta['relations']
+        self.relation_kinds = self.meta['relation_kinds']
+        self.entity_kinds = self.meta['entity_kinds']
+
+    def __getattr__(self, name):
+        # Arrays are mapped on first use
+        if name.startswith('_') or not os.path.exists(os.path.join(self.path, f'{name}.npy')):
+            raise AttributeError(name)
+        array = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        setattr(self, name, array)
+        return array
+
+    def name(self, id):
+        return bytes(self.name_bytes[self.name_offsets[id]:self.name_offsets[id + 1]]).decode('utf-8')
+
+    def ids(self, names):
+        '''Returns the ids of `names` as an array, -1 for names that are not in the graph.'''
+        hashes = np.array([name_hash(name) for name in names], dtype=np.uint64)
+        # Every candidate of a hash, in case of collisions
+        low = np.searchsorted(self.name_hash, hashes, side='left')
+        high = np.searchsorted(self.name_hash, hashes, side='right')
+        ids = np.full(len(names), -1, dtype=np.int64)
+        for i, name in enumerate(names):
+            for candidate in self.name_ids[low[i]:high[i]]:
+                if self.name(candidate) == name:
+                    ids[i] = candidate
+                    break
+        return ids
+
+    def id(self, name):
+        '''Returns the id of the entity `name`, raises KeyError if there is none.'''
+        id = self.ids([name])[0]
+        if id == -1:
+            raise KeyError(name)
+        return int(id)
+
+    def _edge_mask(self, kinds):
+        if kinds is None:
+            return None
+        codes = [self.relation_kinds.index(kind) for kind in kinds if kind in self.relation_kinds]
+        return np.isin(self.kinds, codes)
+
+    def matrix(self, kinds=None, weighted=False):
+        '''
+        The adjacency matrix (a scipy CSR matrix), of relations of `kinds`
+        only if given, whose entries are relation counts if `weighted`, and 1
+        per relation otherwise. Relations of several kinds between two
+        entities add up.
+        '''
+        data = self.counts if weighted else np.ones(self.m, dtype=np.int32)
+        mask = self._edge_mask(kinds)
+        if mask is None:
+            # A copy, mapped arrays are read only and duplicates are summed in place
+            matrix = sparse.csr_matrix((data, self.indices, self.indptr), shape=(self.n, self.n), copy=True)
+        else:
+            matrix = sparse.csr_matrix((data[mask], (self.rows[mask], self.indices[mask])), shape=(self.n, self.n))
+        matrix.sum_duplicates()
+        return matrix
+
+    def fan_out(self, kinds=None, distinct=True):
+        '''Out-degree of every entity, counting each neighbor once if `distinct`, and each relation otherwise.'''
+        if distinct or kinds is not None:
+            matrix = self.matrix(kinds)
+            return np.diff(matrix.indptr) if distinct else np.asarray(matrix.sum(axis=1)).ravel()
+        return np.diff(self.indptr)
+
+    def fan_in(self, kinds=None, distinct=True):
+        '''In-degree of every entity, see `fan_out`.'''
+        if distinct or kinds is not None:
+            matrix = self.matrix(kinds).tocsc()
+            return np.diff(matrix.indptr) if distinct else np.asarray(matrix.sum(axis=0)).ravel()
+        return np.diff(self.rindptr)
+
+    def successors(self, id):
+        return np.unique(self.indices[self.indptr[id]:self.indptr[id + 1]])
+
+    def predecessors(self, id):
+        return np.unique(self.rindices[self.rindptr[id]:self.rindptr[id + 1]])
+
+    def scc(self, kinds=None):
+        '''Returns (count, labels) of the strongly connected components.'''
+        return connected_components(self.matrix(kinds), directed=True, connection='strong')
+
+    def files(self):
+        '''Ids of the file entities.'''
+        return np.flatnonzero(self.file_of == np.arange(self.n))
+
+    def file_matrix(self, kinds=None, weighted=False):
+        '''
+        Returns (file ids, matrix) of relations rolled up to the files of
+        their ends, where relations within a file and of entities in no file
+        are left out.
+        '''
+        files = self.files()
+        index = np.full(self.n, -1, dtype=np.int64)
+        index[files] = np.arange(len(files))
+        file_of = np.asarray(self.file_of)
+        keep = self._edge_mask(kinds)
+        rows, indices = np.asarray(self.rows), np.asarray(self.indices)
+        data = np.asarray(self.counts) if weighted else np.ones(self.m, dtype=np.int64)
+        if keep is not None:
+            rows, indices, data = rows[keep], indices[keep], data[keep]
+        src = np.where(file_of[rows] != -1, index[file_of[rows]], -1)
+        dst = np.where(file_of[indices] != -1, index[file_of[indices]], -1)
+        keep = (src != -1) & (dst != -1) & (src != dst)
+        matrix = sparse.coo_matrix((data[keep], (src[keep], dst[keep])), shape=(len(files), len(files))).tocsr()
+        return files, matrix
+
+    def stats(self):
+        '''Summary statistics of the graph, the columns of `STATS`.'''
+        matrix = self.matrix()
+        fan_in, fan_out = np.diff(matrix.tocsc().indptr), np.diff(matrix.indptr)
+        count, labels = connected_components(matrix, directed=True, connection='strong')
+        sizes = np.bincount(labels) if self.n != 0 else np.zeros(0, dtype=np.int64)
+        files, matrix = self.file_matrix()
+        file_fan_in, file_fan_out = np.diff(matrix.tocsc().indptr), np.diff(matrix.indptr)
+        file_sizes = np.bincount(connected_components(matrix, directed=True, connection='strong')[1]) \
+            if len(files) != 0 else np.zeros(0, dtype=np.int64)
+        return {
+            'entities': self.n,
+            'relations': self.m,
+            'max-fan-in': int(fan_in.max(initial=0)),
+            'max-fan-out': int(fan_out.max(initial=0)),
+            'mean-fan-out': float(fan_out.mean()) if self.n != 0 else 0.0,
+            # Components of more than one entity, single entities are trivially strongly connected
+            'sccs': int((sizes > 1).sum()),
+            'largest-scc': int(sizes.max(initial=0)),
+            'in-cycles': int(sizes[sizes > 1].sum()),
+            'files': len(files),
+            'file-relations': matrix.nnz,
+            'max-file-fan-in': int(file_fan_in.max(initial=0)),
+            'max-file-fan-out': int(file_fan_out.max(initial=0)),
+            'largest-file-scc': int(file_sizes.max(initial=0)),
+        }
+
+
+class GraphStore:
+    '''
+    The graphs of every (project, tool) normalized to `normalized`, built to
+    `root` on first use and rebuilt whenever their normalized output changes.
+    '''
+
+    def __init__(self, root='./out/graphs', normalized='./out/normalized'):
+        self.root = root
+        self.normalized = normalized
+        self._graphs = dict()
+
+    def keys(self):
+        '''(project, tool) of every normalized output, sorted.'''
+        keys = []
+        if os.path.isdir(self.normalized):
+            for entry in os.listdir(self.normalized):
+                if entry.endswith('.edges') and '.' in entry[:-len('.edges')]:
+                    keys.append(tuple(entry[:-len('.edges')].rsplit('.', 1)))
+        return sorted(keys)
+
+    def _stale(self, edges_path, csr_path):
+        try:
+            built = read_meta(csr_path)
+        except (EnvironmentError, ValueError):
+            return True
+        return built.get('built_from_mtime') != os.stat(os.path.join(edges_path, 'meta.json')).st_mtime_ns
+
+    def graph(self, project_name, tool):
+        '''Returns the `Graph` of `tool` (e.g. 'ENRE-java') on a project, raises KeyError if it was not normalized.'''
+        key = (project_name, tool)
+        edges_path = os.path.join(self.normalized, f'{project_name}.{tool}.edges')
+        if not os.path.exists(os.path.join(edges_path, 'meta.json')):
+            raise KeyError(key)
+        csr_path = os.path.join(self.root, f'{project_name}.{tool}.csr')
+        if self._stale(edges_path, csr_path):
+            os.makedirs(self.root, exist_ok=True)
+            build(edges_path, csr_path)
+            self._graphs.pop(key, None)
+        if key not in self._graphs:
+            self._graphs[key] = Graph(csr_path)
+        return self._graphs[key]
+
+    def stats(self, projects=None, tools=None):
+        '''Returns a dict of `Graph.stats` plus 'project' and 'tool' for every graph, filtered if given.'''
+        rows = []
+        for project_name, tool in self.keys():
+            if (projects is not None and project_name not in projects) or (tools is not None and tool not in tools):
+                continue
+            rows.append(dict({'project': project_name, 'tool': tool}, **self.graph(project_name, tool).stats()))
+        return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', help='Specify the directory of built graphs', default='./out/graphs')
+    parser.add_argument('--normalized', help='Specify the directory of normalized outputs', default='./out/normalized')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='Build the graphs of every normalized output that changed')
+    stats = subparsers.add_parser('stats', help='Print statistics of every graph')
+    stats.add_argument('--tool', help='Only the graphs of the given tools', nargs='+')
+    stats.add_argument('-o', '--output', help='Write statistics as csv to the given file instead')
+    query = subparsers.add_parser('query', help='Print the neighborhood of an entity')
+    query.add_argument('project')
+    query.add_argument('tool')
+    query.add_argument('name', help='Qualified name of the entity, as the tool gives it')
+    args = parser.parse_args()
+
+    store = GraphStore(args.root, args.normalized)
+    if args.command == 'build':
+        for project_name, tool in store.keys():
+            graph = store.graph(project_name, tool)
+            print(f'{project_name} {tool}: {graph.n} entities, {graph.m} relations')
+    elif args.command == 'stats':
+        rows = store.stats(tools=args.tool)
+        header = ['project', 'tool'] + STATS
+        if args.output is not None:
+            with open(args.output, 'w', newline='') as f:
+                writer = csv.DictWriter(f, header)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            for row in rows:
+                print(', '.join(f'{column}: {row[column]:.2f}' if isinstance(row[column], float)
+                                else f'{column}: {row[column]}' for column in header))
+    elif args.command == 'query':
+        graph = store.graph(args.project, args.tool)
+        id = graph.id(args.name)
+        count, labels = graph.scc()
+        file = graph.file_of[id]
+        print(f'{args.name} ({graph.entity_kinds[graph.entity_kind[id]]})'
+              + (f' in {graph.name(file)}' if file != -1 else ''))
+        print(f'fan-in {graph.fan_in()[id]}, fan-out {graph.fan_out()[id]},'
+              + f' in a strongly connected component of {int((labels == labels[id]).sum())}')
+        for title, ids in [('uses', graph.successors(id)), ('used by', graph.predecessors(id))]:
+            print(f'{title}:')
+            for other in ids:
+                print(f'    {graph.name(other)}')
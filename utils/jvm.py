@@ -0,0 +1,290 @@
+'''
+Warm JVM workers for Java based tools (ENRE-java, ENRE-cpp, Depends).
+
+Every `java -jar` pays JVM startup and JDK class loading, which dominates
+the time of small projects. A `JvmPool` keeps JVMs running the worker in
+utils/jvmworker/Worker.java, and runs `java [options] -jar <jar> ...`
+commands in them through a line based protocol over a loopback socket.
+
+Each analysis gets a fresh class loader, so tools can't leak static state
+into the next analysis. The time is measured inside the JVM around the
+tool's `main`, and how long the JVM took to start is reported separately as
+`jvm-startup` on the first analysis of every worker (0 on warm ones), so
+both cold (time + jvm-startup) and warm numbers are available.
+
+Memory of the first analysis of a worker is its peak RSS, like that of a
+cold run. A warm worker still holds the heap and code of the analyses before,
+so its peak RSS during a later one is reported as `jvm-warm-memory` instead,
+and `memory` is -1. Its VmHWM is reset before every analysis (Linux), or
+only sampled RSS counts. The peak of the JVM's memory pools during the
+analysis is reported as `jvm-pool-memory` either way. Resource usage and
+phases can't be told apart from the worker's own, they are -1.
+
+Output of the tool goes to the job's log like that of any other process.
+Where a worker can't be started, e.g. on a JDK without the SecurityManager
+the worker traps `System.exit` with, `JvmPool.measure` returns None and the
+tool is run cold instead.
+'''
+
+import os
+import sys
+import time
+import socket
+import logging
+import collections
+import subprocess
+from threading import Thread, Lock, Event
+
+from utils.sampler import sample, reset_hwm
+from utils.supervisor import RING_SIZE, supervisor, rusage_result
+
+
+# Line the worker prints once the output of an analysis is complete
+END_MARKER = '\0END'
+
+WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jvmworker', 'Worker.java')
+
+
+def compile_worker(classes_dir):
+    '''Compile the worker into `classes_dir` unless it is up to date, raises RuntimeError on failure.'''
+    class_file = os.path.join(classes_dir, 'Worker.class')
+    if os.path.exists(class_file) and os.path.getmtime(class_file) >= os.path.getmtime(WORKER_SOURCE):
+        return
+    os.makedirs(classes_dir, exist_ok=True)
+    proc = subprocess.run(
+        ['javac', '-nowarn', '-d', classes_dir, WORKER_SOURCE],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f'Can not compile the JVM worker: {proc.stdout.decode("utf-8", errors="replace")}')
+
+
+def split_command(cmd):
+    '''Returns (JVM options, jar, arguments) of a `java [options] -jar <jar> ...` command, or None.'''
+    if len(cmd) < 3 or os.path.splitext(os.path.basename(cmd[0]))[0] != 'java' or '-jar' not in cmd:
+        return None
+    index = cmd.index('-jar')
+    options = list(cmd[1:index])
+    index += 1
+    # `java -jar -Xmx64G x.jar` is accepted too
+    while index < len(cmd) and cmd[index].startswith('-'):
+        options.append(cmd[index])
+        index += 1
+    if index >= len(cmd):
+        return None
+    return options, cmd[index], cmd[index + 1:]
+
+
+class JvmWorker:
+    '''A running worker JVM started with `options` in `cwd`.'''
+
+    def __init__(self, options, cwd, classes_dir):
+        start = time.monotonic()
+        self.proc = subprocess.Popen(
+            ['java'] + list(options) + ['-Djava.security.manager=allow', '-cp', classes_dir, 'Worker'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd)
+        # Last lines of output, of the analysis being run once started
+        self.tail = collections.deque(maxlen=RING_SIZE)
+        # The JVM may print warnings before the worker is ready
+        port = None
+        for line in self.proc.stdout:
+            line = line.decode('utf-8', errors='replace')
+            if line.startswith('READY '):
+                port = int(line.split()[1])
+                break
+            self.tail.append(line.rstrip('\n'))
+        if port is None:
+            self.proc.wait()
+            raise RuntimeError(f'JVM worker exited with {self.proc.returncode} before being ready:\n'
+                               + '\n'.join(self.tail))
+        self.startup = time.monotonic() - start
+        self.cold = True
+
+        # Where output of the current analysis goes, see `run`
+        self._log = None
+        self._echo = False
+        self._done = Event()
+        self._drain = Thread(target=self._forward, daemon=True)
+        self._drain.start()
+        self.socket = socket.create_connection(('127.0.0.1', port))
+        self.reader = self.socket.makefile('rb')
+
+    def _forward(self):
+        for line in self.proc.stdout:
+            if line.rstrip(b'\r\n') == END_MARKER.encode('ascii'):
+                self._done.set()
+                continue
+            if self._log is not None:
+                self._log.write(line)
+            line = line.decode('utf-8', errors='replace').rstrip('\n')
+            self.tail.append(line)
+            if self._echo:
+                sys.stdout.write(line + '\n')
+        self._done.set()
+
+    def run(self, jar, args, timeout=None, log_path=None, echo=True):
+        '''
+        Run `jar` with `args`, returns (exit status, seconds, peak memory of the JVM's pools in MB).
+
+        Output (stdout and stderr together) is appended to `<log_path>.out` if
+        given, and echoed to the console if `echo`. Raises TimeoutError after
+        `timeout` seconds, the worker is killed then.
+        '''
+        if any('\t' in arg or '\n' in arg for arg in [jar] + list(args)):
+            raise ValueError('Arguments of a JVM worker can not contain tabs or newlines')
+        if log_path is not None:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+            self._log = open(f'{log_path}.out', 'ab')
+        self._echo = echo
+        self.tail.clear()
+        self._done.clear()
+        self.socket.settimeout(timeout)
+        try:
+            self.socket.sendall(('\t'.join(['RUN', jar] + list(args)) + '\n').encode('utf-8'))
+            line = self.reader.readline().decode('utf-8')
+        except socket.timeout:
+            self.kill()
+            raise TimeoutError()
+        finally:
+            # The last lines may still be on their way through the pipe
+            self._done.wait(5)
+            log, self._log = self._log, None
+            if log is not None:
+                log.close()
+        if not line.startswith('DONE'):
+            self.kill()
+            raise RuntimeError('JVM worker died during the analysis')
+        _, status, nanos, peak = line.split()
+        return int(status), int(nanos) / 10 ** 9, int(peak) / 1024 ** 2
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.wait()
+
+    def close(self):
+        try:
+            self.socket.sendall(b'QUIT\n')
+            self.proc.wait(10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+        self.socket.close()
+
+
+class JvmPool:
+    '''
+    Workers for every (JVM options, working directory), started on demand.
+
+    Concurrent jobs each get a worker of their own, a worker only ever runs
+    one analysis at a time. At most `max_idle` workers are kept idle, the
+    least recently used one is closed beyond that, e.g. that of a working
+    directory of a project whose jobs are done.
+    '''
+
+    def __init__(self, classes_dir='./out/jvmworker', max_idle=1):
+        self.classes_dir = os.path.abspath(classes_dir)
+        compile_worker(self.classes_dir)
+        self.max_idle = max(1, max_idle)
+        # (key, worker) of idle workers, least recently used first
+        self._idle = []
+        self._workers = []
+        # (options, cwd) of commands no worker could be started for
+        self._broken = set()
+        self._lock = Lock()
+
+    def accepts(self, cmd):
+        return split_command(cmd) is not None
+
+    def measure(self, cmd, cwd=None, timeout=None, label='Process', log_path=None, phases=None):
+        '''
+        Run a `java -jar` command in a warm worker, and measure it like `utils.runner.measure`.
+
+        The result also has `jvm-startup`, the seconds the worker took to
+        start if this is its first analysis, or 0, `jvm-warm-memory` and
+        `jvm-pool-memory`, see the module. It has the columns of
+        `utils.runner.measure` for resource usage and `phases` (a
+        `utils.phases.PhaseProfile`), all -1.
+        Returns None if no worker can be started for the command, which is
+        then to be run cold.
+        '''
+        options, jar, args = split_command(cmd)
+        key = (tuple(options), os.path.abspath(cwd) if cwd is not None else os.getcwd())
+        with self._lock:
+            if key in self._broken:
+                return None
+            self._idle = [(k, w) for k, w in self._idle if w.alive()]
+            worker = None
+            for index in reversed(range(len(self._idle))):
+                if self._idle[index][0] == key:
+                    worker = self._idle.pop(index)[1]
+                    break
+        result = {
+            'time': -1,
+            'memory': -1,
+            'memory-pss': -1,
+            'killed': False,
+            'oom': False,
+            'returncode': -1,
+            'jvm-startup': 0,
+            'jvm-warm-memory': -1,
+            'jvm-pool-memory': -1,
+        }
+        result.update(rusage_result(None, 0))
+        if phases is not None:
+            result.update({f'phase-{name}': -1 for name in ['startup'] + phases.names})
+        if worker is None:
+            try:
+                worker = JvmWorker(options, key[1], self.classes_dir)
+            except (OSError, RuntimeError) as e:
+                # Most likely the same for every later analysis, e.g. a JDK without SecurityManager
+                with self._lock:
+                    self._broken.add(key)
+                logging.warning(f'Can not start a JVM worker for {label}, running it cold instead: {e}')
+                return None
+            with self._lock:
+                self._workers.append(worker)
+            logging.info(f'Started a JVM worker for {label} in {worker.startup:.3f}s')
+
+        cold = worker.cold
+        if cold:
+            result['jvm-startup'] = worker.startup
+            worker.cold = False
+        echo = supervisor().echo
+        # The high water mark of a fresh worker is that of its first analysis
+        sampler = sample(worker.proc.pid, hwm=cold or reset_hwm(worker.proc.pid))
+        evicted = []
+        try:
+            result['returncode'], result['time'], result['jvm-pool-memory'] = worker.run(
+                os.path.abspath(jar), args, timeout, log_path, echo)
+        except TimeoutError:
+            result['killed'] = True
+            logging.warning(f'{label} timed out')
+        except RuntimeError as e:
+            logging.warning(f'{label} failed: {e}')
+        else:
+            with self._lock:
+                self._idle.append((key, worker))
+                evicted, self._idle = self._idle[:-self.max_idle], self._idle[-self.max_idle:]
+        memory = sampler.stop()
+        result['timeline'] = memory['timeline']
+        if cold:
+            result['memory'], result['memory-pss'] = memory['peak'], memory['peak_pss']
+        else:
+            result['jvm-warm-memory'] = memory['peak']
+        if result['returncode'] != 0 and not echo:
+            logging.warning(f'{label} exited with {result["returncode"]}, last output:\n' + '\n'.join(worker.tail))
+        for _, idle in evicted:
+            idle.close()
+        return result
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._idle = []
+        for worker in workers:
+            if worker.alive():
+                worker.close()
@@ -0,0 +1,145 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.Writer;
+import java.lang.management.ManagementFactory;
+import java.lang.management.MemoryPoolMXBean;
+import java.lang.management.MemoryUsage;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.Arrays;
+import java.util.jar.Attributes;
+import java.util.jar.JarFile;
+
+/**
+ * Keeps a JVM warm for do.py's --jvm-worker mode, see utils/jvm.py.
+ *
+ * Listens on a loopback port, printed as "READY <port>" on stdout, and serves
+ * one connection at a time. Requests are lines of tab separated fields:
+ *
+ *     RUN <jar> <arg>...    runs the Main-Class of <jar> with the arguments
+ *     QUIT                  stops the worker
+ *
+ * and every RUN is answered with
+ *
+ *     DONE <exit status> <analysis time in ns> <peak memory in bytes>
+ *
+ * The jar is loaded by a fresh class loader each time, so no static state of
+ * a tool survives from one analysis to the next, while the JVM itself and the
+ * JDK classes stay warm. Output of the tool goes to the worker's stdout,
+ * followed by a line END_MARKER once the analysis is done.
+ */
+public class Worker {
+    /** Printed on stdout once an analysis is done and its output flushed. */
+    static final String END_MARKER = "\u0000END";
+
+    /** Thrown instead of exiting when a tool calls System.exit. */
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        // Requires -Djava.security.manager=allow from Java 18 on
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkExit(int status) {
+                throw new ExitException(status);
+            }
+
+            @Override
+            public void checkPermission(Permission perm) {
+            }
+
+            @Override
+            public void checkPermission(Permission perm, Object context) {
+            }
+        });
+
+        ServerSocket server = new ServerSocket(0, 1, InetAddress.getLoopbackAddress());
+        System.out.println("READY " + server.getLocalPort());
+        System.out.flush();
+
+        while (true) {
+            try (Socket socket = server.accept()) {
+                BufferedReader in = new BufferedReader(
+                        new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+                Writer out = new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8);
+                String line;
+                while ((line = in.readLine()) != null) {
+                    String[] fields = line.split("\t", -1);
+                    if (fields[0].equals("QUIT")) {
+                        // Tools may leave non-daemon threads behind, which would keep the JVM alive
+                        Runtime.getRuntime().halt(0);
+                    } else if (fields[0].equals("RUN") && fields.length >= 2) {
+                        long[] result = run(fields[1], Arrays.copyOfRange(fields, 2, fields.length));
+                        out.write("DONE\t" + result[0] + "\t" + result[1] + "\t" + result[2] + "\n");
+                        out.flush();
+                    }
+                }
+            }
+        }
+    }
+
+    static long[] run(String jar, String[] args) {
+        // Start every analysis from a clean heap, so peaks are its own
+        System.gc();
+        for (MemoryPoolMXBean pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            pool.resetPeakUsage();
+        }
+
+        int status = 0;
+        ClassLoader previous = Thread.currentThread().getContextClassLoader();
+        long start = System.nanoTime();
+        try (URLClassLoader loader = new URLClassLoader(
+                new URL[] {new File(jar).toURI().toURL()}, ClassLoader.getPlatformClassLoader())) {
+            String mainClass;
+            try (JarFile file = new JarFile(jar)) {
+                mainClass = file.getManifest().getMainAttributes().getValue(Attributes.Name.MAIN_CLASS);
+            }
+            Thread.currentThread().setContextClassLoader(loader);
+            Method main = loader.loadClass(mainClass).getMethod("main", String[].class);
+            main.invoke(null, (Object) args);
+        } catch (InvocationTargetException e) {
+            if (e.getCause() instanceof ExitException) {
+                status = ((ExitException) e.getCause()).status;
+            } else {
+                e.getCause().printStackTrace();
+                status = 1;
+            }
+        } catch (ExitException e) {
+            status = e.status;
+        } catch (Exception e) {
+            e.printStackTrace();
+            status = 1;
+        } finally {
+            Thread.currentThread().setContextClassLoader(previous);
+        }
+        long nanos = System.nanoTime() - start;
+
+        long peak = 0;
+        for (MemoryPoolMXBean pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            MemoryUsage usage = pool.getPeakUsage();
+            if (usage != null) {
+                peak += usage.getUsed();
+            }
+        }
+        System.err.flush();
+        // Tells the reader of stdout that the output of this analysis is complete
+        System.out.println(END_MARKER);
+        System.out.flush();
+        return new long[] {status, nanos, peak};
+    }
+}
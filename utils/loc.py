@@ -0,0 +1,395 @@
+'''
+Incremental line of code counting.
+
+Code lines of every file are cached by git blob hash, so after a repository
+is updated only files whose content changed are counted again, and a file
+appearing in several projects (or revisions) is only counted once.
+
+Files are first filtered by a precomputed extension map, so that cloc is
+only ever given files of the languages a `lang` counts, and files without
+an extension, which cloc tells the language of by their `#!` line (e.g.
+scripts). Uncached files are
+counted by cloc in chunks, and each chunk is cached as soon as it is done,
+so even a timed out count makes progress for the next run.
+
+Files are counted either by cloc or by the built-in counter below, which
+splits files over a process pool and scans them through mmap, stripping
+comments with the same rules as cloc for the languages counted here. The
+two are cached separately, since their numbers may differ slightly. The
+built-in counter doesn't read `#!` lines, and skips files without an extension.
+
+Like cloc, the built-in counter is run as a command of its own
+
+    $ python -m utils.loc <repo path> <list file> --workers 4
+
+so its pool is started from a fresh process rather than forked from a
+caller that already runs threads, and a timeout kills it with its pool.
+'''
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import signal
+import sqlite3
+import hashlib
+import logging
+import argparse
+import tempfile
+import subprocess
+from itertools import repeat
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Where `utils` can be imported from, for the built-in counter's command
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Processes of the built-in counter at most by default, reading files soon
+# becomes the bottleneck, and every one of them is a core taken from tools
+WORKERS = 4
+
+# do.py's lang -> cloc languages counted as its LoC
+LANGUAGES = {
+    'java': ['Java'],
+    'cpp': ['C++', 'C/C++ Header'],
+    'c': ['C++', 'C/C++ Header', 'C'],
+    'python': ['Python'],
+    'ts': ['JavaScript', 'TypeScript'],
+}
+
+# File extension -> cloc language, for the languages above (taken from cloc 1.92)
+EXTENSIONS = dict()
+for language, extensions in {
+    'Java': ['java'],
+    'C': ['c', 'ec', 'pgc', 'idc', 'cats'],
+    'C++': ['cpp', 'CPP', 'cc', 'cxx', 'c++', 'C', 'ccm', 'cppm', 'cxxm', 'c++m', 'h++',
+            'inl', 'ipp', 'ixx', 'tcc', 'tpp', 'pcc'],
+    'C/C++ Header': ['h', 'H', 'hh', 'hpp', 'hxx'],
+    'Python': ['py', 'pyw', 'pyi', 'py3', 'pyp', 'pyt', 'tac', 'wsgi', 'xpy'],
+    'JavaScript': ['js', 'mjs', 'cjs', 'jsm', 'es6', '_js', 'jss', 'jsb', 'njs', 'sjs', 'ssjs', 'pac'],
+    # cloc tells TypeScript from Qt Linguist .ts files by content
+    'TypeScript': ['ts', 'tsx'],
+}.items():
+    for extension in extensions:
+        EXTENSIONS[f'.{extension}'] = language
+
+
+def language_of(filepath):
+    '''Returns the cloc language a file is counted as by its extension, or None.'''
+    return EXTENSIONS.get(os.path.splitext(filepath)[1])
+
+
+# Comments and strings, strings are matched so that comment markers inside them are ignored
+C_LIKE = re.compile(
+    rb'//[^\n]*'
+    rb'|/\*.*?(?:\*/|\Z)'
+    rb'|"(?:\\.|[^"\\\n])*"'
+    rb"|'(?:\\.|[^'\\\n])*'", re.DOTALL)
+# JavaScript template literals may span lines
+JS_LIKE = re.compile(C_LIKE.pattern + rb'|`(?:\\.|[^`\\])*`', re.DOTALL)
+PYTHON = re.compile(
+    rb'#[^\n]*'
+    rb'|[rRuUbBfF]{0,2}(?:\"\"\"(?:\\.|[^\\])*?(?:\"\"\"|\Z)'
+    rb"|'''(?:\\.|[^\\])*?(?:'''|\Z))"
+    rb'|[rRuUbBfF]{0,2}(?:"(?:\\.|[^"\\\n])*"'
+    rb"|'(?:\\.|[^'\\\n])*')", re.DOTALL)
+
+SYNTAX = {
+    'Java': C_LIKE,
+    'C': C_LIKE,
+    'C++': C_LIKE,
+    'C/C++ Header': C_LIKE,
+    'JavaScript': JS_LIKE,
+    'TypeScript': JS_LIKE,
+    'Python': PYTHON,
+}
+
+
+def count_code(content, language):
+    '''
+    Returns the number of code lines in `content` (bytes or a buffer) of `language`.
+
+    A line is code if anything but whitespace is left once comments are
+    removed. Like cloc, triple quoted Python strings are comments.
+    '''
+    def strip(match):
+        token = match.group()
+        if token[:1] in (b'/', b'#'):
+            return b'\n' * token.count(b'\n')
+        if language == 'Python' and token.lstrip(b'rRuUbBfF')[:3] in (b'"""', b"'''"):
+            return b'\n' * token.count(b'\n')
+        # Keep a placeholder, a string is code, on every line it spans
+        return b'\n'.join(b's' for _ in range(token.count(b'\n') + 1))
+
+    stripped = SYNTAX[language].sub(strip, content)
+    return sum(1 for line in stripped.split(b'\n') if len(line.strip()) != 0)
+
+
+def count_file(filepath, language):
+    '''Returns (language, code lines) of a file, language is None if it is not source code.'''
+    with open(filepath, 'rb') as f:
+        try:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            return language, 0
+        with content:
+            if content.find(b'\0', 0, 8000) != -1:
+                # Binary, like cloc
+                return None, 0
+            # .ts is also used by Qt Linguist, which are XML
+            if language == 'TypeScript' and content[:4096].lstrip().startswith(b'<?xml'):
+                return None, 0
+            return language, count_code(content, language)
+
+
+def count_files(repo_path, filepaths):
+    '''Pool worker, returns [(language, code lines)] of files relative to `repo_path`.'''
+    counted = []
+    for filepath in filepaths:
+        try:
+            counted.append(count_file(os.path.join(repo_path, filepath), language_of(filepath)))
+        except EnvironmentError:
+            counted.append((None, 0))
+    return counted
+
+
+def count_list(repo_path, filepaths, workers):
+    '''Returns [(language, code lines)] of files relative to `repo_path`, counted by `workers` processes.'''
+    if workers <= 1:
+        return count_files(repo_path, filepaths)
+    # Small groups keep workers busy, while not paying a round trip for every file
+    groups = [filepaths[i:i + 64] for i in range(0, len(filepaths), 64)]
+    with ProcessPoolExecutor(workers) as pool:
+        return [result for results in pool.map(count_files, repeat(repo_path), groups) for result in results]
+
+
+def run_tree(cmd, timeout, **kwargs):
+    '''
+    Run `cmd` and returns its stdout, like `subprocess.check_output`, except
+    that on timeout its whole process tree is killed rather than just itself.
+    '''
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, start_new_session=os.name == 'posix', **kwargs)
+    try:
+        output, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            subprocess.run(['taskkill', '/T', '/F', '/PID', str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc.communicate()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+    return output
+
+
+def blob_hash(filepath):
+    '''Same as `git hash-object`, for directories that are not git repositories.'''
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def list_blobs(repo_path, languages, extensionless=False):
+    '''
+    Returns {blob hash: relative path} of files of `languages` in `repo_path`,
+    and of files without an extension if `extensionless`.
+
+    Files with the same content only appear once, like cloc's uniqueness check.
+    '''
+    def wanted(filepath):
+        if extensionless and os.path.splitext(filepath)[1] == '':
+            return True
+        return language_of(filepath) in languages
+
+    blobs = dict()
+    proc = subprocess.run(
+        ['git', '-C', repo_path, 'ls-files', '-s', '-z'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    if proc.returncode == 0:
+        # Hashes come for free from git's index: '<mode> <hash> <stage>\t<path>'
+        for entry in proc.stdout.split(b'\0'):
+            if len(entry) == 0:
+                continue
+            info, _, filepath = entry.partition(b'\t')
+            mode, blob, _ = info.split(b' ')
+            # Skip symlinks and submodules
+            if mode not in (b'100644', b'100755'):
+                continue
+            filepath = filepath.decode('utf-8', errors='surrogateescape')
+            if wanted(filepath):
+                blobs.setdefault(blob.decode('ascii'), filepath)
+        return blobs
+
+    for dirpath, dirnames, filenames in os.walk(repo_path):
+        dirnames[:] = [d for d in dirnames if d != '.git']
+        for filename in filenames:
+            if not wanted(filename):
+                continue
+            filepath = os.path.join(dirpath, filename)
+            if os.path.islink(filepath):
+                continue
+            try:
+                blobs.setdefault(blob_hash(filepath), os.path.relpath(filepath, repo_path))
+            except EnvironmentError:
+                pass
+    return blobs
+
+
+class LocCounter:
+    '''
+    Count LoC of repositories, caching code lines of every blob in `cache_path`.
+
+    counter: 'cloc', or 'native' for the built-in counter
+    cloc: command used to run cloc
+    chunk: number of files given to a single cloc run
+    workers: processes of the built-in counter, all cores up to `WORKERS` by default
+
+    Safe to share between threads, e.g. jobs of the scheduler.
+    '''
+
+    def __init__(self, cache_path='./out/loc/cache.sqlite', counter='cloc', cloc=('./utils/cloc',), chunk=2000,
+                 workers=None):
+        if counter not in ('cloc', 'native'):
+            raise ValueError(f'Unknown LoC counter {counter}')
+        self.counter = counter
+        self.cloc = list(cloc)
+        self.chunk = chunk
+        self.workers = workers if workers is not None else min(os.cpu_count() or 1, WORKERS)
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._lock = Lock()
+        # `language` is NULL for files that are not counted at all
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS blobs '
+            '(hash TEXT, counter TEXT, language TEXT, code INTEGER, PRIMARY KEY (hash, counter))')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, hashes):
+        '''Returns {hash: (language, code)} of the cached ones among `hashes`.'''
+        found = dict()
+        hashes = list(hashes)
+        # Stay below SQLite's limit on the number of parameters
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            with self._lock:
+                rows = self.db.execute(
+                    'SELECT hash, language, code FROM blobs '
+                    f'WHERE counter = ? AND hash IN ({",".join("?" * len(batch))})', [self.counter] + batch).fetchall()
+            for blob, language, code in rows:
+                found[blob] = (language, code)
+        return found
+
+    def store(self, counted):
+        with self._lock:
+            self.db.executemany('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)',
+                                [(blob, self.counter) + result for blob, result in counted.items()])
+            self.db.commit()
+
+    def count(self, repo_path, lang, timeout=None):
+        '''
+        Returns the LoC of `lang` in `repo_path`.
+
+        Raises subprocess.TimeoutExpired if counting takes more than `timeout`
+        seconds, or subprocess.CalledProcessError if cloc fails. Files counted
+        before that are cached anyway.
+        '''
+        languages = LANGUAGES.get(lang, LANGUAGES['ts'])
+        # cloc counts scripts without an extension by their `#!` line, those are
+        # cached like any other file, with the language cloc gave them
+        blobs = list_blobs(repo_path, set(languages), extensionless=self.counter == 'cloc')
+        cached = self.lookup(blobs.keys())
+        missing = [blob for blob in blobs if blob not in cached]
+        logging.info(
+            f'{len(blobs)} files to count in {repo_path}, {len(blobs) - len(missing)} of them are cached')
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for i in range(0, len(missing), self.chunk):
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.counter, timeout)
+            batch = missing[i:i + self.chunk]
+            paths = {blobs[blob]: blob for blob in batch}
+            if self.counter == 'native':
+                counted = self._count_native(repo_path, paths, remaining)
+            else:
+                counted = self._count(repo_path, paths, remaining)
+            counted = {blob: counted.get(blob, (None, 0)) for blob in batch}
+            self.store(counted)
+            cached.update(counted)
+
+        return sum(code for language, code in cached.values() if language in languages)
+
+    def _count_native(self, repo_path, paths, timeout):
+        # Same as `_count`, with the built-in counter
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8',
+                                         errors='surrogateescape') as f:
+            for filepath in paths:
+                f.write(filepath + '\n')
+            list_file = f.name
+        try:
+            output = run_tree(
+                [sys.executable, '-m', 'utils.loc', os.path.abspath(repo_path), list_file,
+                 '--workers', str(self.workers)],
+                timeout,
+                cwd=ROOT)
+        finally:
+            os.remove(list_file)
+        return {paths[filepath]: tuple(result) for filepath, result in zip(paths, json.loads(output))}
+
+    def _count(self, repo_path, paths, timeout):
+        # paths: relative path -> blob hash, returns {blob hash: (language, code)}
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8',
+                                         errors='surrogateescape') as f:
+            for filepath in paths:
+                f.write(os.path.join(repo_path, filepath) + '\n')
+            list_file = f.name
+        try:
+            output = subprocess.check_output(
+                self.cloc + [f'--list-file={list_file}', '--by-file', '--csv', '--quiet',
+                             # Duplicates are already removed by hash
+                             '--skip-uniqueness'],
+                timeout=timeout)
+        finally:
+            os.remove(list_file)
+
+        counted = dict()
+        prefix = os.path.join(repo_path, '')
+        for line in output.decode('utf-8', errors='surrogateescape').splitlines():
+            # 'language,filename,blank,comment,code', where filename may contain commas
+            fields = line.split(',')
+            if len(fields) < 5 or fields[0] in ('language', 'SUM'):
+                continue
+            filepath = ','.join(fields[1:-3])
+            if filepath.startswith(prefix):
+                filepath = filepath[len(prefix):]
+            if filepath in paths:
+                try:
+                    counted[paths[filepath]] = (fields[0], int(fields[-1]))
+                except ValueError:
+                    pass
+        return counted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('repo_path', help='Specify the repository the files are in')
+    parser.add_argument('list_file', help='Specify a file listing the files to count, one path relative to repo_path per line')
+    parser.add_argument('--workers', help='Specify the number of counting processes', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.list_file, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        filepaths = [line.rstrip('\n') for line in f if line != '\n']
+    # [[language, code lines]] in the order of the list, as JSON
+    json.dump(count_list(args.repo_path, filepaths, args.workers), sys.stdout)
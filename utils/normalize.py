@@ -0,0 +1,270 @@
+'''
+Streaming normalizer of tool outputs into the edge format of `utils.edges`.
+
+Outputs are read incrementally, so a multi-GB file never has to fit in
+memory: JSON is read in chunks and each element of its top-level arrays is
+decoded on its own with `json.JSONDecoder.raw_decode`, which stops at the
+end of the element rather than requiring the end of the document. The
+layouts understood are
+
+    Depends        {"variables": [<file name>, ...],
+                    "cells": [{"src": i, "dest": j, "values": {<kind>: <count>}}]}
+    ENRE (java, cpp, python)
+                   {"variables": [{"id", "qualifiedName", "category", ...}],
+                    "cells": [{"src", "dest", "values": {<kind>: <count>, ...}}]}
+    ENRE-ts        {"entities": [{"id", "name", "type"}],
+                    "relations": [{"from", "to", "type"}]}
+    Understand     the csv of `und export -dependencies file csv <output.csv> <project.und>`,
+                   its database itself can only be read through its own API
+
+so the tools differ in field names only, which are looked up in order of
+the lists below. A top-level array of relations in the JSON file is handled
+the same whether it comes before or after the entities.
+
+    $ python -m utils.normalize ./out/depends/fastjson.json ./out/normalized/fastjson.Depends.edges
+'''
+
+import os
+import csv
+import glob
+import json
+import time
+import logging
+import argparse
+
+from utils.edges import EdgeWriter
+
+
+# Characters read at once
+CHUNK = 1024 * 1024
+
+ENTITY_ARRAYS = ['variables', 'entities', 'Entities']
+RELATION_ARRAYS = ['cells', 'relations', 'Relations', 'dependencies', 'Dependencies']
+ID_FIELDS = ['id', 'ID']
+NAME_FIELDS = ['qualifiedName', 'name', 'Name']
+KIND_FIELDS = ['category', 'type', 'kind', 'Kind']
+SRC_FIELDS = ['src', 'from', 'source']
+DST_FIELDS = ['dest', 'to', 'target']
+
+WHITESPACE = ' \t\n\r'
+# Characters a JSON number may consist of
+NUMBER = '0123456789+-.eE'
+
+
+class JsonStream:
+    '''
+    Incremental reader of a JSON document from a text file.
+
+    `walk()` yields (key, index, element) for every element of every
+    top-level array, and (key, None, value) for other top-level values.
+    '''
+
+    def __init__(self, file, chunk=CHUNK):
+        self.file = file
+        self.chunk = chunk
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # Characters read so far
+        self.read = 0
+
+    def _more(self, size=None):
+        if self.eof:
+            return False
+        data = self.file.read(size if size is not None else self.chunk)
+        if len(data) == 0:
+            self.eof = True
+            return False
+        self.read += len(data)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char == '' or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} at character {self.read - len(self.buf) + self.pos},'
+                             + f' found {char!r}')
+        self.pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            # A number at the end of the buffer may go on in the next read, and one cut
+            # right after its `.` or `e` would not even decode
+            if self.pos < len(self.buf) and self.buf[self.pos] in NUMBER:
+                end = self.pos
+                while end < len(self.buf) and self.buf[end] in NUMBER:
+                    end += 1
+                if end == len(self.buf) and self._more():
+                    continue
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Most likely cut at the end of the buffer, an element bigger than a chunk takes bigger reads
+                if not self._more(max(self.chunk, len(self.buf) - self.pos)):
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def _elements(self):
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index, self._value()
+            index += 1
+            if self._expect(',]') == ']':
+                return
+
+    def walk(self):
+        if self._expect('{[') == '[':
+            for index, element in self._elements():
+                yield None, index, element
+            return
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if self._peek() == '[':
+                self.pos += 1
+                for index, element in self._elements():
+                    yield key, index, element
+            else:
+                yield key, None, self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def _first(element, fields, default=None):
+    for field in fields:
+        if field in element:
+            return element[field]
+    return default
+
+
+def _ref(value):
+    # ENRE-ts refers to entities by {"id": ...} objects in some versions
+    return _first(value, ID_FIELDS) if isinstance(value, dict) else value
+
+
+def read_json(file, writer):
+    '''Normalize a JSON output from the text `file`, returns the `JsonStream` that read it.'''
+    stream = JsonStream(file)
+    for key, index, element in stream.walk():
+        if index is None:
+            continue
+        if key in ENTITY_ARRAYS or (key is None and isinstance(element, dict) and _first(element, SRC_FIELDS) is None):
+            if isinstance(element, str):
+                # Depends lists file names, referred to by index
+                writer.entity(index, element, 'File')
+            else:
+                writer.entity(_first(element, ID_FIELDS, index), str(_first(element, NAME_FIELDS, '')),
+                              str(_first(element, KIND_FIELDS, '')))
+        elif key in RELATION_ARRAYS or key is None:
+            src = _ref(_first(element, SRC_FIELDS))
+            dst = _ref(_first(element, DST_FIELDS))
+            if src is None or dst is None:
+                continue
+            values = element.get('values')
+            if isinstance(values, dict):
+                for kind, count in values.items():
+                    # Besides kinds, ENRE puts locations and binding details in there
+                    if isinstance(count, (int, float)) and not isinstance(count, bool):
+                        writer.relation(src, dst, kind, max(1, int(count)))
+            else:
+                writer.relation(src, dst, str(_first(element, KIND_FIELDS, 'Unknown')))
+    return stream
+
+
+def read_understand_csv(file, writer):
+    '''Normalize a dependency csv exported by Understand from the text `file`.'''
+    reader = csv.reader(file)
+    header = next(reader, [])
+    columns = {column.strip().lower(): index for index, column in enumerate(header)}
+    src = next((columns[c] for c in ['from file', 'from class', 'from entity', 'from'] if c in columns), 0)
+    dst = next((columns[c] for c in ['to file', 'to class', 'to entity', 'to'] if c in columns), 1)
+    count = columns.get('references')
+    for row in reader:
+        if len(row) <= max(src, dst):
+            continue
+        for name in (row[src], row[dst]):
+            writer.entity(name, name, 'File')
+        try:
+            references = int(row[count]) if count is not None else 1
+        except (ValueError, IndexError):
+            references = 1
+        writer.relation(row[src], row[dst], 'Depend', max(1, references))
+
+
+def normalize(source, target, tool=None):
+    '''
+    Normalize the output file `source` of a tool into the `.edges` directory
+    `target`, returns its meta data (see `utils.edges`), which includes
+
+        entities, relations: counts
+        bytes: size of `source`
+        seconds: time taken to normalize
+        relations-per-second: relations normalized per second
+
+    Raises ValueError if `source` is not a well-formed output.
+    '''
+    start = time.monotonic()
+    writer = EdgeWriter(target, tool, os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        if source.lower().endswith('.csv'):
+            read_understand_csv(f, writer)
+        else:
+            try:
+                read_json(f, writer)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'{source} is not well-formed JSON: {e}')
+    seconds = time.monotonic() - start
+    return writer.close(**{
+        'bytes': os.path.getsize(source),
+        'seconds': seconds,
+        'relations-per-second': writer.relations / seconds if seconds > 0 else -1,
+    })
+
+
+def find_output(pattern, since=None):
+    '''
+    Returns the largest file matching the glob `pattern` (`**` included),
+    modified at or after the timestamp `since` if given, or None.
+    '''
+    candidates = []
+    for filepath in glob.glob(pattern, recursive=True):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+        if os.path.isfile(filepath) and (since is None or stat.st_mtime >= since):
+            candidates.append((stat.st_size, filepath))
+    return max(candidates)[1] if len(candidates) != 0 else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='Specify the output file of a tool, JSON or csv exported by Understand')
+    parser.add_argument('target', help='Specify the .edges directory to write')
+    parser.add_argument('--tool', help='Specify the tool recorded in the meta data')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    meta = normalize(args.source, args.target, args.tool)
+    logging.info(f'{meta["entities"]} entities and {meta["relations"]} relations in {meta["seconds"]:.2f}s,'
+                 + f' {meta["relations-per-second"]:.0f} relations/s, {meta["bytes"] / max(meta["seconds"], 1e-9) / 2 ** 20:.1f} MB/s')
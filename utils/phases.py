@@ -0,0 +1,70 @@
+'''
+Per-phase timing of tools from their output.
+
+Tools print a line when they move on to another phase of the analysis, e.g.
+Depends' "Start parsing files..." and "Resolve types and bindings...". A
+`PhaseProfile` lists the phases of a tool in order, each with a regex that
+matches the line starting it. The supervisor timestamps every line as it is
+read and keeps the first match of each phase, from which `durations` makes
+the time spent in each phase:
+
+    parsing: from "Start parsing files" to "Resolve types"
+    resolving: from "Resolve types" to "Start create output"
+    output: from "Start create output" to the exit of the tool
+
+and `startup` for the time before the first phase (JVM startup, option parsing).
+
+Timestamps are when the line was read from the pipe, tools that buffer their
+output (Python, node when not on a terminal) report phases late.
+'''
+
+import re
+
+
+class PhaseProfile:
+    '''
+    Phases of a tool as a list of (name, regex), in the order they run.
+
+    A match only counts if it comes after the phases matched so far, so a
+    later line repeating an earlier marker doesn't move it.
+    '''
+
+    def __init__(self, phases):
+        self.phases = [(name, re.compile(pattern)) for name, pattern in phases]
+
+    @property
+    def names(self):
+        return [name for name, _ in self.phases]
+
+    def match(self, line, reached=0):
+        '''Returns the index of the phase started by `line` among those from `reached` on, or None.'''
+        for index in range(reached, len(self.phases)):
+            if self.phases[index][1].search(line):
+                return index
+        return None
+
+
+class PhaseTracker:
+    '''Timestamps of the phases of a `PhaseProfile` reached by a running tool.'''
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.marks = []
+        self._reached = 0
+
+    def feed(self, line, timestamp):
+        index = self.profile.match(line, self._reached)
+        if index is not None:
+            self.marks.append((self.profile.phases[index][0], timestamp))
+            self._reached = index + 1
+
+    def durations(self, time_start, time_end):
+        '''
+        Returns {phase: seconds} for every phase of the profile, -1 for phases
+        that were not reached, and 'startup' for the time before the first one.
+        '''
+        result = {name: -1 for name in self.profile.names}
+        marks = [('startup', time_start)] + self.marks
+        for (name, start), (_, end) in zip(marks, marks[1:] + [(None, time_end)]):
+            result[name] = max(0, end - start)
+        return result
@@ -0,0 +1,115 @@
+'''
+Repository cache keyed by (url, commit) on top of one shared object store.
+
+Every remote is fetched into the same bare repository, and each revision
+is checked out as a `git worktree` at
+
+    <root>/trees/<hash of url>-<commit>
+
+so two projects sharing their last path segment never collide, re-runs of
+a pinned revision need no network at all, and objects common to several
+revisions are only stored once.
+'''
+
+import os
+import time
+import hashlib
+import logging
+import subprocess
+from threading import Lock
+
+
+# Attempts of a fetch after the store's shallow file was locked by another one
+FETCH_RETRIES = 8
+
+
+class GitError(RuntimeError):
+    '''A git command failed, `output` is all it printed.'''
+
+    def __init__(self, message, output=''):
+        super().__init__(message)
+        self.output = output
+
+
+def url_key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+
+
+def is_commit(revision):
+    return revision is not None and len(revision) == 40 \
+        and all(c in '0123456789abcdef' for c in revision.lower())
+
+
+class RepoCache:
+    def __init__(self, root='./repo/.cache'):
+        self.root = os.path.abspath(root)
+        self.store = os.path.join(self.root, 'store.git')
+        self.trees = os.path.join(self.root, 'trees')
+        # Fetches of one url go one at a time, those of different urls run
+        # concurrently, see `checkout`
+        self._lock = Lock()
+        self._url_locks = dict()
+
+    def _git(self, *args, repo=None):
+        proc = subprocess.run(
+            ['git', '-C', repo if repo is not None else self.store] + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        output = proc.stdout.decode('utf-8', errors='replace').strip()
+        if proc.returncode != 0:
+            lines = output.splitlines()
+            raise GitError(lines[-1] if len(lines) != 0 else f'git {args[0]} returned {proc.returncode}', output)
+        return output
+
+    def _init(self):
+        if not os.path.exists(self.store):
+            os.makedirs(self.trees, exist_ok=True)
+            subprocess.run(['git', 'init', '--quiet', '--bare', self.store], check=True)
+
+    def path_of(self, url, commit):
+        return os.path.join(self.trees, f'{url_key(url)}-{commit}')
+
+    def checkout(self, url, revision=None, source=None):
+        '''
+        Make `revision` (HEAD by default) of `url` available as a directory.
+
+        `source` is where objects are fetched from if not `url` itself, e.g. a
+        local mirror. Returns (path, commit); raises RuntimeError if git fails.
+        '''
+        # A pinned commit that has been checked out before needs nothing else
+        if is_commit(revision) and os.path.exists(self.path_of(url, revision.lower())):
+            return self.path_of(url, revision.lower()), revision.lower()
+
+        with self._lock:
+            self._init()
+            url_lock = self._url_locks.setdefault(url_key(url), Lock())
+
+        with url_lock:
+            ref = f'refs/cache/{url_key(url)}/{revision if revision is not None else "HEAD"}'
+            self._fetch(source if source is not None else url, f'+{revision if revision is not None else "HEAD"}:{ref}')
+            commit = self._git('rev-parse', f'{ref}^{{commit}}')
+
+            path = self.path_of(url, commit)
+            if not os.path.exists(path):
+                # Worktree bookkeeping is shared by all urls, but only takes a moment
+                with self._lock:
+                    # Clean up the bookkeeping of worktrees deleted by hand
+                    self._git('worktree', 'prune')
+                    self._git('worktree', 'add', '--quiet', '--detach', '--no-checkout', path, commit)
+                # Checking out files is the slow part, and only touches this worktree
+                self._git('checkout', '--quiet', '--detach', commit, repo=path)
+            else:
+                logging.info(f'Reusing cached {url} at {commit}')
+        return path, commit
+
+    def _fetch(self, source, refspec):
+        # Shallow fetches rewrite the store's `shallow` file and take `shallow.lock`,
+        # which makes a concurrent one fail at once, so those are retried
+        for attempt in range(FETCH_RETRIES + 1):
+            try:
+                self._git('fetch', '--quiet', '--depth', '1', '--no-tags', '--no-write-fetch-head', source, refspec)
+                return
+            except GitError as e:
+                if 'shallow.lock' not in e.output or attempt == FETCH_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
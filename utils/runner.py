@@ -0,0 +1,286 @@
+'''
+Declarative registry of dependency extraction tools and the one measured
+execution path every tool goes through.
+
+A tool is described by a `ToolRunner`, whose commands are token lists with
+`str.format` placeholders filled from a context dict, e.g.
+
+    register(ToolRunner('depends', 'Depends', {
+        '*': ['java', '-jar', '{tools}/depends.jar', '{lang}', '{repo}', '{project}', '-g', 'var'],
+    }, cwd='./out/depends'))
+
+Available placeholders are whatever the caller puts in the context, do.py
+provides `project`, `repo`, `lang`, `root` and `tools`.
+'''
+
+import os
+import glob
+import time
+import logging
+
+from utils.sampler import sample
+from utils.cgroup import COLUMNS
+from utils.supervisor import supervisor, rusage_result
+from utils.phases import PhaseProfile
+from utils.normalize import normalize, find_output
+
+
+def measure(cmd, cwd=None, timeout=None, label='Process', memory_limit=None, cgroup=None, log_path=None,
+            phases=None):
+    '''
+    Run `cmd` to its end while draining its output, and measure it.
+
+    The process is run by the shared `utils.supervisor.Supervisor`, which
+    appends its output to `<log_path>.out` and `<log_path>.err` if given.
+
+    Returns a dict with
+        time: wall clock duration in seconds, -1 if timed out
+        memory: peak memory usage in MB, -1 if unavailable, this is the
+            cgroup's memory.peak if the process has a cgroup of its own
+        memory-pss: peak proportional set size in MB, -1 if unavailable
+        timeline: memory over time as a `utils.timeline.Timeline`
+        killed: whether the process was killed for exceeding `timeout`
+        oom: whether the process was killed for exceeding `memory_limit` (in MB)
+        returncode: exit status of the process
+        the resource usage of `utils.supervisor.RUSAGE_COLUMNS`, -1 if unavailable
+
+    If `cgroup` (a `CgroupBackend`) is given, the process is run in a group of its
+    own, `memory_limit` becomes the group's `memory.max`, and the group's
+    accounting (see `utils.cgroup.COLUMNS`) is added to the result.
+
+    If `phases` (a `utils.phases.PhaseProfile`) is given, the seconds spent in
+    each phase are added as 'phase-<name>', -1 for phases that were not reached.
+    '''
+    group = None
+    if cgroup is not None:
+        group = cgroup.create(label, memory_limit)
+        cmd = group.wrap(cmd)
+
+    try:
+        # Without `shell=True`, so that the tool itself is the process being
+        # measured, and it is killed along with its whole process group
+        process = supervisor().start(cmd, cwd=cwd, timeout=timeout, label=label, log_path=log_path,
+                                     phases=phases)
+    except OSError:
+        if group is not None:
+            group.remove()
+        raise
+
+    if group is None:
+        sampler = sample(process.pid, memory_limit)
+    else:
+        # The kernel enforces the limit, and the sampler can't find the group
+        # by itself since the process may not have joined it yet
+        sampler = sample(process.pid, cgroup=group.path)
+    process.wait()
+    memory = sampler.stop()
+
+    result = {
+        'time': process.time_end - process.time_start,
+        # No matter it been killed or not, still output the peak memory usage
+        'memory': memory['cgroup_peak'] if memory['cgroup_peak'] != -1 else memory['peak'],
+        'memory-pss': memory['peak_pss'],
+        'timeline': memory['timeline'],
+        'killed': process.killed,
+        'oom': sampler.killed,
+        'returncode': process.returncode,
+    }
+    result.update(rusage_result(process.rusage, result['time']))
+    if process.phases is not None:
+        for name, seconds in process.phases.durations(process.time_start, process.time_end).items():
+            result[f'phase-{name}'] = seconds
+    if group is not None:
+        stats = group.stats()
+        group.remove()
+        if stats['memory'] != -1:
+            result['memory'] = stats['memory']
+        result['oom'] = stats['oom']
+        for column in COLUMNS:
+            result[column] = stats[column]
+        if result['oom']:
+            logging.warning(f'{label} took too much memory and thus been killed')
+
+    if result['killed'] or result['oom']:
+        result['time'] = -1
+    if (result['returncode'] != 0 or result['killed'] or result['oom']) and not process.echo:
+        # Output was not shown, show how it ended
+        logging.warning(f'{label} exited with {result["returncode"]}, last output:\n' + '\n'.join(process.tail))
+    return result
+
+
+class ToolRunner:
+    '''
+    A tool that can be run and measured on a project.
+
+    name: identifier used on the command line, e.g. 'enre'
+    column: prefix of the tool's columns in records, e.g. 'ENRE' for 'ENRE-time'
+    commands: lang -> command, where '*' matches any lang. A command is either a
+        token list to be formatted with the context, or a callable taking
+        the context and returning the token list
+    cwd: working directory template, created if missing
+    label: name used in logs, defaults to `column`
+    requires: path template that must exist for the tool to run, e.g. a project file
+    memory_limit: peak memory in MB above which the tool is killed
+    phases: lang -> [(phase, regex of the line starting it)], where '*' matches
+        any lang, see `utils.phases`
+    output: glob template of the tool's output file, relative to `cwd` if set,
+        to be normalized by `utils.normalize`. Placeholders are filled in escaped.
+        Only the output of this very job must match it, e.g. by a `cwd` of its
+        own for every project
+    export: lang -> command writing `output` from what the tool left, for tools
+        whose own output can't be normalized. Run before normalizing and not
+        measured, commands are as in `commands`
+    '''
+
+    def __init__(self, name, column, commands, cwd=None, label=None, requires=None, memory_limit=None,
+                 phases=None, output=None, export=None):
+        self.name = name
+        self.column = column
+        self.commands = commands
+        self.cwd = cwd
+        self.label = label if label is not None else column
+        self.requires = requires
+        self.memory_limit = memory_limit
+        self.phases = phases if phases is not None else dict()
+        self.output = output
+        self.export = export if export is not None else dict()
+
+    def supports(self, lang):
+        return lang in self.commands or '*' in self.commands
+
+    def command(self, context, commands=None):
+        if commands is None:
+            commands = self.commands
+        template = commands.get(context['lang'], commands.get('*'))
+        if template is None:
+            return None
+        if callable(template):
+            return template(context)
+        return [token.format(**context) for token in template]
+
+    def profile(self, lang):
+        '''Returns the `PhaseProfile` of the tool on `lang`, or None if it has no phase markers.'''
+        phases = self.phases.get(lang, self.phases.get('*'))
+        return PhaseProfile(phases) if phases is not None else None
+
+    def run(self, context, timeout=None, cgroup=None, memory_limit=None, jvm=None, log_dir=None,
+            normalize_dir=None):
+        '''
+        Run the tool on the project in `context`, returns None if it is skipped.
+
+        `memory_limit` overrides the tool's own, see `measure` for `cgroup`.
+        `java -jar` commands are run in a warm worker of `jvm` (a `JvmPool`) if given,
+        and cold where no worker can be started.
+        Output is saved to `<log_dir>/<project>.<label>.out` and `.err` if `log_dir` is given.
+        If `normalize_dir` is given, the tool's output is normalized to
+        `<normalize_dir>/<project>.<label>.edges`, see `normalized`.
+        '''
+        label = self.label.format(**context)
+        project_name = context['project']
+
+        if self.requires is not None and not os.path.exists(self.requires.format(**context)):
+            logging.warning(f'No {label} project for {project_name}, skipped')
+            return None
+
+        print(f'Starting {label}')
+        cmd = self.command(context)
+        print(' '.join(cmd))
+
+        cwd = None
+        if self.cwd is not None:
+            cwd = self.cwd.format(**context)
+            os.makedirs(cwd, exist_ok=True)
+
+        log_path = None
+        if log_dir is not None:
+            log_path = os.path.join(log_dir, f'{project_name}.{label}')
+
+        # File times lag behind time.time() by up to a clock tick, outputs of earlier runs are far older
+        started = time.time() - 1
+        result = None
+        if jvm is not None and jvm.accepts(cmd):
+            result = jvm.measure(cmd,
+                                 cwd=cwd,
+                                 timeout=timeout,
+                                 label=f'Running {label} on {project_name}',
+                                 log_path=log_path,
+                                 phases=self.profile(context['lang']))
+        # Without a JVM worker, or where none can be started
+        if result is None:
+            result = measure(cmd,
+                             cwd=cwd,
+                             timeout=timeout,
+                             label=f'Running {label} on {project_name}',
+                             memory_limit=memory_limit if memory_limit is not None else self.memory_limit,
+                             cgroup=cgroup,
+                             log_path=log_path,
+                             phases=self.profile(context['lang']))
+        if result['time'] != -1:
+            logging.info(
+                f'Running {label} on {project_name} costs {result["time"]}s'
+                + (f' and {result["memory"]}MB' if result['memory'] != -1 else ''))
+        if normalize_dir is not None and self.output is not None and result['time'] != -1 \
+                and result['returncode'] == 0:
+            export = self.command(context, self.export)
+            if export is not None and not self.exported(export, cwd, timeout, f'{label} on {project_name}',
+                                                        f'{log_path}.export' if log_path is not None else None):
+                normalized = {'entities': -1, 'relations': -1, 'normalize-time': -1}
+            else:
+                normalized = self.normalized(context, cwd, started,
+                                             os.path.join(normalize_dir, f'{project_name}.{label}.edges'))
+            # Throughput of the tool itself, rather than of the normalization
+            normalized['relations-per-second'] = normalized['relations'] / result['time'] \
+                if normalized['relations'] != -1 and result['time'] > 0 else -1
+            result.update(normalized)
+        return result
+
+    def exported(self, cmd, cwd, timeout, label, log_path):
+        '''Run the `export` command `cmd` of the tool, returns whether it succeeded.'''
+        print(' '.join(cmd))
+        try:
+            result = measure(cmd, cwd=cwd, timeout=timeout, label=f'Exporting {label}', log_path=log_path)
+        except OSError as e:
+            logging.warning(f'Can not export {label}: {e}')
+            return False
+        if result['time'] == -1 or result['returncode'] != 0:
+            logging.warning(f'Exporting {label} failed, its output is not normalized')
+            return False
+        return True
+
+    def normalized(self, context, cwd, since, target):
+        '''
+        Normalize the output the tool wrote after `since` into `target`, returns
+            entities, relations: counts, -1 if the output is missing or malformed
+            normalize-time: seconds taken by the normalization
+        `run` adds relations-per-second, relations over the time the tool took.
+        '''
+        pattern = self.output.format(**{key: glob.escape(value) if isinstance(value, str) else value
+                                         for key, value in context.items()})
+        if cwd is not None:
+            pattern = os.path.join(glob.escape(cwd), pattern)
+        failed = {'entities': -1, 'relations': -1, 'normalize-time': -1}
+        source = find_output(pattern, since)
+        if source is None:
+            logging.warning(f'No output of {self.label.format(**context)} matches {pattern}')
+            return failed
+        try:
+            meta = normalize(source, target, self.column)
+        except (ValueError, EnvironmentError) as e:
+            logging.warning(f'Can not normalize {source}: {e}')
+            return failed
+        logging.info(f'{source} has {meta["entities"]} entities and {meta["relations"]} relations,'
+                     + f' normalized in {meta["seconds"]:.2f}s')
+        return {'entities': meta['entities'], 'relations': meta['relations'], 'normalize-time': meta['seconds']}
+
+
+RUNNERS = dict()
+
+
+def register(runner):
+    '''Add `runner` to the registry, tools run and are recorded in registration order.'''
+    RUNNERS[runner.name] = runner
+    return runner
+
+
+def runners_for(lang):
+    return [runner for runner in RUNNERS.values() if runner.supports(lang)]
@@ -0,0 +1,360 @@
+'''
+Peak memory sampling of a process tree.
+
+On Linux the tree is sampled straight from /proc, which is much cheaper
+than building `psutil.Process` objects, so the sampling rate can be raised
+whenever memory is moving:
+
+    * VmRSS / VmHWM are read from /proc/<pid>/status of every process
+    * Pss is read from /proc/<pid>/smaps_rollup, only when the tree is close
+      to its peak, since the kernel walks page tables to produce it
+    * the interval starts at `min_interval` and doubles up to `max_interval`
+      while RSS is stable, and drops back as soon as it changes
+
+If the process runs in a cgroup v2 group of its own, `memory.peak` of that
+group is also recorded, which is an exact peak no sampling can miss.
+
+Every sample also goes to a `utils.timeline.Timeline`, the curve the peak
+was taken from.
+
+Elsewhere (e.g. Windows) psutil is polled like before.
+'''
+
+import os
+import time
+import signal
+import logging
+from threading import Thread, Event
+
+from utils.timeline import Timeline
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+
+PROC = '/proc'
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def read_status(pid):
+    '''Returns (VmRSS, VmHWM) of `pid` in kB, or None if it is gone or a zombie.'''
+    try:
+        with open(f'{PROC}/{pid}/status', 'rb') as f:
+            content = f.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    rss = hwm = None
+    for line in content.split(b'\n'):
+        if line.startswith(b'VmRSS:'):
+            rss = int(line.split()[1])
+        elif line.startswith(b'VmHWM:'):
+            hwm = int(line.split()[1])
+    # Zombies (and kernel threads) have no memory lines at all
+    if rss is None:
+        return None
+    return rss, hwm if hwm is not None else rss
+
+
+def reset_hwm(pid):
+    '''
+    Reset VmHWM of `pid` to its current RSS, returns whether it could be reset.
+
+    A process that ran before being sampled, e.g. a warm worker, has the high
+    water mark of its whole life otherwise.
+    '''
+    try:
+        with open(f'{PROC}/{pid}/clear_refs', 'wb') as f:
+            f.write(b'5')
+        return True
+    except OSError:
+        return False
+
+
+def read_pss(pid):
+    '''Returns Pss of `pid` in kB, or None if unavailable.'''
+    try:
+        with open(f'{PROC}/{pid}/smaps_rollup', 'rb') as f:
+            for line in f:
+                if line.startswith(b'Pss:'):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return None
+
+
+def children_of(pid):
+    '''
+    Returns all descendants of `pid`.
+
+    Uses /proc/<pid>/task/<tid>/children if the kernel provides it,
+    otherwise scans the parent pid of every process.
+    '''
+    if not os.path.exists(f'{PROC}/{pid}'):
+        return []
+    if os.path.exists(f'{PROC}/{pid}/task/{pid}/children'):
+        result = []
+        pending = [pid]
+        while len(pending) != 0:
+            curr = pending.pop()
+            try:
+                tids = os.listdir(f'{PROC}/{curr}/task')
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                continue
+            for tid in tids:
+                try:
+                    with open(f'{PROC}/{curr}/task/{tid}/children', 'rb') as f:
+                        found = [int(c) for c in f.read().split()]
+                except (FileNotFoundError, ProcessLookupError, PermissionError):
+                    continue
+                result += found
+                pending += found
+        return result
+
+    parents = dict()
+    for entry in os.listdir(PROC):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'{PROC}/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+        # The command name may contain spaces and parentheses, fields start after the last ')'
+        fields = stat[stat.rfind(b')') + 2:].split()
+        parents.setdefault(int(fields[1]), []).append(int(entry))
+    result = []
+    pending = [pid]
+    while len(pending) != 0:
+        found = parents.get(pending.pop(), [])
+        result += found
+        pending += found
+    return result
+
+
+def cgroup_of(pid):
+    '''Returns the cgroup v2 directory of `pid`, or None on cgroup v1 or no cgroup at all.'''
+    try:
+        with open(f'{PROC}/{pid}/cgroup', 'r') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    directory = os.path.join(CGROUP_ROOT, line[3:].strip().lstrip('/'))
+                    if os.path.exists(os.path.join(directory, 'memory.current')):
+                        return directory
+    except EnvironmentError:
+        pass
+    return None
+
+
+def read_cgroup_peak(directory):
+    '''Returns memory.peak of a cgroup v2 group in MB, or -1 if unavailable.'''
+    try:
+        with open(os.path.join(directory, 'memory.peak'), 'r') as f:
+            return int(f.read()) / 1024 ** 2
+    except (EnvironmentError, ValueError, TypeError):
+        return -1
+
+
+class ProcSampler:
+    '''
+    Sample the memory of `pid` and its descendants from /proc in a background thread.
+
+    Results are in MB:
+        peak: highest sampled sum of RSS of the tree, or the VmHWM of a single
+            process if it is higher, since the kernel tracks that one exactly
+        peak_pss: highest sampled sum of PSS of the tree, which doesn't count
+            pages shared between processes of the tree more than once
+        cgroup_peak: memory.peak of the process's own cgroup, -1 if it has none
+        timeline: every sample as a `Timeline`
+    If `limit` (in MB) is given, the whole tree is killed once the peak exceeds it.
+    Without `hwm`, VmHWM is not used, for a process that ran before sampling
+    started and whose high water mark could not be reset (see `reset_hwm`).
+    '''
+
+    def __init__(self, pid, limit=None, min_interval=0.01, max_interval=0.5, cgroup=None, hwm=True):
+        self.pid = pid
+        self.limit = limit
+        self.hwm = hwm
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.peak = -1
+        self.peak_pss = -1
+        self.cgroup_peak = -1
+        self.samples = 0
+        self.timeline = Timeline()
+        self.killed = False
+        # Only a group of its own tells something about this very process
+        if cgroup is None:
+            cgroup = cgroup_of(pid)
+            if cgroup is not None and cgroup == cgroup_of(os.getpid()):
+                cgroup = None
+        self.cgroup = cgroup
+        self._stop = Event()
+        self._thread = Thread(target=self._task, daemon=True)
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop sampling and return the results, safe to call after the process is gone.'''
+        self._stop.set()
+        self._thread.join()
+        if self.cgroup is not None:
+            self.cgroup_peak = read_cgroup_peak(self.cgroup)
+        return self.result()
+
+    def result(self):
+        return {
+            'peak': self.peak,
+            'peak_pss': self.peak_pss,
+            'cgroup_peak': self.cgroup_peak,
+            'timeline': self.timeline,
+        }
+
+    def _sample(self, tree):
+        total = 0
+        hwm = 0
+        alive = []
+        for pid in tree:
+            status = read_status(pid)
+            if status is None:
+                continue
+            alive.append(pid)
+            total += status[0]
+            hwm = max(hwm, status[1])
+        if len(alive) == 0:
+            return None
+        # With a single process, its high water mark is exact even between two samples
+        peak = max(total, hwm) if len(alive) == 1 and self.hwm else total
+        return total, peak, alive
+
+    def _task(self):
+        interval = self.min_interval
+        last = 0
+        tree = [self.pid]
+        tree_time = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            # Refreshing the tree is the costly part, don't do it on every sample
+            if now - tree_time >= 0.1:
+                tree = [self.pid] + children_of(self.pid)
+                tree_time = now
+            sample = self._sample(tree)
+            if sample is None or self.pid not in sample[2]:
+                # The process has exited (or been killed) and is waiting to be reaped
+                break
+            rss, peak, alive = sample
+            self.samples += 1
+
+            curr = peak / 1024
+            if curr > self.peak:
+                self.peak = curr
+            # Pss <= Rss, so it only needs to be checked close to the RSS peak
+            pss = None
+            if curr >= self.peak * 0.95:
+                pss = 0
+                for pid in alive:
+                    value = read_pss(pid)
+                    pss += value if value is not None else 0
+                self.peak_pss = max(self.peak_pss, pss / 1024)
+            self.timeline.add(now - self._start, rss, pss)
+
+            if self.limit is not None and self.peak > self.limit:
+                for pid in reversed(alive):
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except (ProcessLookupError, PermissionError):
+                        pass
+                self.killed = True
+                logging.warning(
+                    f'The process with pid={self.pid} took too much memory and thus been killed')
+                break
+
+            # Sample fast while memory is moving, and back off while it is stable
+            if last != 0 and abs(rss - last) <= last / 100:
+                interval = min(interval * 2, self.max_interval)
+            else:
+                interval = self.min_interval
+            last = rss
+            self._stop.wait(interval)
+
+
+class PsutilSampler:
+    '''Fallback of `ProcSampler` where /proc is unavailable, polls psutil every 0.5s.'''
+
+    def __init__(self, pid, limit=None, interval=0.5):
+        self.pid = pid
+        self.limit = limit
+        self.interval = interval
+        self.peak = -1
+        self.timeline = Timeline()
+        self.killed = False
+        self._stop = Event()
+        self._thread = Thread(target=self._task, daemon=True)
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.result()
+
+    def result(self):
+        return {'peak': self.peak, 'peak_pss': -1, 'cgroup_peak': -1, 'timeline': self.timeline}
+
+    def _task(self):
+        if psutil is None:
+            logging.warning('Can not import psutil, memory usage monitoring disabled')
+            return
+        try:
+            me = psutil.Process(self.pid)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return
+        while not self._stop.is_set():
+            try:
+                curr = me.memory_info().rss
+                # Also counting descendents
+                children = me.children(recursive=True)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # This usually happens after the process is finished/killed
+                break
+            for child in children:
+                try:
+                    curr += child.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    # Suppress the losing of subprocesses
+                    pass
+            self.timeline.add(time.monotonic() - self._start, curr // 1024)
+            # Convert unit from B to MB
+            curr /= 1024 ** 2
+            self.peak = max(self.peak, curr)
+
+            if self.limit is not None and self.peak > self.limit:
+                for child in children:
+                    try:
+                        child.kill()
+                    except psutil.NoSuchProcess:
+                        pass
+                try:
+                    me.kill()
+                except psutil.NoSuchProcess:
+                    pass
+                self.killed = True
+                logging.warning(
+                    f'The process with pid={self.pid} took too much memory and thus been killed')
+                break
+
+            self._stop.wait(self.interval)
+
+
+def sample(pid, limit=None, **kwargs):
+    '''Start sampling the memory of `pid` with the best sampler for this platform.'''
+    if os.path.exists(f'{PROC}/{pid}/status'):
+        return ProcSampler(pid, limit, **kwargs).start()
+    return PsutilSampler(pid, limit).start()
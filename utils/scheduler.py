@@ -0,0 +1,194 @@
+'''
+Resource-aware job scheduler used by do.py's `--jobs` mode.
+
+A job is a (project, tool) pair. It is only admitted when the number of
+running jobs, the reserved cores and the reserved memory all stay within
+the configured limits, so that concurrently running tools do not fight
+for CPU or swap and thus skew each other's measurements.
+
+Memory reservations are estimated from the peak memory of previous runs,
+read from the result store and `records/*.csv` (and `*.csv.pending` left by
+crashed runs of older versions). The headroom is the memory budget minus
+the reservations of running jobs, rather than what the OS reports as
+available, which already has the memory those jobs take.
+'''
+
+import os
+import csv
+import glob
+import logging
+import statistics
+from threading import Thread, Condition
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+
+# Reservation for a tool that has never been recorded before, in MB
+DEFAULT_MEMORY = 1024
+# Scale recorded peaks up a bit, peaks vary from run to run
+HEADROOM = 1.25
+# Jobs admitted ahead of a queued one before nothing behind it is admitted any more
+MAX_BYPASS = 8
+
+
+def total_memory():
+    '''Physical memory of this machine in MB.'''
+    if psutil is not None:
+        return psutil.virtual_memory().total / 1024 ** 2
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def load_peak_history(records_dir='./records', store=None):
+    '''
+    Collect the highest recorded peak memory for every (project, tool).
+
+    Returns a dict keyed by (project_name, tool) in MB, where `tool` is the
+    column prefix used in the records file, e.g. 'ENRE' for 'ENRE-memory'.
+    Error indicators (0 or -1) are ignored. Results in `store` (a
+    `ResultStore`) are taken into account as well.
+    '''
+    history = dict(store.peak_memory()) if store is not None else dict()
+    files = glob.glob(os.path.join(records_dir, '*.csv')) \
+        + glob.glob(os.path.join(records_dir, '*.csv.pending'))
+    for filepath in files:
+        try:
+            with open(filepath, 'r', encoding='utf-8-sig') as f:
+                for row in csv.DictReader(f):
+                    project_name = row.get('project_name')
+                    if not project_name:
+                        continue
+                    for column, value in row.items():
+                        if column is None or not column.endswith('-memory'):
+                            continue
+                        try:
+                            value = float(value)
+                        except (TypeError, ValueError):
+                            continue
+                        if value <= 0:
+                            continue
+                        key = (project_name, column[:-len('-memory')])
+                        history[key] = max(history.get(key, 0), value)
+        except EnvironmentError:
+            logging.warning(f'Can not read history records from {filepath}')
+    return history
+
+
+class Job:
+    def __init__(self, project_name, tool, target, cores, memory):
+        self.project_name = project_name
+        self.tool = tool
+        self.target = target
+        self.cores = cores
+        self.memory = memory
+        # Jobs admitted while this one was waiting, see `Scheduler._dispatch`
+        self.bypassed = 0
+
+
+class Scheduler:
+    '''
+    Run jobs in worker threads, admitting each one only when at most `jobs`
+    jobs are running and there are enough free cores and memory for it.
+
+    Jobs are admitted first-fit in submission order. A job that doesn't fit
+    has the cores and memory of finishing jobs reserved for it once
+    `MAX_BYPASS` jobs behind it have been admitted, so small jobs can't starve
+    a large one. A job whose estimate exceeds the whole budget is still run,
+    but only once nothing else is.
+    '''
+
+    def __init__(self, jobs=1, cores=None, memory=None, history=None):
+        self.jobs = max(1, jobs)
+        self.cores = cores if cores is not None else (os.cpu_count() or 1)
+        if memory is None:
+            memory = total_memory()
+            # Leave some room for the OS and this script itself
+            memory = memory * 0.9 if memory is not None else None
+        self.memory = memory
+        self.history = history if history is not None else dict()
+
+        # Per-tool fallback estimate for projects without any history
+        by_tool = dict()
+        for (_, tool), peak in self.history.items():
+            by_tool.setdefault(tool, []).append(peak)
+        self._tool_estimate = {tool: statistics.median(peaks) for tool, peaks in by_tool.items()}
+
+        self._cond = Condition()
+        self._queue = []
+        self._running = []
+        self._threads = []
+
+    def estimate(self, project_name, tool):
+        '''Memory in MB to reserve for running `tool` on `project_name`.'''
+        peak = self.history.get((project_name, tool))
+        if peak is None:
+            peak = self._tool_estimate.get(tool, DEFAULT_MEMORY)
+        return peak * HEADROOM
+
+    def submit(self, project_name, tool, target, cores=1, memory=None):
+        '''Queue `target()` to be run as `tool` on `project_name`.'''
+        if memory is None:
+            memory = self.estimate(project_name, tool)
+        job = Job(project_name, tool, target, min(cores, self.cores), memory)
+        with self._cond:
+            self._queue.append(job)
+            self._dispatch()
+
+    def join(self):
+        '''Block until every submitted job has finished.'''
+        with self._cond:
+            while len(self._queue) != 0 or len(self._running) != 0:
+                self._cond.wait()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _fits(self, job):
+        if len(self._running) == 0:
+            return True
+        if len(self._running) >= self.jobs:
+            return False
+        if sum(j.cores for j in self._running) + job.cores > self.cores:
+            return False
+        if self.memory is not None:
+            if sum(j.memory for j in self._running) + job.memory > self.memory:
+                return False
+        return True
+
+    def _dispatch(self):
+        # Must be called with `self._cond` held
+        waiting = []
+        for job in list(self._queue):
+            if not self._fits(job):
+                # Nothing behind a job that has waited long enough goes ahead of it
+                if job.bypassed >= MAX_BYPASS:
+                    break
+                waiting.append(job)
+                continue
+            for other in waiting:
+                other.bypassed += 1
+            self._queue.remove(job)
+            self._running.append(job)
+            logging.info(
+                f'Admitted {job.tool} on {job.project_name}'
+                + f' ({job.cores} cores, {round(job.memory)}MB reserved,'
+                + f' {len(self._running)} running, {len(self._queue)} queued)')
+            thread = Thread(target=self._work, args=(job,))
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self, job):
+        try:
+            job.target()
+        except Exception:
+            logging.exception(f'Job {job.tool} on {job.project_name} failed')
+        finally:
+            with self._cond:
+                self._running.remove(job)
+                self._dispatch()
+                self._cond.notify_all()
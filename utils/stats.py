@@ -0,0 +1,63 @@
+'''
+Summary statistics of repeated measurements.
+
+The median and its confidence interval are used rather than the mean, since
+timings are skewed by the odd slow run (GC pauses, page cache misses). The
+interval comes from order statistics, so it needs no assumption about the
+distribution of samples.
+'''
+
+import math
+import statistics
+
+
+def iqr(samples):
+    '''Interquartile range, 0 for less than 2 samples.'''
+    if len(samples) < 2:
+        return 0
+    q1, _, q3 = statistics.quantiles(samples, n=4, method='inclusive')
+    return q3 - q1
+
+
+def median_ci(samples, confidence=0.95):
+    '''
+    Distribution-free confidence interval of the median, as (low, high).
+
+    With too few samples for the requested confidence (less than 6 for 95%),
+    this is (min, max), whose confidence is 1 - 2 / 2 ** n.
+    '''
+    samples = sorted(samples)
+    n = len(samples)
+    alpha = 1 - confidence
+    # Largest k with P(Binomial(n, 0.5) < k) <= alpha / 2
+    k = 0
+    cumulative = 0
+    while k < n:
+        cumulative += math.comb(n, k) / 2 ** n
+        if cumulative > alpha / 2:
+            break
+        k += 1
+    k = max(k, 1)
+    return samples[k - 1], samples[n - k]
+
+
+def cv(samples):
+    '''Coefficient of variation, 0 for less than 2 samples.'''
+    if len(samples) < 2:
+        return 0
+    mean = statistics.fmean(samples)
+    return statistics.stdev(samples) / mean if mean != 0 else 0
+
+
+def summarize(samples, confidence=0.95):
+    '''Returns a dict of n, median, iqr, ci-low and ci-high of `samples`, or None if there is none.'''
+    if len(samples) == 0:
+        return None
+    low, high = median_ci(samples, confidence)
+    return {
+        'n': len(samples),
+        'median': statistics.median(samples),
+        'iqr': iqr(samples),
+        'ci-low': low,
+        'ci-high': high,
+    }
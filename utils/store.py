@@ -0,0 +1,478 @@
+'''
+Append-only result store on SQLite.
+
+Every run of do.py gets a row in `runs`, and every measured (project, tool)
+of it a row in `results`, holding the revision the project was analyzed at,
+time, memory, resource usage (see `utils.supervisor.RUSAGE_COLUMNS`), exit
+status and whether the tool was killed. Rows are never
+updated, so re-running a project adds new rows and the history of every
+measurement is kept; queries pick the latest one by default.
+
+Writes are buffered and committed in one transaction per `flush()`, so a
+crash loses at most the project being analyzed. Records files in the old
+csv layout are exported from the store, see `export_csv`.
+
+Memory timelines of results (see `utils.timeline`) go to `timelines`, one
+row per result with the compressed series as blobs, and can be exported
+as csv or drawn:
+
+    $ python -m utils.store runs
+    $ python -m utils.store export java ./records/java.csv
+    $ python -m utils.store timeline fastjson ENRE ./fastjson-enre.png
+'''
+
+import os
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+from threading import Lock
+
+from utils.stats import cv, summarize
+from utils.timeline import Timeline, Series
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT,
+    lang TEXT,
+    from_line INTEGER,
+    end_line INTEGER,
+    only TEXT,
+    options TEXT
+);
+CREATE TABLE IF NOT EXISTS completions (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    finished TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs (id),
+    project TEXT,
+    tool TEXT,
+    revision TEXT,
+    time REAL,
+    memory REAL,
+    memory_pss REAL,
+    returncode INTEGER,
+    timed_out INTEGER,
+    oom INTEGER,
+    extra TEXT,
+    recorded TEXT,
+    trial INTEGER DEFAULT 0,
+    user_time REAL,
+    system_time REAL,
+    maxrss REAL,
+    voluntary_switches INTEGER,
+    involuntary_switches INTEGER,
+    major_faults INTEGER
+);
+CREATE TABLE IF NOT EXISTS loc (
+    run_id INTEGER REFERENCES runs (id),
+    project TEXT,
+    revision TEXT,
+    loc INTEGER,
+    recorded TEXT
+);
+CREATE TABLE IF NOT EXISTS timelines (
+    run_id INTEGER REFERENCES runs (id),
+    project TEXT,
+    tool TEXT,
+    trial INTEGER,
+    rss BLOB,
+    pss BLOB
+);
+CREATE INDEX IF NOT EXISTS results_key ON results (project, tool);
+'''
+
+# Resource usage keys of a `measure` result -> their columns, parallelism is derived from them
+RUSAGE = {
+    'user-time': 'user_time',
+    'system-time': 'system_time',
+    'maxrss': 'maxrss',
+    'voluntary-switches': 'voluntary_switches',
+    'involuntary-switches': 'involuntary_switches',
+    'major-faults': 'major_faults',
+}
+
+# Keys of a `measure` result that have columns of their own, anything else goes to `extra`
+RESULT_KEYS = ['time', 'memory', 'memory-pss', 'returncode', 'killed', 'oom', 'timeline', 'parallelism'] \
+    + list(RUSAGE)
+
+
+def now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def known(value):
+    # -1 is how measurements tell something is unavailable
+    return None if value is None or value == -1 else value
+
+
+class ResultStore:
+    '''
+    Results of all runs in the SQLite database at `path`.
+
+    Safe to share between the scheduler's threads. `batch` is the number of
+    buffered rows that triggers a commit without waiting for `flush()`.
+    '''
+
+    def __init__(self, path='./records/results.sqlite', batch=64):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.batch = batch
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        # Stores created before repeated trials have no trial column
+        columns = [row['name'] for row in self.db.execute('PRAGMA table_info(results)')]
+        if 'trial' not in columns:
+            with self.db:
+                self.db.execute('ALTER TABLE results ADD COLUMN trial INTEGER DEFAULT 0')
+        # Nor resource usage
+        if 'user_time' not in columns:
+            with self.db:
+                for column in RUSAGE.values():
+                    kind = 'REAL' if column in ('user_time', 'system_time', 'maxrss') else 'INTEGER'
+                    self.db.execute(f'ALTER TABLE results ADD COLUMN {column} {kind}')
+        self._lock = Lock()
+        self._results = []
+        self._loc = []
+        self._timelines = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def start_run(self, lang, from_line, end_line, only='', options=None):
+        '''Register a new run and returns its id.'''
+        with self._lock, self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (started, lang, from_line, end_line, only, options) VALUES (?, ?, ?, ?, ?, ?)',
+                (now(), lang, from_line, end_line, only, json.dumps(options) if options is not None else None))
+            return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        self.flush()
+        with self._lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO completions VALUES (?, ?)', (run_id, now()))
+
+    def add(self, run_id, project_name, tool, revision, result, trial=0):
+        '''
+        Buffer the `measure` result of `tool` (its records column prefix, e.g. 'ENRE') on a project.
+
+        `trial` numbers repeated samples from 0, warmup runs are negative.
+        '''
+        extra = {key: value for key, value in result.items() if key not in RESULT_KEYS}
+        row = (run_id, project_name, tool, revision,
+               known(result.get('time')), known(result.get('memory')), known(result.get('memory-pss')),
+               result.get('returncode'), int(bool(result.get('killed'))), int(bool(result.get('oom'))),
+               json.dumps(extra) if len(extra) != 0 else None, now(), trial) \
+            + tuple(known(result.get(key)) for key in RUSAGE)
+        with self._lock:
+            self._results.append(row)
+            timeline = result.get('timeline')
+            if timeline is not None and len(timeline.rss) != 0:
+                self._timelines.append((run_id, project_name, tool, trial,
+                                        timeline.rss.encode(), timeline.pss.encode()))
+            full = len(self._results) + len(self._loc) >= self.batch
+        if full:
+            self.flush()
+
+    def add_loc(self, run_id, project_name, revision, loc):
+        with self._lock:
+            self._loc.append((run_id, project_name, revision, known(loc), now()))
+
+    def flush(self):
+        '''Commit buffered rows in a single transaction.'''
+        with self._lock:
+            results, self._results = self._results, []
+            loc, self._loc = self._loc, []
+            timelines, self._timelines = self._timelines, []
+            if len(results) == 0 and len(loc) == 0:
+                return
+            with self.db:
+                self.db.executemany(
+                    'INSERT INTO results (run_id, project, tool, revision, time, memory, memory_pss,'
+                    ' returncode, timed_out, oom, extra, recorded, trial, '
+                    + ', '.join(RUSAGE.values()) + ')'
+                    ' VALUES (' + ', '.join(['?'] * (13 + len(RUSAGE))) + ')',
+                    results)
+                self.db.executemany('INSERT INTO loc VALUES (?, ?, ?, ?, ?)', loc)
+                self.db.executemany('INSERT INTO timelines VALUES (?, ?, ?, ?, ?, ?)', timelines)
+
+    def runs(self):
+        with self._lock:
+            return [dict(row) for row in self.db.execute(
+                'SELECT runs.*, completions.finished FROM runs'
+                ' LEFT JOIN completions ON completions.run_id = runs.id ORDER BY runs.id')]
+
+    def run(self, run_id):
+        '''Returns the run `run_id` as a dict, or None if there is no such run.'''
+        for run in self.runs():
+            if run['id'] == run_id:
+                return run
+        return None
+
+    def find_run(self, lang, from_line, end_line):
+        '''Returns the id of the latest unfinished run over the same projects, or None.'''
+        for run in reversed(self.runs()):
+            if run['finished'] is None and (run['lang'], run['from_line'], run['end_line']) == (lang, from_line, end_line):
+                return run['id']
+        return None
+
+    def trials(self, run_id):
+        '''
+        Returns the times of the successful measured trials of `run_id`, as
+        {(project, tool): {trial: time}} in the order they were run. Only the
+        latest result of a trial counts, see `summary`. Warmup runs, and trials
+        that timed out, took too much memory or exited with an error are left out.
+        '''
+        latest = {(result['project'], result['tool'], result['trial']): result
+                  for result in self.query(run=run_id, latest=False)}
+        trials = dict()
+        for (project_name, tool, trial), result in latest.items():
+            if not result['timed_out'] and not result['oom'] and result['returncode'] in (0, None) \
+                    and result['time'] is not None:
+                trials.setdefault((project_name, tool), dict())[trial] = result['time']
+        return trials
+
+    def completed(self, run_id, repeat=1, stable=None, min_trials=3):
+        '''
+        Returns the (project, tool) pairs of `run_id` that need not be run again,
+        where LoC is the tool 'LoC'. A tool has completed once it has `repeat`
+        successful trials (see `trials`), or at least `min_trials` of them whose
+        coefficient of variation is at most `stable`, as do.py stops repeating.
+        A failed LoC count is not completed.
+        '''
+        completed = set()
+        for key, times in self.trials(run_id).items():
+            times = list(times.values())
+            if len(times) >= repeat or (stable is not None and len(times) >= min_trials and cv(times) <= stable):
+                completed.add(key)
+        for project_name, loc in self.loc(run=run_id).items():
+            if loc is not None:
+                completed.add((project_name, 'LoC'))
+        return completed
+
+    def query(self, lang=None, tool=None, project=None, run=None, latest=True, warmup=False):
+        '''
+        Returns results as dicts, filtered by whichever of the arguments is given.
+
+        With `latest`, only the most recent result of every (project, tool) is
+        returned. Warmup runs are left out unless `warmup`. Keys of `extra`
+        (e.g. cgroup accounting) are merged into the dicts, and resource usage
+        is under the keys of `measure` ('user-time', ..., 'parallelism').
+        '''
+        conditions, parameters = [], []
+        if not warmup:
+            conditions.append('results.trial >= 0')
+        for column, value in [('runs.lang', lang), ('results.tool', tool),
+                              ('results.project', project), ('results.run_id', run)]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+        sql = 'SELECT results.*, runs.lang FROM results JOIN runs ON runs.id = results.run_id'
+        if len(conditions) != 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY results.id'
+        with self._lock:
+            rows = [dict(row) for row in self.db.execute(sql, parameters)]
+
+        if latest:
+            rows = list({(row['project'], row['tool']): row for row in rows}.values())
+        for row in rows:
+            extra = row.pop('extra')
+            if extra is not None:
+                row.update(json.loads(extra))
+            for key, column in RUSAGE.items():
+                row[key] = row.pop(column)
+            cpu = None if row['user-time'] is None or row['system-time'] is None \
+                else row['user-time'] + row['system-time']
+            row['parallelism'] = cpu / row['time'] if cpu is not None and row['time'] else None
+        return rows
+
+    def loc_rows(self, lang=None, run=None):
+        '''Returns LoC rows as dicts of project, revision and loc, oldest first.'''
+        conditions, parameters = [], []
+        for column, value in [('runs.lang', lang), ('loc.run_id', run)]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+        sql = 'SELECT loc.project, loc.revision, loc.loc FROM loc JOIN runs ON runs.id = loc.run_id'
+        if len(conditions) != 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with self._lock:
+            return [dict(row) for row in self.db.execute(sql + ' ORDER BY loc.rowid', parameters)]
+
+    def loc(self, lang=None, run=None):
+        '''Returns the latest LoC of every project, as {project: loc}.'''
+        return {row['project']: row['loc'] for row in self.loc_rows(lang, run)}
+
+    def summary(self, lang=None, run=None, confidence=0.95):
+        '''
+        Summarize repeated samples of every (project, tool) in its latest run.
+
+        Returns {(project, tool): dict} with 'time' and 'memory' as given by
+        `utils.stats.summarize` over samples that were not killed (None if there
+        is none), whatever their exit status, 'failed' as the number of killed
+        samples or samples that exited with an error, and 'latest' as the
+        latest sample, as returned by `query`.
+
+        A trial that a resumed run measured again (see `trials`) is only
+        summarized by its latest sample.
+        '''
+        samples = dict()
+        for result in self.query(lang=lang, run=run, latest=False):
+            key = (result['project'], result['tool'])
+            # Only samples of the latest run are summarized, older ones measured another setup
+            if key in samples and samples[key][0]['run_id'] != result['run_id']:
+                del samples[key]
+            samples.setdefault(key, []).append(result)
+
+        summary = dict()
+        for key, results in samples.items():
+            latest = results[-1]
+            results = list({result['trial']: result for result in results}.values())
+            # A tool that exits with an error has still run to its end, and its time is kept as it always was
+            measured = [result for result in results if not result['timed_out'] and not result['oom']
+                        and result['time'] is not None]
+            memory = [result['memory'] for result in measured if result['memory'] is not None]
+            summary[key] = {
+                'time': summarize([result['time'] for result in measured], confidence),
+                'memory': summarize(memory, confidence),
+                'failed': len([result for result in results if result not in measured
+                               or result['returncode'] not in (0, None)]),
+                'latest': latest,
+            }
+        return summary
+
+    def timeline(self, project_name, tool, run=None, trial=None):
+        '''
+        Returns the `Timeline` of `tool` on a project, or None if there is none.
+
+        Picks the latest run unless `run` is given, and the last trial of it
+        unless `trial` is given.
+        '''
+        sql = 'SELECT rss, pss FROM timelines WHERE project = ? AND tool = ?'
+        params = [project_name, tool]
+        if run is not None:
+            sql += ' AND run_id = ?'
+            params.append(run)
+        if trial is not None:
+            sql += ' AND trial = ?'
+            params.append(trial)
+        sql += ' ORDER BY rowid DESC LIMIT 1'
+        with self._lock:
+            row = self.db.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        return Timeline(Series.decode(row['rss']), Series.decode(row['pss']))
+
+    def peak_memory(self):
+        '''Returns the highest peak memory of every (project, tool) in MB, like `load_peak_history`.'''
+        with self._lock:
+            return {(row[0], row[1]): row[2] for row in self.db.execute(
+                'SELECT project, tool, MAX(memory) FROM results WHERE memory > 0 GROUP BY project, tool')}
+
+    def table(self, lang=None, run=None, columns=(), stats=False):
+        '''
+        Returns rows in the records csv layout, as dicts of 'project_name',
+        'LoC', '<tool>-time', '<tool>-memory' and '<tool>-<column>' for `columns`,
+        and 'revision'. Killed runs have a time of -1, as in records files, and
+        runs that exited with an error have their time, their exit status is
+        exported with the column 'returncode'.
+
+        Time and memory are medians of repeated samples. With `stats`, the
+        number of samples, the IQR and confidence interval of the time are
+        added as '<tool>-time-n', '<tool>-time-iqr', '<tool>-time-ci-low' and
+        '<tool>-time-ci-high'.
+        '''
+        rows = dict()
+        for loc in self.loc_rows(lang, run):
+            row = rows.setdefault(loc['project'], {'project_name': loc['project']})
+            row['LoC'] = loc['loc'] if loc['loc'] is not None else -1
+            if loc['revision'] is not None:
+                row['revision'] = loc['revision']
+        for (project_name, tool), summary in self.summary(lang, run).items():
+            row = rows.setdefault(project_name, {'project_name': project_name})
+            result = summary['latest']
+            time, memory = summary['time'], summary['memory']
+            row[f'{tool}-time'] = time['median'] if time is not None else -1
+            if memory is not None:
+                row[f'{tool}-memory'] = memory['median']
+            else:
+                # No matter it been killed or not, still output the peak memory usage
+                row[f'{tool}-memory'] = result['memory'] if result['memory'] is not None else -1
+            for column in columns:
+                value = result.get(column)
+                row[f'{tool}-{column}'] = value if value is not None else -1
+            if stats:
+                for key in ['n', 'iqr', 'ci-low', 'ci-high']:
+                    row[f'{tool}-time-{key}'] = time[key] if time is not None else -1
+            if result['revision'] is not None:
+                row['revision'] = result['revision']
+        return list(rows.values())
+
+    def export_csv(self, filepath, tools, lang=None, run=None, columns=(), stats=False):
+        '''
+        Write results in the records csv layout, tools (records column prefixes)
+        in the order of `tools`. Tools without a result are written as 0.
+        See `table` for `columns` and `stats`.
+        '''
+        header = ['project_name', 'LoC']
+        for tool in tools:
+            header += [f'{tool}-time', f'{tool}-memory'] + [f'{tool}-{column}' for column in columns]
+            if stats:
+                header += [f'{tool}-time-{key}' for key in ['n', 'iqr', 'ci-low', 'ci-high']]
+        header.append('revision')
+
+        tmp_path = f'{filepath}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(','.join(header) + '\n')
+            for row in self.table(lang, run, columns, stats):
+                f.write(','.join(
+                    str(row.get(column, '' if column == 'revision' else 0)) for column in header) + '\n')
+        os.replace(tmp_path, filepath)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', help='Specify the result store', default='./records/results.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('runs', help='List all runs')
+    export = commands.add_parser('export', help='Export the latest results in the records csv layout')
+    export.add_argument('lang', help='Sepcify the target language')
+    export.add_argument('output', help='Specify the csv file to write')
+    export.add_argument('--run', help='Only export results of the given run', type=int)
+    export.add_argument('--stats', help='Add the number of samples, IQR and confidence interval of times',
+                        action='store_true')
+    timeline = commands.add_parser('timeline', help='Export the memory timeline of a tool on a project')
+    timeline.add_argument('project', help='Specify the project name')
+    timeline.add_argument('tool', help='Specify the tool, as its records column prefix, e.g. ENRE')
+    timeline.add_argument('output', help='Specify the file to write, a csv file or an image')
+    timeline.add_argument('--run', help='Export the timeline of the given run', type=int)
+    timeline.add_argument('--trial', help='Export the timeline of the given trial', type=int)
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    if args.command == 'runs':
+        for run in store.runs():
+            print(f'{run["id"]:>5}  {run["started"]}  {run["lang"]:<7}{run["from_line"]}-{run["end_line"]}'
+                  f'  {run["only"] or "all tools"}  {"finished" if run["finished"] else "unfinished"}')
+    elif args.command == 'timeline':
+        found = store.timeline(args.project, args.tool, args.run, args.trial)
+        if found is None:
+            raise SystemExit(f'No memory timeline of {args.tool} on {args.project}')
+        if args.output.endswith('.csv'):
+            found.write_csv(args.output)
+        else:
+            found.plot(args.output, f'{args.tool} on {args.project}')
+    else:
+        tools = []
+        for result in store.query(lang=args.lang, run=args.run, latest=False):
+            if result['tool'] not in tools:
+                tools.append(result['tool'])
+        store.export_csv(args.output, tools, args.lang, args.run, columns=['returncode'], stats=args.stats)
+    store.close()
@@ -0,0 +1,417 @@
+'''
+Asyncio based supervisor of tool processes.
+
+A single event loop, running in a thread of its own, starts every tool
+process and drains its stdout and stderr as raw bytes, so neither a bad
+byte sequence nor a chatty tool can stall a run, however many tools run at
+the same time. For each process
+
+    * stdout and stderr go byte for byte into per-job log files
+    * the last lines of both are kept in a bounded ring buffer, shown on the
+      console when the tool fails instead of flooding it with every line
+    * lines are timestamped as they are read, and matched against the tool's
+      phase markers if it has a `utils.phases.PhaseProfile`
+    * the timeout is enforced with `asyncio.wait_for`, and a timed out tool
+      is stopped together with its whole process group, SIGTERM first and
+      SIGKILL for whatever is left after `TERM_GRACE` seconds; on Windows the
+      tree is killed with `taskkill /T /F`
+    * every tool is the leader of a session of its own, and descendants still
+      in that session once the tool has exited (Understand's helpers, node
+      workers) are stopped the same way before the process counts as done
+    * on POSIX the tool is reaped with `os.wait4`, which gives its resource
+      usage (CPU time, peak RSS, context switches, page faults) as counted by
+      the kernel, see `RUSAGE_COLUMNS`
+
+Durations are measured with `time.monotonic`, so they are not skewed by
+changes of the wall clock during a long run.
+
+Callers block on `Process.wait()` from their own (scheduler) threads, so a
+job only frees its slot, and the next job is only admitted, once no
+descendant of it is left to skew the next measurement.
+'''
+
+import os
+import sys
+import time
+import signal
+import subprocess
+import asyncio
+import logging
+import collections
+from threading import Thread, Event, Lock
+
+from utils.phases import PhaseTracker
+
+
+# Lines of output kept for the console
+RING_SIZE = 50
+# How long the output of an exited tool is still drained, grandchildren may hold its pipes open
+DRAIN_GRACE = 5
+# How long a process may take to exit on SIGTERM before being sent SIGKILL
+TERM_GRACE = 5
+
+# Resource usage of a tool from `os.wait4`, -1 where unavailable:
+#   user-time, system-time: CPU seconds of the tool and the descendants it waited for
+#   maxrss: peak RSS in MB of the largest single process among them, not their sum; Linux counts
+#       the harness' RSS at fork time too, so this is only meaningful for tools larger than it
+#   voluntary-switches, involuntary-switches: context switches, waiting for I/O or locks against being preempted
+#   major-faults: page faults that had to read from disk
+#   parallelism: CPU time over wall clock time, how many cores the tool kept busy
+RUSAGE_COLUMNS = ['user-time', 'system-time', 'maxrss', 'voluntary-switches', 'involuntary-switches',
+                  'major-faults', 'parallelism']
+
+
+class Process:
+    '''A tool process started by `Supervisor.start`.'''
+
+    def __init__(self, label, echo, phases=None):
+        self.label = label
+        self.echo = echo
+        # A `PhaseTracker` if the tool has phase markers
+        self.phases = PhaseTracker(phases) if phases is not None else None
+        self.pid = None
+        self.tail = collections.deque(maxlen=RING_SIZE)
+        self.returncode = None
+        self.killed = False
+        # Descendants that outlived the tool and had to be stopped
+        self.orphans = []
+        # `resource.struct_rusage` of the tool, None where unavailable
+        self.rusage = None
+        # `time.monotonic()` at start and exit
+        self.time_start = None
+        self.time_end = None
+        self.error = None
+        self._started = Event()
+        self._done = Event()
+
+    def wait(self):
+        '''Block until the process has exited and its output is drained, returns its exit status.'''
+        self._done.wait()
+        return self.returncode
+
+
+class Supervisor:
+    '''
+    Run processes on an event loop in a background thread.
+
+    echo: also write every line of output to the console, as tools used to,
+        which is only readable when a single tool runs at a time
+    '''
+
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self, cmd, cwd=None, timeout=None, label='Process', log_path=None, phases=None):
+        '''
+        Start `cmd`, and return a `Process` as soon as it has a pid.
+
+        Output is appended to `log_path` (`<log_path>.out` and `<log_path>.err`)
+        if given, and matched against `phases` (a `PhaseProfile`) if given.
+        Raises OSError if the process can not be started.
+        '''
+        process = Process(label, self.echo, phases)
+        asyncio.run_coroutine_threadsafe(self._run(process, cmd, cwd, timeout, log_path), self.loop)
+        process._started.wait()
+        if process.error is not None:
+            raise process.error
+        return process
+
+    async def _run(self, process, cmd, cwd, timeout, log_path):
+        logs = [None, None]
+        try:
+            if log_path is not None:
+                os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+                logs = [open(f'{log_path}.out', 'ab'), open(f'{log_path}.err', 'ab')]
+                for log in logs:
+                    log.write(f'==== {time.strftime("%Y-%m-%d %H:%M:%S")} {" ".join(cmd)}\n'.encode('utf-8'))
+
+            process.time_start = time.monotonic()
+            if os.name == 'posix':
+                proc = await PosixChild.start(cmd, cwd)
+            else:
+                proc = AsyncioChild(await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=cwd))
+        except Exception as e:
+            process.error = e
+            for log in logs:
+                if log is not None:
+                    log.close()
+            process._started.set()
+            process._done.set()
+            return
+
+        process.pid = proc.pid
+        process._started.set()
+        drains = [
+            asyncio.ensure_future(self._drain(process, proc.stdout, logs[0], sys.stdout)),
+            asyncio.ensure_future(self._drain(process, proc.stderr, logs[1], sys.stderr)),
+        ]
+        try:
+            process.time_end = await asyncio.wait_for(proc.exited(), timeout)
+        except asyncio.TimeoutError:
+            process.killed = True
+            logging.warning(f'{process.label} timed out')
+            await terminate(proc)
+            process.time_end = time.monotonic()
+        process.returncode = proc.returncode
+        process.rusage = proc.rusage
+
+        if os.name == 'posix':
+            process.orphans = session_members(proc.pid)
+            if len(process.orphans) != 0:
+                logging.warning(
+                    f'{process.label} left {len(process.orphans)} processes behind'
+                    + f' ({", ".join(str(pid) for pid in process.orphans)}), stopping them')
+                await terminate_session(proc.pid)
+
+        _, pending = await asyncio.wait(drains, timeout=DRAIN_GRACE)
+        for drain in pending:
+            drain.cancel()
+        for log in logs:
+            if log is not None:
+                log.close()
+        process._done.set()
+
+    async def _drain(self, process, stream, log, console):
+        pending = b''
+        while True:
+            chunk = await stream.read(64 * 1024)
+            if len(chunk) == 0:
+                break
+            timestamp = time.monotonic()
+            if log is not None:
+                log.write(chunk)
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                line = line.decode('utf-8', errors='replace')
+                process.tail.append(line)
+                if process.phases is not None:
+                    process.phases.feed(line, timestamp)
+                if process.echo:
+                    console.write(line + '\n')
+        if len(pending) != 0:
+            process.tail.append(pending.decode('utf-8', errors='replace'))
+            if process.echo:
+                console.write(pending.decode('utf-8', errors='replace') + '\n')
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class PosixChild:
+    '''
+    A tool started with `subprocess.Popen` and reaped with `os.wait4`.
+
+    asyncio's own subprocesses are reaped by its child watcher, which throws
+    the resource usage of the child away, so the pipes are attached to the
+    loop by hand instead.
+    '''
+
+    def __init__(self, popen):
+        self.popen = popen
+        self.pid = popen.pid
+        self.returncode = None
+        self.rusage = None
+        self.stdout = None
+        self.stderr = None
+        self.time_end = None
+
+    @classmethod
+    async def start(cls, cmd, cwd):
+        loop = asyncio.get_running_loop()
+        # A session of its own, so that the whole tree can be killed
+        popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
+                                 start_new_session=True)
+        child = cls(popen)
+        child.stdout = await _reader(loop, popen.stdout)
+        child.stderr = await _reader(loop, popen.stderr)
+        return child
+
+    def _reap(self, flags):
+        pid, status, rusage = os.wait4(self.pid, flags)
+        if pid == 0:
+            return False
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        # Keeps Popen from trying to reap it again
+        self.popen.returncode = self.returncode
+        return True
+
+    async def exited(self):
+        '''
+        Wait for the tool to exit, reap it, and return the time it did.
+
+        This doesn't wait for the pipes of the tool to be closed as well,
+        which descendants may keep open long after it exited.
+        '''
+        if self.returncode is not None:
+            return self.time_end
+        loop = asyncio.get_running_loop()
+        try:
+            fd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            fd = None
+        if fd is not None:
+            # Readable as soon as the process exits
+            exit = loop.create_future()
+            loop.add_reader(fd, lambda: exit.done() or exit.set_result(time.monotonic()))
+            try:
+                time_end = await exit
+            finally:
+                loop.remove_reader(fd)
+                os.close(fd)
+            self._reap(0)
+        else:
+            while not self._reap(os.WNOHANG):
+                await asyncio.sleep(0.01)
+            time_end = time.monotonic()
+        self.time_end = time_end
+        return time_end
+
+
+class AsyncioChild:
+    '''An asyncio subprocess, where `os.wait4` is unavailable.'''
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.pid = proc.pid
+        self.rusage = None
+        self.stdout = proc.stdout
+        self.stderr = proc.stderr
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    def kill(self):
+        self.proc.kill()
+
+    async def exited(self):
+        '''Wait for the tool to exit without waiting for its pipes, and return the time it did.'''
+        while self.proc.returncode is None:
+            await asyncio.sleep(0.01)
+        return time.monotonic()
+
+
+async def _reader(loop, pipe):
+    reader = asyncio.StreamReader(loop=loop)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+    return reader
+
+
+def rusage_result(rusage, wall):
+    '''The `RUSAGE_COLUMNS` of `rusage` for a run of `wall` seconds, all -1 if `rusage` is None.'''
+    if rusage is None:
+        return {column: -1 for column in RUSAGE_COLUMNS}
+    # Kilobytes on Linux, bytes on macOS
+    maxrss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    cpu = rusage.ru_utime + rusage.ru_stime
+    return {
+        'user-time': rusage.ru_utime,
+        'system-time': rusage.ru_stime,
+        'maxrss': maxrss,
+        'voluntary-switches': rusage.ru_nvcsw,
+        'involuntary-switches': rusage.ru_nivcsw,
+        'major-faults': rusage.ru_majflt,
+        'parallelism': cpu / wall if wall > 0 else -1,
+    }
+
+
+def session_members(sid):
+    '''Pids of the processes in session `sid`, empty where /proc is unavailable.'''
+    pids = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command may contain spaces and parentheses, fields after it don't
+        fields = stat[stat.rindex(b')') + 2:].split()
+        # state, ppid, pgrp, session; zombies are gone as soon as they are reaped
+        if int(fields[3]) == sid and fields[0] != b'Z':
+            pids.append(int(entry))
+    return pids
+
+
+def signal_session(sid, sig):
+    '''Send `sig` to every process in session `sid`, including those that moved to another group.'''
+    try:
+        os.killpg(sid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+    for pid in session_members(sid):
+        try:
+            os.kill(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+async def terminate_session(sid):
+    '''SIGTERM every process in session `sid`, and SIGKILL those left after `TERM_GRACE` seconds.'''
+    signal_session(sid, signal.SIGTERM)
+    deadline = time.monotonic() + TERM_GRACE
+    while len(session_members(sid)) != 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if len(session_members(sid)) != 0:
+        signal_session(sid, signal.SIGKILL)
+
+
+def kill_tree(pid):
+    '''Kill `pid` and all its descendants with taskkill, on Windows.'''
+    proc = subprocess.run(['taskkill', '/T', '/F', '/PID', str(pid)],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if proc.returncode != 0:
+        logging.warning(f'taskkill of process {pid} failed: {proc.stdout.decode(errors="replace").strip()}')
+
+
+async def terminate(proc):
+    '''Stop `proc` and its whole process tree, escalating from SIGTERM to SIGKILL.'''
+    if os.name != 'posix':
+        # Windows has no sessions to signal, but taskkill walks the tree down from
+        # the tool while it is still alive, e.g. to und or node workers
+        await asyncio.get_running_loop().run_in_executor(None, kill_tree, proc.pid)
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.exited()
+        return
+    signal_session(proc.pid, signal.SIGTERM)
+    try:
+        # Descendants that are still exiting are left to the orphan check
+        await asyncio.wait_for(proc.exited(), TERM_GRACE)
+    except asyncio.TimeoutError:
+        logging.warning(f'Process {proc.pid} ignored SIGTERM, killing it')
+        signal_session(proc.pid, signal.SIGKILL)
+        await proc.exited()
+
+
+_supervisor = None
+_lock = Lock()
+
+
+def supervisor(echo=None):
+    '''Returns the shared supervisor, created on first use; `echo` changes whether output is echoed.'''
+    global _supervisor
+    with _lock:
+        if _supervisor is None:
+            _supervisor = Supervisor(echo if echo is not None else True)
+        elif echo is not None:
+            _supervisor.echo = echo
+        return _supervisor
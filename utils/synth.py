@@ -0,0 +1,363 @@
+'''
+Synthetic repositories of a given size for controlled scaling experiments.
+
+The projects of `lists/` differ in much more than their LoC, so scaling
+curves drawn from them mix the effect of size with everything else. A
+synthetic repository only varies by what is asked for:
+
+    loc       lines of code, as counted by cloc (no blank or comment lines)
+    files     number of modules, LoC / 150 by default
+    density   mean number of other modules each module depends on
+
+Every module is a class with a field per dependency and methods whose
+bodies are arithmetic and calls to the dependencies and to earlier methods
+of the class, in C a struct and functions taking a pointer to it.
+Dependencies form a DAG, each module depending on earlier ones picked
+with a preference for those already depended on, so a few modules end up
+used everywhere as in real code. Module sizes vary log-normally around
+LoC / files.
+
+Output is deterministic: the same language, size and seed give the same
+files, and the same commit, since the repository is committed with a fixed
+author and date. A project list is written next to the ones of `lists/`,
+to be given to do.py with `--list`:
+
+    $ python -m utils.synth java --loc 1000 10000 100000 1000000
+    $ python do.py java 1-4 --list "./lists/java project list synthetic.csv"
+'''
+
+import os
+import csv
+import json
+import math
+import random
+import shutil
+import logging
+import argparse
+import subprocess
+
+
+# Marks a directory as generated, so that it can be replaced by the next generation
+MARKER = '.synthetic.json'
+
+# Statements of a method body beyond the minimal ones, as (min, max)
+STATEMENTS = (3, 12)
+
+
+class Module:
+    '''A class of the repository, with the indices of the modules it depends on.'''
+
+    def __init__(self, index, package, deps, loc):
+        self.index = index
+        self.package = package
+        self.deps = deps
+        # Target LoC, including both files of a C or C++ module
+        self.loc = loc
+        self.name = f'C{index}'
+
+
+class Java:
+
+    def path(self, module):
+        return f'src/main/java/synth/p{module.package}/{module.name}.java'
+
+    def statement(self, statement):
+        kind, a, b = statement
+        if kind == 'call':
+            return f'y = y + this.f{a}.m0(y);'
+        if kind == 'self':
+            return f'y = this.m{a}(y) - {b};'
+        return f'y = y {a} {b};'
+
+    def render(self, module, modules, methods):
+        lines = [f'package synth.p{module.package};', '']
+        for dep in module.deps:
+            lines.append(f'import synth.p{modules[dep].package}.{modules[dep].name};')
+        lines += ['', f'public class {module.name} {{']
+        for i, dep in enumerate(module.deps):
+            lines.append(f'    private {modules[dep].name} f{i} = new {modules[dep].name}();')
+        for i, body in enumerate(methods):
+            lines += ['', f'    public int m{i}(int x) {{', '        int y = x;']
+            lines += [f'        {self.statement(statement)}' for statement in body]
+            lines += ['        return y;', '    }']
+        lines.append('}')
+        return {self.path(module): lines}
+
+
+class Cpp:
+
+    def path(self, module, extension='.h'):
+        return f'src/p{module.package}/{module.name.lower()}{extension}'
+
+    def statement(self, statement):
+        kind, a, b = statement
+        if kind == 'call':
+            return f'y = y + f{a}.m0(y);'
+        if kind == 'self':
+            return f'y = m{a}(y) - {b};'
+        return f'y = y {a} {b};'
+
+    def render(self, module, modules, methods):
+        header = ['#pragma once', '']
+        for dep in module.deps:
+            header.append(f'#include "../p{modules[dep].package}/{modules[dep].name.lower()}.h"')
+        header += ['', f'class {module.name} {{', 'public:']
+        for i, dep in enumerate(module.deps):
+            header.append(f'    {modules[dep].name} f{i};')
+        header += [f'    int m{i}(int x);' for i in range(len(methods))]
+        header.append('};')
+        source = [f'#include "{module.name.lower()}.h"']
+        for i, body in enumerate(methods):
+            source += ['', f'int {module.name}::m{i}(int x) {{', '    int y = x;']
+            source += [f'    {self.statement(statement)}' for statement in body]
+            source += ['    return y;', '}']
+        return {self.path(module): header, self.path(module, '.cpp'): source}
+
+
+class C:
+
+    def path(self, module, extension='.h'):
+        return f'src/p{module.package}/{module.name.lower()}{extension}'
+
+    def statement(self, module, modules, statement):
+        kind, a, b = statement
+        if kind == 'call':
+            return f'y = y + {modules[module.deps[a]].name.lower()}_m0(&self->f{a}, y);'
+        if kind == 'self':
+            return f'y = {module.name.lower()}_m{a}(self, y) - {b};'
+        return f'y = y {a} {b};'
+
+    def render(self, module, modules, methods):
+        guard = f'SYNTH_{module.name}_H'
+        header = [f'#ifndef {guard}', f'#define {guard}', '']
+        for dep in module.deps:
+            header.append(f'#include "../p{modules[dep].package}/{modules[dep].name.lower()}.h"')
+        header += ['', f'struct {module.name} {{']
+        for i, dep in enumerate(module.deps):
+            header.append(f'    struct {modules[dep].name} f{i};')
+        # A struct needs at least one member
+        if len(module.deps) == 0:
+            header.append('    int f;')
+        header.append('};')
+        header += [f'int {module.name.lower()}_m{i}(struct {module.name} *self, int x);' for i in range(len(methods))]
+        header += ['', '#endif']
+        source = [f'#include "{module.name.lower()}.h"']
+        for i, body in enumerate(methods):
+            source += ['', f'int {module.name.lower()}_m{i}(struct {module.name} *self, int x) {{', '    int y = x;']
+            source += [f'    {self.statement(module, modules, statement)}' for statement in body]
+            source += ['    return y;', '}']
+        return {self.path(module): header, self.path(module, '.c'): source}
+
+
+class Python:
+
+    def path(self, module):
+        return f'synth/p{module.package}/{module.name.lower()}.py'
+
+    def statement(self, statement):
+        kind, a, b = statement
+        if kind == 'call':
+            return f'y = y + self.f{a}.m0(y)'
+        if kind == 'self':
+            return f'y = self.m{a}(y) - {b}'
+        return f'y = y {a} {b}'
+
+    def render(self, module, modules, methods):
+        lines = []
+        for dep in module.deps:
+            lines.append(f'from synth.p{modules[dep].package}.{modules[dep].name.lower()} import {modules[dep].name}')
+        lines += ['', '', f'class {module.name}:', '    def __init__(self):']
+        lines += [f'        self.f{i} = {modules[dep].name}()' for i, dep in enumerate(module.deps)]
+        if len(module.deps) == 0:
+            lines.append('        self.f = 0')
+        for i, body in enumerate(methods):
+            lines += ['', f'    def m{i}(self, x):', '        y = x']
+            lines += [f'        {self.statement(statement)}' for statement in body]
+            lines.append('        return y')
+        return {self.path(module): lines}
+
+
+class TypeScript:
+
+    def path(self, module):
+        return f'src/p{module.package}/{module.name.lower()}.ts'
+
+    def statement(self, statement):
+        kind, a, b = statement
+        if kind == 'call':
+            return f'y = y + this.f{a}.m0(y);'
+        if kind == 'self':
+            return f'y = this.m{a}(y) - {b};'
+        return f'y = y {a} {b};'
+
+    def render(self, module, modules, methods):
+        lines = []
+        for dep in module.deps:
+            lines.append(f"import {{ {modules[dep].name} }} from '../p{modules[dep].package}/{modules[dep].name.lower()}';")
+        lines += ['', f'export class {module.name} {{']
+        for i, dep in enumerate(module.deps):
+            lines.append(f'    private f{i}: {modules[dep].name} = new {modules[dep].name}();')
+        for i, body in enumerate(methods):
+            lines += ['', f'    m{i}(x: number): number {{', '        let y = x;']
+            lines += [f'        {self.statement(statement)}' for statement in body]
+            lines += ['        return y;', '    }']
+        lines.append('}')
+        return {self.path(module): lines}
+
+
+LANGUAGES = {
+    'java': Java(),
+    'cpp': Cpp(),
+    'c': C(),
+    'python': Python(),
+    'ts': TypeScript(),
+}
+
+
+def code_lines(files):
+    return sum(1 for lines in files.values() for line in lines if line.strip() != '')
+
+
+def plan(loc, files, density, rng):
+    '''Returns the `Module`s of a repository, see the module docstring.'''
+    packages = max(1, round(math.sqrt(files) / 2))
+    weights = [rng.lognormvariate(0, 0.5) for _ in range(files)]
+    total = sum(weights)
+    modules = []
+    # Every module so far, once more for each of its dependents, for preferential attachment
+    pool = []
+    for index in range(files):
+        wanted = min(index, _poisson(density, rng))
+        deps = set()
+        while len(deps) < wanted:
+            deps.add(rng.choice(pool))
+        pool += sorted(deps)
+        pool.append(index)
+        package = index * packages // files
+        modules.append(Module(index, package, sorted(deps), round(loc * weights[index] / total)))
+    return modules
+
+
+def _poisson(mean, rng):
+    # Knuth's method, means are small
+    limit, k, p = math.exp(-mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def methods_of(emitter, module, modules, rng):
+    '''Statements of every method, as many as it takes for `module` to reach its target LoC.'''
+    fixed = code_lines(emitter.render(module, modules, []))
+    # Lines of a method without statements
+    overhead = code_lines(emitter.render(module, modules, [[]])) - fixed
+    budget = module.loc - fixed
+    methods = []
+    while budget > 0 or len(methods) == 0:
+        count = rng.randint(*STATEMENTS)
+        # The rest goes to this method if it is too small for another one
+        if budget - overhead - count < overhead + STATEMENTS[0]:
+            count = max(1, budget - overhead)
+        body = []
+        for _ in range(count):
+            roll = rng.random()
+            if roll < 0.3 and len(module.deps) != 0:
+                body.append(('call', rng.randrange(len(module.deps)), None))
+            elif roll < 0.4 and len(methods) != 0:
+                body.append(('self', rng.randrange(len(methods)), rng.randint(1, 9)))
+            else:
+                body.append(('arith', rng.choice(['+', '-', '*', '^']), rng.randint(1, 99)))
+        methods.append(body)
+        budget -= overhead + count
+    return methods
+
+
+def generate(lang, path, loc, files=None, density=3, seed=0, commit=True):
+    '''
+    Write a synthetic repository of `lang` to `path`, replacing a previously
+    generated one. Returns its LoC, which is `loc` unless modules are too
+    small to hold their imports and fields.
+
+    Raises ValueError if `path` exists and was not generated.
+    '''
+    emitter = LANGUAGES[lang]
+    if files is None:
+        files = max(1, loc // 150)
+    if os.path.exists(path):
+        if not os.path.exists(os.path.join(path, MARKER)):
+            raise ValueError(f'{path} exists and is not a synthetic repository')
+        shutil.rmtree(path)
+
+    rng = random.Random(f'{lang}-{loc}-{files}-{density}-{seed}')
+    modules = plan(loc, files, density, rng)
+    total = 0
+    written = set()
+    for module in modules:
+        rendered = emitter.render(module, modules, methods_of(emitter, module, modules, rng))
+        total += code_lines(rendered)
+        for filepath, lines in rendered.items():
+            filepath = os.path.join(path, filepath)
+            directory = os.path.dirname(filepath)
+            if directory not in written:
+                os.makedirs(directory, exist_ok=True)
+                written.add(directory)
+                if lang == 'python':
+                    open(os.path.join(directory, '__init__.py'), 'w').close()
+            with open(filepath, 'w', encoding='utf-8', newline='\n') as f:
+                f.write('\n'.join(lines) + '\n')
+    if lang == 'python':
+        open(os.path.join(path, 'synth', '__init__.py'), 'w').close()
+
+    with open(os.path.join(path, MARKER), 'w', encoding='utf-8', newline='\n') as f:
+        json.dump({'lang': lang, 'loc': loc, 'files': files, 'density': density, 'seed': seed, 'actual': total},
+                  f, indent=2, sort_keys=True)
+        f.write('\n')
+    if commit:
+        _commit(path)
+    return total
+
+
+def _commit(path):
+    # A fixed identity and date, so that the commit hash only depends on the content
+    env = dict(os.environ, GIT_AUTHOR_NAME='synth', GIT_AUTHOR_EMAIL='synth@localhost',
+               GIT_COMMITTER_NAME='synth', GIT_COMMITTER_EMAIL='synth@localhost',
+               GIT_AUTHOR_DATE='2000-01-01T00:00:00+0000', GIT_COMMITTER_DATE='2000-01-01T00:00:00+0000')
+    try:
+        for args in [['init', '-q'], ['add', '-A'], ['commit', '-q', '--no-gpg-sign', '-m', 'Synthetic repository']]:
+            subprocess.run(['git', '-C', path] + args, env=env, check=True, stdout=subprocess.DEVNULL)
+    except (EnvironmentError, subprocess.CalledProcessError):
+        logging.warning(f'Can not commit {path}, it is left as plain files')
+
+
+def project_name(lang, loc, seed):
+    return f'synthetic-{lang}-{loc}-s{seed}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('lang', help='Specify the language', choices=list(LANGUAGES))
+    parser.add_argument('--loc', help='Specify the LoC of each repository', type=int, nargs='+', required=True)
+    parser.add_argument('--files', help='Specify the number of modules, LoC / 150 by default', type=int)
+    parser.add_argument('--density', help='Specify the mean number of dependencies of a module', type=float,
+                        default=3)
+    parser.add_argument('--seed', help='Specify the seed', type=int, default=0)
+    parser.add_argument('--repo-dir', help='Specify the directory to write repositories to', default='./repo')
+    parser.add_argument('--list', help='Specify the project list to write, for do.py\'s --list',
+                        default='./lists/{lang} project list synthetic.csv')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rows = []
+    for loc in args.loc:
+        name = project_name(args.lang, loc, args.seed)
+        actual = generate(args.lang, os.path.join(args.repo_dir, name), loc, args.files, args.density, args.seed)
+        logging.info(f'Generated {name} with {actual} LoC')
+        # Same layout as the lists of real projects, the url is never used since the repository exists
+        rows.append([f'synthetic/{name}', 0, '', f'synthetic://{name}'])
+    list_path = args.list.format(lang=args.lang)
+    with open(list_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['project name', 'stars', 'github url', 'clone url'])
+        writer.writerows(rows)
+    logging.info(f'Project list written to {list_path}')
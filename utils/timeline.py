@@ -0,0 +1,109 @@
+'''
+Memory over time of a tool run.
+
+The sampler records every sample it takes, not only the peak, so that
+the shape of the curve (e.g. ENRE-python growing until it is killed) can
+be looked at after the run. Samples are kept in `array`s as deltas from the
+previous one: times in ms since the start of the run, memory in kB. RSS
+changes little between samples, so deltas are small and compress well,
+and a run of an hour sampled every 10ms still fits in a few MB.
+
+A `Timeline` has two series, 'rss' sampled on every tick and 'pss' only
+when the sampler reads it (close to the peak, see `utils.sampler`).
+'''
+
+import zlib
+import itertools
+from array import array
+
+
+class Series:
+    '''A delta-encoded series of (ms, kB) integer points.'''
+
+    def __init__(self):
+        self._times = array('q')
+        self._values = array('q')
+        self._last = (0, 0)
+
+    def __len__(self):
+        return len(self._times)
+
+    def append(self, ms, kb):
+        last_ms, last_kb = self._last
+        self._times.append(ms - last_ms)
+        self._values.append(kb - last_kb)
+        self._last = (ms, kb)
+
+    def points(self):
+        '''Returns the points as (times in s, values in MB) lists.'''
+        times = [ms / 1000 for ms in itertools.accumulate(self._times)]
+        values = [kb / 1024 for kb in itertools.accumulate(self._values)]
+        return times, values
+
+    def encode(self):
+        '''Returns the series as compressed bytes, see `decode`.'''
+        return zlib.compress(self._times.tobytes() + self._values.tobytes())
+
+    @classmethod
+    def decode(cls, data):
+        series = cls()
+        if data is None:
+            return series
+        deltas = array('q')
+        deltas.frombytes(zlib.decompress(data))
+        half = len(deltas) // 2
+        series._times = deltas[:half]
+        series._values = deltas[half:]
+        if half != 0:
+            series._last = (sum(series._times), sum(series._values))
+        return series
+
+
+class Timeline:
+    '''RSS and PSS of a process tree over time, recorded by a sampler.'''
+
+    def __init__(self, rss=None, pss=None):
+        self.rss = rss if rss is not None else Series()
+        self.pss = pss if pss is not None else Series()
+
+    def add(self, seconds, rss=None, pss=None):
+        '''Record a sample taken `seconds` after the start, memory in kB.'''
+        ms = round(seconds * 1000)
+        if rss is not None:
+            self.rss.append(ms, rss)
+        if pss is not None:
+            self.pss.append(ms, pss)
+
+    def rows(self):
+        '''Returns (seconds, series, MB) rows sorted by time.'''
+        rows = []
+        for name, series in [('rss', self.rss), ('pss', self.pss)]:
+            rows += [(time, name, value) for time, value in zip(*series.points())]
+        return sorted(rows)
+
+    def write_csv(self, filepath):
+        with open(filepath, 'w') as f:
+            f.write('time,series,memory\n')
+            for time, name, value in self.rows():
+                f.write(f'{time:.3f},{name},{value:.3f}\n')
+
+    def plot(self, filepath, title=None):
+        '''Draw memory over time into `filepath`, needs matplotlib.'''
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(8, 4))
+        for name, series in [('RSS', self.rss), ('PSS', self.pss)]:
+            if len(series) != 0:
+                times, values = series.points()
+                ax.step(times, values, where='post', label=name, marker='.' if name == 'PSS' else None,
+                        linestyle='-' if name == 'RSS' else 'none')
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Memory (MB)')
+        if title is not None:
+            ax.set_title(title)
+        ax.legend()
+        fig.tight_layout()
+        fig.savefig(filepath)
+        plt.close(fig)